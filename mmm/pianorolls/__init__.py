@@ -0,0 +1,11 @@
+import importlib
+
+# Submodules are imported on first access, so that importing the package does not pull networkx, mido or matplotlib
+SUBMODULES = ['algorithms', 'dictionaries', 'graphs', 'midi', 'morphology', 'music', 'musicxml', 'parameters', 'plot',
+              'score', 'score_tree', 'utils']
+
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
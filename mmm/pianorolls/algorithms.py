@@ -4,7 +4,6 @@ import logging
 from multimethod import multimethod
 from typing import List
 import numpy as np
-import networkx as nx
 from mmm.pianorolls.graphs import DerivedActivationsGraph
 from mmm.pianorolls.music import PianoRoll, PianoRollStack, Activations, Texture, ActivationsStack, TimeFrequency
 from mmm.pianorolls.morphology import erosion
@@ -91,7 +90,7 @@ def concatenate_path(path: list):
 
 def find_minimal_activations(activations_graph: DerivedActivationsGraph,
                              derivation_order=None, verbose=False, folder_save=None,
-                             load=False, sparse=True, max_shortest_paths=10):
+                             load=False, sparse=True, max_shortest_paths=10, lazy=False):
     # Compute order of derivation
     if derivation_order is None:
         texture_length = (activations_graph.texture.extension.end - activations_graph.texture.extension.start)
@@ -106,20 +105,37 @@ def find_minimal_activations(activations_graph: DerivedActivationsGraph,
     if verbose:
         logging.info('Number of derivatives: %d' % derivation_order)
 
+    if lazy:
+        # Search the derivative without building it
+        assert sparse, 'The lazy search always removes inconsistent nodes'
+        start = time.time()
+        shortest_paths = activations_graph.lazy_shortest_paths(derivation_order, max_shortest_paths)
+        if len(shortest_paths) == 0:
+            logging.info('No path found')
+        else:
+            if len(shortest_paths) == max_shortest_paths:
+                logging.info('Maximum number of shortest paths reached.')
+            logging.info('Time to find shortest paths: %.3f' % (time.time() - start))
+            logging.info('Number of shortest paths: %d' % len(shortest_paths))
+
+        activation_stacks = activation_stacks_from_paths(shortest_paths, activations_graph.texture)
+
+        return shortest_paths, activation_stacks, activations_graph
+
     derived_graph = activations_graph
 
     # Save graph
     if folder_save is not None:
-        file_name = 'derivative_graph-0.gpickle'
-        nx.write_gpickle(derived_graph, folder_save / file_name)
+        file_name = 'derivative_graph-0.npz'
+        derived_graph.save(folder_save / file_name)
 
     # Try to load last derived graph
     last_loaded = False
     if load and folder_save is not None:
         start_load = time.time()
-        file_name = 'derivative_graph-%d.gpickle' % derivation_order
+        file_name = 'derivative_graph-%d.npz' % derivation_order
         if os.path.isfile(folder_save / file_name):
-            derived_graph = nx.read_gpickle(folder_save / file_name)
+            derived_graph = activations_graph.load(folder_save / file_name)
             last_loaded = True
         if last_loaded and verbose:
             logging.info('Time to load graph: %.3f s' % (time.time() - start_load))
@@ -129,13 +145,13 @@ def find_minimal_activations(activations_graph: DerivedActivationsGraph,
         for k in range(derivation_order):
             if verbose:
                 logging.info('Computing derivative %d...' % (k + 1))
-            file_name = 'derivative_graph-%d.gpickle' % (k + 1)
+            file_name = 'derivative_graph-%d.npz' % (k + 1)
 
             # Try to load graph
             if load and folder_save is not None:
                 start_load = time.time()
                 try:
-                    derived_graph = nx.read_gpickle(folder_save / file_name)
+                    derived_graph = activations_graph.load(folder_save / file_name)
                     logging.info('Time to load graph: %.3f' % (time.time() - start_load))
                     continue
                 except FileNotFoundError:
@@ -148,7 +164,7 @@ def find_minimal_activations(activations_graph: DerivedActivationsGraph,
 
             # Save graph
             if folder_save is not None:
-                nx.write_gpickle(derived_graph, folder_save / file_name)
+                derived_graph.save(folder_save / file_name)
 
         if verbose:
             logging.info('Time to derive graph: %.3f s' % (time.time() - start_all))
@@ -177,29 +193,26 @@ def find_minimal_activations(activations_graph: DerivedActivationsGraph,
 
     # Save graph
     if folder_save is not None:
-        file_name = 'pruned_weighted_graph-%d.gpickle' % derivation_order
-        nx.write_gpickle(derived_graph, folder_save / file_name)
+        file_name = 'pruned_weighted_graph-%d.npz' % derivation_order
+        derived_graph.save(folder_save / file_name)
 
     # Find the shortest paths
     start = time.time()
-    try:
-        # All shortest paths
-        shortest_paths = []
-        shortest_paths_generator = nx.all_shortest_paths(derived_graph, derived_graph.start, derived_graph.end,
-                                                         weight='weight')
-        n = 0
-        for shortest_path in shortest_paths_generator:
-            shortest_paths.append(shortest_path)
-            n += 1
-            if n == max_shortest_paths:
-                logging.info('Maximum number of shortest paths reached.')
-                break
+    shortest_paths = derived_graph.shortest_paths(max_shortest_paths)
+    if len(shortest_paths) == 0:
+        logging.info('No path found')
+    else:
+        if len(shortest_paths) == max_shortest_paths:
+            logging.info('Maximum number of shortest paths reached.')
         logging.info('Time to find shortest paths: %.3f' % (time.time() - start))
         logging.info('Number of shortest paths: %d' % len(shortest_paths))
-    except nx.NetworkXNoPath:
-        shortest_paths = []
-        logging.info('No path found')
 
+    activation_stacks = activation_stacks_from_paths(shortest_paths, derived_graph.texture)
+
+    return shortest_paths, activation_stacks, derived_graph
+
+
+def activation_stacks_from_paths(shortest_paths: List[list], texture: Texture):
     # Concatenate paths
     concatenated_paths = []
     for shortest_path in shortest_paths:
@@ -209,10 +222,10 @@ def find_minimal_activations(activations_graph: DerivedActivationsGraph,
     activation_stacks = []
     for path in concatenated_paths:
         activations_list = []
-        for i in range(len(derived_graph.texture)):
+        for i in range(len(texture)):
             activations = [TimeFrequency(activation.t_a, activation.xi) for activation in path if activation.i == i]
             activations_list.append(Activations(*activations))
         activation_stack = ActivationsStack(*activations_list)
         activation_stacks.append(activation_stack)
 
-    return shortest_paths, activation_stacks, derived_graph
+    return activation_stacks
@@ -1,9 +1,17 @@
+import os
+import tempfile
+import numpy as np
 import networkx as nx
+from copy import copy
+from pathlib import Path
+from typing import List
 from multimethod import multimethod
 from .music import PianoRoll, Texture, Rhythm, TimePoint, FrequencyPoint, ActivationsStack, Activations, Harmony, \
     RomanNumeral
 from .dictionaries import chord_to_roman_numeral_dict
 
+CHECKPOINT_VERSION = 1
+
 
 class ActivationNode:
     def __init__(self, t_p: TimePoint, t_a: TimePoint, xi: FrequencyPoint, i: int):
@@ -212,113 +220,370 @@ class ActivationsGraph(Graph):
                     self.clusters.pop(-1)
 
 
-class DerivedActivationsGraph(Graph):
+def count_distinct(codes: np.ndarray):
+    # Number of distinct values in each row
+    sorted_codes = np.sort(codes, axis=1)
+    return 1 + np.count_nonzero(np.diff(sorted_codes, axis=1), axis=1)
+
+
+def unique_rows(digits: np.ndarray, radices: np.ndarray):
+    # Index of the first occurrence of each distinct row, in lexicographic order, and the inverse mapping
+    if np.sum(np.log2(np.maximum(radices, 1))) < 63:
+        keys = np.zeros(digits.shape[0], dtype=np.int64)
+        for j in range(digits.shape[1]):
+            keys = keys * int(radices[j]) + digits[:, j]
+        _, index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        return index, inverse.reshape(-1)
+
+    order = np.lexsort(digits.T[::-1])
+    sorted_digits = digits[order]
+    change = np.concatenate(([True], np.any(sorted_digits[1:] != sorted_digits[:-1], axis=1)))
+    inverse = np.empty(digits.shape[0], dtype=np.int64)
+    inverse[order] = np.cumsum(change) - 1
+    return order[change], inverse
+
+
+class DerivedActivationsGraph:
     @multimethod
     def __init__(self, piano_roll: PianoRoll, texture: Texture):
-        super().__init__()
-
         self.texture = texture
         self.piano_roll = piano_roll
 
-        self.clusters = []
+        # Activations of the base graph, times and activations being replaced by integer codes
+        self.base_nodes: List[DerivedActivationNode] = []
+        self.base_cluster = np.zeros(0, dtype=np.int32)
+        self.base_index = np.zeros(0, dtype=np.int32)
+        self.base_time = np.zeros(0, dtype=np.int32)
+        self.base_scope = np.zeros(0, dtype=np.int32)
+        self.base_activation = np.zeros(0, dtype=np.int32)
+        self.n_clusters = 0
+
+        # Nodes of order k are paths of k + 1 base activations, edges are stored in CSR format
+        self.paths = np.zeros((0, 1), dtype=np.int32)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+
+        self.weights = None
+        self.start_weights = None
 
         self.start = None
         self.end = None
 
     @multimethod
     def __init__(self, graph: ActivationsGraph):
-        super().__init__()
         self.__init__(graph.piano_roll, graph.texture)
 
-        previous_cluster = []
-        for cluster in graph.clusters:
-            self.clusters.append([])
-
-            # Add nodes
-            for node in cluster:
-                u = (DerivedActivationNode(node.t_p, node.t_a, node.xi, node.i, len(self.clusters) - 1), )
-                self.add_node(u)
-                self.clusters[-1].append(u)
+        duration = self.texture.extension.duration
+        time_codes = {}
+        activation_codes = {}
+        cluster, index, times, scopes, activations = [], [], [], [], []
+        for c, nodes in enumerate(graph.clusters):
+            for node in nodes:
+                t_scope = node.t_p - duration
+                self.base_nodes.append(DerivedActivationNode(node.t_p, node.t_a, node.xi, node.i, c))
+                cluster.append(c)
+                index.append(node.i)
+                times.append(time_codes.setdefault(node.t_a.value, len(time_codes)))
+                scopes.append(time_codes.setdefault(t_scope.value, len(time_codes)))
+                activations.append(activation_codes.setdefault((node.t_a.value, node.xi.value, node.i),
+                                                               len(activation_codes)))
+
+        self.base_cluster = np.array(cluster, dtype=np.int32)
+        self.base_index = np.array(index, dtype=np.int32)
+        self.base_time = np.array(times, dtype=np.int32)
+        self.base_scope = np.array(scopes, dtype=np.int32)
+        self.base_activation = np.array(activations, dtype=np.int32)
+        self.n_clusters = len(graph.clusters)
+
+        # Every activation is linked to all the activations of the next cluster
+        sizes = np.bincount(self.base_cluster, minlength=self.n_clusters)
+        offsets = np.concatenate(([0], np.cumsum(sizes)))
+        degree = np.append(sizes[1:], 0)[self.base_cluster]
+        self.paths = np.arange(len(self.base_nodes), dtype=np.int32).reshape(-1, 1)
+        self.indptr = np.concatenate(([0], np.cumsum(degree)))
+        self.indices = (np.repeat(offsets[self.base_cluster + 1] - self.indptr[:-1], degree) +
+                        np.arange(self.indptr[-1])).astype(np.int32)
 
-                # Set scope
-                self.nodes[u]['t_scope'] = node.t_p - self.texture.extension.duration
+    def __str__(self):
+        return '%s with %d nodes and %d edges' % (type(self).__name__, self.number_of_nodes(),
+                                                 self.number_of_edges())
 
-            # Add edges
-            for u in previous_cluster:
-                for v in self.clusters[-1]:
-                    self.add_edge(u, v)
+    @property
+    def order(self):
+        return self.paths.shape[1] - 1
 
-            previous_cluster = self.clusters[-1]
+    @property
+    def node_clusters(self):
+        return self.base_cluster[self.paths[:, 0]]
 
-    def add_start_end_nodes(self):
-        # Add start node
-        self.start = 'S'
-        self.add_node(self.start)
-        for node in self.clusters[0]:
-            self.add_edge(self.start, node)
+    @property
+    def clusters(self):
+        node_clusters = self.node_clusters
+        return [np.flatnonzero(node_clusters == c) for c in range(self.n_clusters - self.order)]
+
+    def number_of_nodes(self):
+        if self.start is None:
+            return self.paths.shape[0]
+        return self.paths.shape[0] + 2
+
+    def number_of_edges(self):
+        if self.start is None:
+            return self.indices.size
+        clusters = self.clusters
+        return self.indices.size + (clusters[0].size + clusters[-1].size if len(clusters) != 0 else 0)
+
+    def node(self, k: int):
+        return tuple(self.base_nodes[j] for j in self.paths[k])
+
+    def edge_sources(self):
+        return np.repeat(np.arange(self.paths.shape[0], dtype=np.int32), np.diff(self.indptr))
+
+    def derive(self):
+        # Line graph: the edges (u, v) become the nodes, linked to the edges (v, w)
+        sources = self.edge_sources()
+        degree = np.diff(self.indptr)[self.indices]
+
+        derived_graph = copy(self)
+        derived_graph.paths = np.concatenate((self.paths[sources], self.paths[self.indices, -1:]), axis=1)
+        derived_graph.indptr = np.concatenate(([0], np.cumsum(degree)))
+        derived_graph.indices = (np.repeat(self.indptr[self.indices] - derived_graph.indptr[:-1], degree) +
+                                 np.arange(derived_graph.indptr[-1])).astype(np.int32)
+        derived_graph.weights = None
+        derived_graph.start_weights = None
+        derived_graph.start = None
+        derived_graph.end = None
 
-        # Add end node
-        self.end = 'E'
-        self.add_node(self.end)
-        for node in self.clusters[-1]:
-            self.add_edge(node, self.end)
+        return derived_graph
 
-    def derive(self, make_clusters=True, placement=0.5):
-        derived_graph = DerivedActivationsGraph(self.piano_roll, self.texture)
+    def consistent(self, paths: np.ndarray):
+        # The activations at the scope of a node must belong to all the rhythms of the texture or to none
+        on_scope = self.base_time[paths] == self.base_scope[paths[:, -1:]]
+        indexes = self.base_index[paths]
+        n_indexes = np.zeros(paths.shape[0], dtype=np.int64)
+        for i in range(len(self.texture)):
+            n_indexes += np.any(np.logical_and(on_scope, indexes == i), axis=1)
+        return np.logical_or(n_indexes == len(self.texture), n_indexes == 0)
+
+    def path_weights(self, paths: np.ndarray, last: np.ndarray):
+        # Weight of the edge from a node to the node ending with the activation last, which is the only new one
+        new_activations = ~np.any(self.base_activation[paths] == self.base_activation[last][:, None], axis=1)
+        new_times = ~np.any(self.base_time[paths] == self.base_time[last][:, None], axis=1)
+        return new_activations.astype(np.int64) + new_times
+
+    def start_weights_of(self, paths: np.ndarray):
+        # From the start node, all the activations are new
+        return count_distinct(self.base_activation[paths]) + count_distinct(self.base_time[paths])
 
-        if make_clusters:
-            for _ in range(len(self.clusters) - 1):
-                derived_graph.clusters.append([])
+    def remove_inconsistent_nodes(self):
+        keep = self.consistent(self.paths)
 
-        # Add nodes
-        for edge in self.edges:
-            u = *edge[0], edge[1][-1]
-            derived_graph.add_node(u)
-            derived_graph.nodes[u]['t_scope'] = self.nodes[edge[1]]['t_scope']
+        # Renumber nodes and edges
+        ids = np.cumsum(keep) - 1
+        sources = self.edge_sources()
+        kept_edges = np.logical_and(keep[sources], keep[self.indices])
+        self.paths = self.paths[keep]
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(ids[sources[kept_edges]],
+                                                                 minlength=self.paths.shape[0]))))
+        self.indices = ids[self.indices[kept_edges]].astype(np.int32)
 
-            if make_clusters:
-                derived_graph.clusters[u[0].cluster].append(u)
+    def add_start_end_nodes(self):
+        # Start and end nodes are linked to the first and last clusters
+        self.start = 'S'
+        self.end = 'E'
 
-            # Add edges
-            for outgoing_edge in self.edges(edge[1]):
-                v = *outgoing_edge[0], outgoing_edge[1][-1]
-                derived_graph.add_edge(u, v)
+    def weight_graph(self):
+        self.weights = self.path_weights(self.paths[self.edge_sources()], self.paths[self.indices, -1])
+        self.start_weights = self.start_weights_of(self.paths)
+
+    def shortest_paths(self, max_paths=None):
+        clusters = self.clusters
+        if len(clusters) == 0 or clusters[0].size == 0 or clusters[-1].size == 0:
+            return []
+
+        # Edges only link consecutive clusters, which are relaxed in order
+        sources = self.edge_sources()
+        edge_clusters = self.node_clusters[sources]
+        bounds = np.searchsorted(edge_clusters, np.arange(len(clusters) + 1))
+        distance = np.full(self.paths.shape[0], np.inf)
+        distance[clusters[0]] = self.start_weights[clusters[0]]
+        for c in range(len(clusters) - 1):
+            edges = slice(bounds[c], bounds[c + 1])
+            np.minimum.at(distance, self.indices[edges], distance[sources[edges]] + self.weights[edges])
+
+        best = np.min(distance[clusters[-1]])
+        if np.isinf(best):
+            return []
+
+        # Predecessors along the shortest paths
+        tight = distance[sources] + self.weights == distance[self.indices]
+        order = np.argsort(self.indices[tight], kind='stable')
+        predecessors = sources[tight][order]
+        predecessors_indptr = np.concatenate(([0], np.cumsum(np.bincount(self.indices[tight],
+                                                                           minlength=self.paths.shape[0]))))
+        first = np.zeros(self.paths.shape[0], dtype=bool)
+        first[clusters[0]] = True
+
+        # Enumerate the paths backwards from the end node
+        shortest_paths = []
+        stack = [[node] for node in clusters[-1][distance[clusters[-1]] == best][::-1]]
+        while len(stack) != 0:
+            path = stack.pop()
+            node = path[-1]
+            if first[node]:
+                shortest_paths.append([self.start] + [self.node(k) for k in path[::-1]] + [self.end])
+                if len(shortest_paths) == max_paths:
+                    break
+                continue
+            for previous in predecessors[predecessors_indptr[node]: predecessors_indptr[node + 1]][::-1]:
+                stack.append(path + [previous])
+
+        return shortest_paths
+
+    def lazy_shortest_paths(self, order: int, max_paths=None):
+        # Shortest paths of the pruned and weighted derivative of the given order, without building it: its nodes
+        # are the windows of one activation per cluster, explored one window position at a time
+        assert self.order == 0, 'The lazy search starts from the graph of order 0'
+
+        n_layers = self.n_clusters - order
+        if n_layers <= 0:
+            return []
+        sizes = np.bincount(self.base_cluster, minlength=self.n_clusters)
+        offsets = np.concatenate(([0], np.cumsum(sizes)))
+
+        # First window
+        grids = np.meshgrid(*[np.arange(offsets[c], offsets[c + 1]) for c in range(order + 1)], indexing='ij')
+        states = np.stack([grid.reshape(-1) for grid in grids], axis=1).astype(np.int32)
+        states = states[self.consistent(states)]
+        distance = self.start_weights_of(states).astype(float)
+        layers = [(states, None, None)]
+
+        # Slide the window, keeping the tight predecessors of each state
+        for c in range(1, n_layers):
+            if states.shape[0] == 0:
+                return []
+            new_nodes = np.arange(offsets[c + order], offsets[c + order + 1], dtype=np.int32)
+            sources = np.repeat(np.arange(states.shape[0]), new_nodes.size)
+            candidates = np.concatenate((states[sources, 1:], np.tile(new_nodes, states.shape[0])[:, None]), axis=1)
+            keep = self.consistent(candidates)
+            sources = sources[keep]
+            candidates = candidates[keep]
+            cost = distance[sources] + self.path_weights(states[sources], candidates[:, -1])
+
+            # Windows hold one activation per cluster, so they are digits in the cluster sizes
+            index, inverse = unique_rows(candidates - offsets[c: c + order + 1], sizes[c: c + order + 1])
+            states = candidates[index]
+            distance = np.full(states.shape[0], np.inf)
+            np.minimum.at(distance, inverse, cost)
+
+            tight = cost == distance[inverse]
+            predecessors = sources[tight][np.argsort(inverse[tight], kind='stable')]
+            predecessors_indptr = np.concatenate(([0], np.cumsum(np.bincount(inverse[tight],
+                                                                               minlength=states.shape[0]))))
+            layers.append((states, predecessors, predecessors_indptr))
+
+        if states.shape[0] == 0:
+            return []
+        best = np.min(distance)
+
+        # Enumerate the paths backwards from the end node
+        shortest_paths = []
+        stack = [[k] for k in np.flatnonzero(distance == best)[::-1]]
+        while len(stack) != 0:
+            path = stack.pop()
+            layer = n_layers - len(path)
+            if layer == 0:
+                nodes = [tuple(self.base_nodes[j] for j in layers[n][0][k]) for n, k in enumerate(path[::-1])]
+                shortest_paths.append(['S'] + nodes + ['E'])
+                if len(shortest_paths) == max_paths:
+                    break
+                continue
+            _, predecessors, predecessors_indptr = layers[layer]
+            k = path[-1]
+            for previous in predecessors[predecessors_indptr[k]: predecessors_indptr[k + 1]][::-1]:
+                stack.append(path + [previous])
+
+        return shortest_paths
+
+    def save(self, path):
+        # Only the integer arrays are saved, the base nodes being those of the graph the checkpoint is loaded into
+        arrays = {'version': np.array(CHECKPOINT_VERSION),
+                  'base_cluster': self.base_cluster,
+                  'base_activation': self.base_activation,
+                  'base_time': self.base_time,
+                  'paths': self.paths,
+                  'indptr': self.indptr,
+                  'indices': self.indices}
+        if self.weights is not None:
+            arrays['weights'] = self.weights
+            arrays['start_weights'] = self.start_weights
+        if self.start is not None:
+            arrays['start_end'] = np.array([self.start, self.end])
+
+        # Write next to the checkpoint and rename, so that an interrupted save never leaves a truncated file
+        path = Path(path)
+        file = tempfile.NamedTemporaryFile(dir=path.parent, prefix=path.name + '.', suffix='.tmp', delete=False)
+        try:
+            with file:
+                np.savez(file, **arrays)
+            os.replace(file.name, path)
+        except BaseException:
+            os.remove(file.name)
+            raise
+
+    def load(self, path):
+        # Derivative saved from a graph with the same base activations
+        with np.load(path) as data:
+            version = int(data['version'])
+            if version != CHECKPOINT_VERSION:
+                raise ValueError('Checkpoint version %d is not supported (expected %d)' % (version, CHECKPOINT_VERSION))
+            for name in ['base_cluster', 'base_activation', 'base_time']:
+                if not np.array_equal(data[name], getattr(self, name)):
+                    raise ValueError('Checkpoint was saved from another graph')
+
+            derived_graph = copy(self)
+            derived_graph.paths = data['paths']
+            derived_graph.indptr = data['indptr']
+            derived_graph.indices = data['indices']
+            derived_graph.weights = data['weights'] if 'weights' in data else None
+            derived_graph.start_weights = data['start_weights'] if 'start_weights' in data else None
+            if 'start_end' in data:
+                derived_graph.start, derived_graph.end = data['start_end'].tolist()
+            else:
+                derived_graph.start, derived_graph.end = None, None
 
         return derived_graph
 
-    def remove_inconsistent_nodes(self):
-        nodes_to_remove = []
-        for node in self.nodes:
-            t_scope = self.nodes[node]['t_scope']
-            indexes = set()
-            for activation in node:
-                if activation.t_a == t_scope:
-                    indexes.add(activation.i)
-            if len(indexes) != len(self.texture) and len(indexes) != 0:
-                nodes_to_remove.append(node)
-
-        self.remove_nodes_from(nodes_to_remove)
-        for node in nodes_to_remove:
-            self.clusters[node[0].cluster].remove(node)
+    def to_networkx(self):
+        graph = nx.DiGraph()
 
-    def weight_graph(self):
-        for edge in self.edges:
-            u = edge[0]
-            v = edge[1]
-
-            if v == 'E':
-                new_activations = {}
-                new_time_a = {}
-            elif u == 'S':
-                new_activations = set([a.activation for a in v])
-                new_time_a = set([a.t_a for a in v])
-            else:
-                new_activations = set([a.activation for a in v]) - set([a.activation for a in u])
-                new_time_a = set([a.t_a for a in v]) - set([a.t_a for a in u])
+        duration = self.texture.extension.duration
+        nodes = [self.node(k) for k in range(self.paths.shape[0])]
+        for k, node in enumerate(nodes):
+            graph.add_node(node, t_scope=self.base_nodes[self.paths[k, -1]].t_p - duration)
 
-            weight = len(new_activations) + len(new_time_a)
-
-            self.edges[edge]['weight'] = weight
+        for e, (u, v) in enumerate(zip(self.edge_sources(), self.indices)):
+            if self.weights is None:
+                graph.add_edge(nodes[u], nodes[v])
+            else:
+                graph.add_edge(nodes[u], nodes[v], weight=self.weights[e])
+
+        if self.start is not None:
+            clusters = self.clusters
+            graph.add_node(self.start)
+            graph.add_node(self.end)
+            if len(clusters) != 0:
+                for k in clusters[0]:
+                    if self.start_weights is None:
+                        graph.add_edge(self.start, nodes[k])
+                    else:
+                        graph.add_edge(self.start, nodes[k], weight=self.start_weights[k])
+                for k in clusters[-1]:
+                    if self.weights is None:
+                        graph.add_edge(nodes[k], self.end)
+                    else:
+                        graph.add_edge(nodes[k], self.end, weight=0)
+
+        return graph
 
 
 class TonalGraph(nx.DiGraph):
@@ -1,4 +1,5 @@
 import numpy as np
+from typing import Tuple
 from multimethod import multimethod
 from numpy.ma.core import minimum
 
@@ -8,11 +9,42 @@ from .music import Activations, PianoRoll, PianoRollStack, TimeFrequency, Activa
 
 @multimethod
 def dilation(activations: Activations, structuring_element: PianoRoll):
-    result = PianoRoll()
-    for activation in activations:
-        shifted_piano_roll = structuring_element.copy()
-        shifted_piano_roll.shift(activation)
-        result += shifted_piano_roll
+    f_idx, t_idx = np.nonzero(activations.array)
+    if f_idx.size == 0:
+        return PianoRoll()
+
+    # Common tatum of the shifted copies
+    f_min = int(f_idx.min())
+    t_min = int(t_idx.min())
+    t_gcd = int(np.gcd.reduce(t_idx - t_min))
+    tatum = structuring_element.tatum.gcd(activations.tatum * t_gcd)
+    str_el = structuring_element.change_tatum(tatum).array
+
+    # Positions of the shifted copies in the result
+    if t_gcd == 0:
+        t_pos = np.zeros_like(t_idx)
+    else:
+        t_pos = (t_idx - t_min) // t_gcd * ((activations.tatum * t_gcd) // tatum)
+    f_pos = (f_idx - f_min) * (activations.step // structuring_element.step)
+
+    # Scatter every cell of the structuring element at once
+    array = np.zeros((int(f_pos.max()) + str_el.shape[0], int(t_pos.max()) + str_el.shape[1]), dtype=str_el.dtype)
+    if f_pos.size > array.size // 8:
+        hits = np.zeros((int(f_pos.max()) + 1, int(t_pos.max()) + 1), dtype=bool)
+        hits[f_pos, t_pos] = True
+        for i, j in zip(*np.nonzero(str_el)):
+            window = array[i: i + hits.shape[0], j: j + hits.shape[1]]
+            np.maximum(window, hits * str_el[i, j], out=window)
+    else:
+        for i, j in zip(*np.nonzero(str_el)):
+            np.maximum.at(array, (f_pos + i, t_pos + j), str_el[i, j])
+
+    origin = structuring_element.origin + TimeFrequency(activations.origin.time + t_min * activations.tatum,
+                                                        activations.origin.frequency + f_min * activations.step)
+    result = PianoRoll(array, origin, tatum, structuring_element.step)
+    if f_idx.size > 1:
+        result.reduce(inplace=True)
+
     return result
 
 
@@ -32,30 +64,109 @@ def dilation(activations_list: ActivationsStack, texture: Texture):
     return result
 
 
+def shift_bits(words: np.ndarray, shift: int):
+    # Bit n of the result is bit n + shift of the input, rows being little-endian bitsets
+    n_words = words.shape[-1]
+    word_shift, bit_shift = divmod(shift, 64)
+    padded = np.zeros((words.shape[0], 3 * n_words + 2), dtype=words.dtype)
+    padded[:, n_words + 1: 2 * n_words + 1] = words
+    low = padded[:, n_words + 1 + word_shift: 2 * n_words + 1 + word_shift]
+    if bit_shift == 0:
+        return np.copy(low)
+    high = padded[:, n_words + 2 + word_shift: 2 * n_words + 2 + word_shift]
+    return (low >> np.uint64(bit_shift)) | (high << np.uint64(64 - bit_shift))
+
+
+def pack_bits(array: np.ndarray):
+    n_words = (array.shape[-1] + 63) // 64
+    packed = np.packbits(array.astype(bool), axis=-1, bitorder='little')
+    padded = np.zeros((array.shape[0], n_words * 8), dtype=np.uint8)
+    padded[:, :packed.shape[-1]] = packed
+    return padded.view('<u8')
+
+
+def unpack_bits(words: np.ndarray, n: int):
+    return np.unpackbits(words.view(np.uint8), axis=-1, count=n, bitorder='little').astype(bool)
+
+
+def erosion_bounds(shape: Tuple[int, int], str_el_shape: Tuple[int, int], origin_frequency: int, origin_time: int):
+    # Output positions whose window lies inside the piano roll
+    m_start = max(0, origin_frequency)
+    m_end = min(shape[0] - str_el_shape[0] + 1, shape[0] - str_el_shape[0] + origin_frequency + 1)
+    n_start = max(0, origin_time)
+    n_end = min(shape[1] - str_el_shape[1] + 1, shape[1] - str_el_shape[1] + origin_time + 1)
+    return m_start, m_end, n_start, n_end
+
+
+def erosion_sliding(array: np.ndarray, str_el: np.ndarray, origin_frequency: int, origin_time: int):
+    eroded_array = np.zeros(array.shape, dtype=bool)
+
+    m_start, m_end, n_start, n_end = erosion_bounds(array.shape, str_el.shape, origin_frequency, origin_time)
+    if m_start >= m_end or n_start >= n_end:
+        return eroded_array
+
+    # Each cell of the structuring element requires at least its value (sustain or attack) in the shifted view
+    eroded_window = eroded_array[m_start: m_end, n_start: n_end]
+    eroded_window[:, :] = True
+    for i, j in zip(*np.nonzero(str_el > 0)):
+        view = array[m_start - origin_frequency + i: m_end - origin_frequency + i,
+                     n_start - origin_time + j: n_end - origin_time + j]
+        eroded_window &= view >= str_el[i, j]
+
+    return eroded_array
+
+
+def erosion_bitset(array: np.ndarray, str_el: np.ndarray, origin_frequency: int, origin_time: int):
+    array_n = array.shape[-1]
+    eroded_array = np.zeros(array.shape, dtype=bool)
+
+    m_start, m_end, n_start, n_end = erosion_bounds(array.shape, str_el.shape, origin_frequency, origin_time)
+    if m_start >= m_end or n_start >= n_end:
+        return eroded_array
+
+    valid = np.zeros((1, array_n), dtype=bool)
+    valid[0, n_start: n_end] = True
+    eroded_words = np.repeat(pack_bits(valid), m_end - m_start, axis=0)
+
+    # Intersection of the shifted rows, one per active cell of the structuring element
+    words = pack_bits(array)
+    for i, j in zip(*np.nonzero(str_el)):
+        rows = words[m_start - origin_frequency + i: m_end - origin_frequency + i]
+        eroded_words &= shift_bits(rows, j - origin_time)
+
+    eroded_array[m_start: m_end] = unpack_bits(eroded_words, array_n)
+
+    return eroded_array
+
+
 @multimethod
-def erosion(piano_roll: PianoRoll, structuring_element: PianoRoll, engine='numpy'):
+def erosion(piano_roll: PianoRoll, structuring_element: PianoRoll, engine='sliding'):
+    if engine not in ['sliding', 'numpy', 'torch', 'bitset']:
+        raise ValueError('Engine should be either "sliding", "numpy", "torch" or "bitset"')
+
+    # Tatum
+    if structuring_element.tatum != piano_roll.tatum and structuring_element.tatum != TimeShift(0):
+        new_tatum = piano_roll.tatum.gcd(structuring_element.tatum,
+                                         piano_roll.origin.time - structuring_element.origin.time)
+        piano_roll = piano_roll.change_tatum(new_tatum)
+        structuring_element = structuring_element.change_tatum(new_tatum)
+
+    # Origin
+    if structuring_element.frequency_nature == 'shift':
+        origin_frequency = - structuring_element.origin.frequency // structuring_element.step
+    else:
+        raise NotImplementedError
+
+    if structuring_element.time_nature == 'shift':
+        origin_time = - structuring_element.origin.time // structuring_element.tatum
+    else:
+        raise NotImplementedError
+
+    # Erosion
     if engine == 'torch':
         import torch
         from nnMorpho.binary_operators import erosion as binary_erosion
 
-        # Tatum
-        if structuring_element.tatum != piano_roll.tatum and structuring_element.tatum != TimeShift(0):
-            new_tatum = piano_roll.tatum.gcd(structuring_element.tatum,
-                                             piano_roll.origin.time - structuring_element.origin.time)
-            piano_roll = piano_roll.change_tatum(new_tatum)
-            structuring_element = structuring_element.change_tatum(new_tatum)
-
-        # Origin
-        if structuring_element.frequency_nature == 'shift':
-            origin_frequency = - structuring_element.origin.frequency // structuring_element.step
-        else:
-            raise NotImplementedError
-
-        if structuring_element.time_nature == 'shift':
-            origin_time = - structuring_element.origin.time // structuring_element.tatum
-        else:
-            raise NotImplementedError
-
         # To PyTorch tensors
         piano_roll_tensor = torch.from_numpy(piano_roll.array)
         str_el_tensor = torch.from_numpy(structuring_element.array)
@@ -65,34 +176,11 @@ def erosion(piano_roll: PianoRoll, structuring_element: PianoRoll, engine='numpy
 
         # To numpy array
         eroded_array = eroded_tensor.numpy()
-
-        # To Activations
-        f, t = np.where(eroded_array)
-        activations = Activations(*[TimeFrequency(
-            piano_roll.origin.time + t[i] * piano_roll.tatum,
-            piano_roll.origin.frequency + f[i] * piano_roll.step) for i in range(len(f))])
-
-        return activations
-    elif engine == 'numpy':
-        # Tatum
-        if structuring_element.tatum != piano_roll.tatum and structuring_element.tatum != TimeShift(0):
-            new_tatum = piano_roll.tatum.gcd(structuring_element.tatum,
-                                             piano_roll.origin.time - structuring_element.origin.time)
-            piano_roll = piano_roll.change_tatum(new_tatum)
-            structuring_element = structuring_element.change_tatum(new_tatum)
-
-        # Origin
-        if structuring_element.frequency_nature == 'shift':
-            origin_frequency = - structuring_element.origin.frequency // structuring_element.step
-        else:
-            raise NotImplementedError
-
-        if structuring_element.time_nature == 'shift':
-            origin_time = - structuring_element.origin.time // structuring_element.tatum
-        else:
-            raise NotImplementedError
-
-        # Erosion
+    elif engine == 'sliding':
+        eroded_array = erosion_sliding(piano_roll.array, structuring_element.array, origin_frequency, origin_time)
+    elif engine == 'bitset':
+        eroded_array = erosion_bitset(piano_roll.array, structuring_element.array, origin_frequency, origin_time)
+    else:
         eroded_array = np.zeros_like(piano_roll.array, dtype=bool)
         str_el = structuring_element.array
         str_el_n = str_el.shape[-1]
@@ -104,20 +192,13 @@ def erosion(piano_roll: PianoRoll, structuring_element: PianoRoll, engine='numpy
                           n - origin_time: n - origin_time + str_el_n]
                 if segment.shape != str_el.shape:
                     continue
-                value = np.min(segment - str_el)
-                eroded_array[m, n] = value >= 0
-
-        # Activations
-        f, t = np.where(eroded_array)
-        values = [TimeFrequency(
-            piano_roll.origin.time + t[i] * piano_roll.tatum,
-            piano_roll.origin.frequency + f[i] * piano_roll.step) for i in range(len(f))]
-        activations = Activations(*values)
+                eroded_array[m, n] = np.all(segment >= str_el)
 
-        return activations
-    else:
-        raise ValueError('Engine should be either "numpy" or "torch"')
+    # Activations
+    f, t = np.where(eroded_array)
+    activations = Activations.from_indices(f, t, piano_roll.origin, piano_roll.tatum, piano_roll.step)
 
+    return activations
 
 
 @multimethod
@@ -13,7 +13,17 @@ class WrongNature(Exception):
         super().__init__(msg)
 
 
+def set_slots(obj, state):
+    # Pickles written before __slots__ carry an instance dictionary instead of a slot mapping
+    if isinstance(state, tuple):
+        state = {**(state[0] or {}), **state[1]}
+    for key, value in state.items():
+        setattr(obj, key, value)
+
+
 class Time:
+    __slots__ = ('value',)
+
     def __init__(self, value: frac):
         if type(self) == Time:
             raise TypeError('Time is an abstract class.')
@@ -24,6 +34,9 @@ class Time:
     def nature(self) -> str:
         raise NotImplementedError
 
+    def __setstate__(self, state):
+        set_slots(self, state)
+
     @property
     def numerator(self):
         return self.value.numerator
@@ -77,6 +90,8 @@ class Time:
 
 
 class TimeShift(Time):
+    __slots__ = ()
+
     @multimethod
     def __init__(self, value: Union[frac, int, str]):
         super().__init__(frac(value))
@@ -85,6 +100,13 @@ class TimeShift(Time):
     def __init__(self, numerator: int, denominator: int):
         super().__init__(frac(numerator, denominator))
 
+    @classmethod
+    def from_value(cls, value: frac):
+        # Non-dispatching constructor for values that are already fractions
+        time = object.__new__(cls)
+        time.value = value
+        return time
+
     @property
     def nature(self):
         return 'shift'
@@ -96,22 +118,22 @@ class TimeShift(Time):
             return False
 
     def __neg__(self):
-        return TimeShift(-self.value)
+        return TimeShift.from_value(-self.value)
 
     def __add__(self, other):
         assert isinstance(other, TimeShift) or isinstance(other, TimePoint)
         if isinstance(other, TimeShift):
-            return TimeShift(self.value + other.value)
+            return TimeShift.from_value(self.value + other.value)
         else:
-            return TimePoint(self.value + other.value)
+            return TimePoint.from_value(self.value + other.value, TimeSignature.shared(4, 4))
 
     def __sub__(self, other):
         assert isinstance(other, TimeShift)
-        return TimeShift(self.value - other.value)
+        return TimeShift.from_value(self.value - other.value)
 
     def __mul__(self, other):
         assert isinstance(other, int)
-        return TimeShift(self.value * other)
+        return TimeShift.from_value(self.value * other)
 
     def __rmul__(self, other):
         return self * other
@@ -165,7 +187,7 @@ class TimeShift(Time):
             return self
         if len(others) == 1:
             assert isinstance(others[0], Time)
-            return TimeShift(gcd(self.value, others[0].value))
+            return TimeShift.from_value(gcd(self.value, others[0].value))
 
         result = self
         for other in others:
@@ -175,6 +197,8 @@ class TimeShift(Time):
 
 
 class TimeSignature:
+    __slots__ = ('numerator', 'denominator', 'duration')
+
     @multimethod
     def __init__(self, numerator: int, denominator: int):
         self.numerator: int = numerator
@@ -189,18 +213,36 @@ class TimeSignature:
     def __init__(self, value: Tuple[int, int]):
         self.__init__(*value)
 
+    def __setstate__(self, state):
+        set_slots(self, state)
+
+    @classmethod
+    def shared(cls, numerator: int, denominator: int):
+        # Time signatures are never modified, so time points can reference a single instance
+        key = (numerator, denominator)
+        time_signature = SHARED_TIME_SIGNATURES.get(key)
+        if time_signature is None:
+            time_signature = cls(numerator, denominator)
+            SHARED_TIME_SIGNATURES[key] = time_signature
+        return time_signature
+
     def __str__(self):
         return str(self.numerator) + '/' + str(self.denominator)
 
 
+SHARED_TIME_SIGNATURES: Dict[Tuple[int, int], TimeSignature] = {}
+
+
 class TimePoint(Time):
+    __slots__ = ('time_signature',)
+
     @multimethod
     def __init__(self, value: Union[frac, int, str], time_signature: Union[Tuple[int, int], TimeSignature] = (4, 4)):
         super().__init__(frac(value))
         if isinstance(time_signature, TimeSignature):
             self.time_signature = time_signature
         else:
-            self.time_signature = TimeSignature(*time_signature)
+            self.time_signature = TimeSignature.shared(*time_signature)
 
     @multimethod
     def __init__(self, numerator: int, denominator: int,
@@ -209,7 +251,7 @@ class TimePoint(Time):
         if isinstance(time_signature, TimeSignature):
             self.time_signature = time_signature
         else:
-            self.time_signature = TimeSignature(*time_signature)
+            self.time_signature = TimeSignature.shared(*time_signature)
 
     @multimethod
     def __init__(self, measure: int, beat: int, offset: Union[frac, str, int],
@@ -221,6 +263,14 @@ class TimePoint(Time):
         time_shift = (measure - 1) * measure_duration + (beat - 1) * beat_duration + offset
         super().__init__(time_shift.value)
 
+    @classmethod
+    def from_value(cls, value: frac, time_signature: TimeSignature):
+        # Non-dispatching constructor, the time signature is referenced and not copied
+        time = object.__new__(cls)
+        time.value = value
+        time.time_signature = time_signature
+        return time
+
     @property
     def nature(self):
         return 'point'
@@ -250,15 +300,15 @@ class TimePoint(Time):
 
     def __add__(self, other: TimeShift):
         assert isinstance(other, TimeShift), 'TimePoint can only be added with TimeShift.'
-        return TimePoint(self.value + other.value, time_signature=self.time_signature)
+        return TimePoint.from_value(self.value + other.value, self.time_signature)
 
     def __sub__(self, other):
         assert isinstance(other, TimePoint) or isinstance(other, TimeShift), \
             "Substraction is made between TimePoint and TimePoint or TimePoint and TimeShift"
         if isinstance(other, TimePoint):
-            return TimeShift(self.value - other.value)
+            return TimeShift.from_value(self.value - other.value)
         else:
-            return TimePoint(self.value - other.value, time_signature=self.time_signature)
+            return TimePoint.from_value(self.value - other.value, self.time_signature)
 
     def __mul__(self, other):
         raise ValueError('TimePoint cannot be multiplied.')
@@ -297,6 +347,8 @@ class TimePoint(Time):
 
 
 class TimeSeconds(TimePoint):
+    __slots__ = ()
+
     def __init__(self, value: float):
         super().__init__(frac(value), time_signature=(1, 1))
         self.value = value
@@ -361,6 +413,7 @@ class TimeVector:
 
 # Frequency
 class Frequency:
+    __slots__ = ('value',)
     nature: Optional[str] = None
 
     def __init__(self, value):
@@ -369,6 +422,24 @@ class Frequency:
         else:
             self.value = value
 
+    def __setstate__(self, state):
+        set_slots(self, state)
+
+    @classmethod
+    def from_value(cls, value: int):
+        # Non-dispatching constructor, frequencies are never modified so equal integers share one instance
+        if type(value) is not int:
+            frequency = object.__new__(cls)
+            frequency.value = value
+            return frequency
+        key = (cls, value)
+        frequency = SHARED_FREQUENCIES.get(key)
+        if frequency is None:
+            frequency = object.__new__(cls)
+            frequency.value = value
+            SHARED_FREQUENCIES[key] = frequency
+        return frequency
+
     def __eq__(self, other):
         raise NotImplementedError
 
@@ -414,6 +485,8 @@ class Frequency:
 
 
 class FrequencyShift(Frequency):
+    __slots__ = ()
+
     def __init__(self, shift: int):
         super().__init__(shift)
 
@@ -424,17 +497,17 @@ class FrequencyShift(Frequency):
             return False
 
     def __neg__(self):
-        return FrequencyShift(-self.value)
+        return FrequencyShift.from_value(-self.value)
 
     def __add__(self, other):
         assert isinstance(other, FrequencyShift) or isinstance(other, FrequencyPoint)
         if isinstance(other, FrequencyShift):
-            return FrequencyShift(self.value + other.value)
+            return FrequencyShift.from_value(self.value + other.value)
         else:
-            return FrequencyPoint(self.value + other.value)
+            return FrequencyPoint.from_value(self.value + other.value)
 
     def __mul__(self, other):
-        return FrequencyShift(self.value * other)
+        return FrequencyShift.from_value(self.value * other)
 
     def __rmul__(self, other):
         return FrequencyShift.__mul__(self, other)
@@ -455,7 +528,7 @@ class FrequencyShift(Frequency):
 
     def __sub__(self, other):
         assert isinstance(other, FrequencyShift)
-        return FrequencyShift(self.value - other.value)
+        return FrequencyShift.from_value(self.value - other.value)
 
     def __lt__(self, other):
         assert isinstance(other, FrequencyShift), 'FrequencyShift is only comparable with FrequencyShift.'
@@ -489,6 +562,8 @@ class FrequencyShift(Frequency):
 
 
 class FrequencyPoint(Frequency):
+    __slots__ = ()
+
     def __init__(self, midi_number: int):
         super().__init__(midi_number)
 
@@ -503,15 +578,15 @@ class FrequencyPoint(Frequency):
 
     def __add__(self, other: FrequencyShift):
         assert isinstance(other, FrequencyShift), 'FrequencyPoint can only be added with FrequencyShift.'
-        return FrequencyPoint(self.value + other.value)
+        return FrequencyPoint.from_value(self.value + other.value)
 
     def __sub__(self, other):
         assert isinstance(self, FrequencyPoint) or isinstance(self, FrequencyShift), \
             "Subtraction is made between FrequencyPoint and FrequencyPoint or FrequencyPoint and FrequencyShift"
         if isinstance(other, FrequencyPoint):
-            return FrequencyShift(self.value - other.value)
+            return FrequencyShift.from_value(self.value - other.value)
         else:
-            return FrequencyPoint(self.value - other.value)
+            return FrequencyPoint.from_value(self.value - other.value)
 
     def __mul__(self, other):
         raise ValueError('FrequencyPoint cannot be multiplied.')
@@ -554,6 +629,8 @@ class FrequencyPoint(Frequency):
 
 
 class ChromaShift(FrequencyShift):
+    __slots__ = ()
+
     def __init__(self, shift: int):
         assert 0 <= shift < 12
         super().__init__(shift)
@@ -574,6 +651,8 @@ class ChromaShift(FrequencyShift):
 
 
 class Chroma(FrequencyPoint):
+    __slots__ = ()
+
     def __init__(self, number: int):
         assert 0 <= number < 12
         super().__init__(number)
@@ -586,6 +665,9 @@ class Chroma(FrequencyPoint):
         return midi_number_to_chroma(self.value)
 
 
+SHARED_FREQUENCIES: Dict[Tuple[Type[Frequency], int], Frequency] = {}
+
+
 class FrequencyExtension:
     def __init__(self, lower: Frequency, higher: Frequency):
         assert type(lower) == type(higher)
@@ -630,6 +712,8 @@ class FrequencyVector:
 
 # Time-Frequency
 class TimeFrequency:
+    __slots__ = ('time', 'frequency')
+
     @multimethod
     def __init__(self, time: Optional[Time], frequency: Optional[Frequency]):
         self.time = time
@@ -651,6 +735,17 @@ class TimeFrequency:
         else:
             raise ValueError('Frequency nature should be either point or shift.')
 
+    @classmethod
+    def from_values(cls, time: Optional[Time], frequency: Optional[Frequency]):
+        # Non-dispatching constructor
+        time_frequency = object.__new__(cls)
+        time_frequency.time = time
+        time_frequency.frequency = frequency
+        return time_frequency
+
+    def __setstate__(self, state):
+        set_slots(self, state)
+
     def __eq__(self, other):
         if isinstance(other, TimeFrequency):
             return self.time == other.time and self.frequency == other.frequency
@@ -659,11 +754,11 @@ class TimeFrequency:
 
     def __add__(self, other: TimeFrequency):
         assert isinstance(other, TimeFrequency)
-        return TimeFrequency(self.time + other.time, self.frequency + other.frequency)
+        return TimeFrequency.from_values(self.time + other.time, self.frequency + other.frequency)
 
     def __sub__(self, other: TimeFrequency):
         assert isinstance(other, TimeFrequency)
-        return TimeFrequency(self.time - other.time, self.frequency - other.frequency)
+        return TimeFrequency.from_values(self.time - other.time, self.frequency - other.frequency)
 
     def __str__(self):
         return '(%s, %s)' % (self.time, self.frequency)
@@ -1227,6 +1322,9 @@ class Texture(PianoRollStack):
     def __iter__(self):
         return iter(self.piano_rolls)
 
+    def __getitem__(self, item):
+        return self.piano_rolls[item]
+
     @property
     def nature(self):
         if len(self.piano_rolls) == 0:
@@ -1461,6 +1559,9 @@ class Harmony(PianoRollStack):
     def __iter__(self):
         return iter(self.piano_rolls)
 
+    def __getitem__(self, item):
+        return self.piano_rolls[item]
+
     @property
     def nature(self):
         if len(self.piano_rolls) == 0:
@@ -1551,8 +1652,58 @@ class Activations(PianoRoll):
         # PianoRoll
         PianoRoll.__init__(self, array, origin, tatum, step)
 
+    @classmethod
+    def from_indices(cls, f_idx: np.ndarray, t_idx: np.ndarray, origin: TimeFrequency, tatum: TimeShift,
+                     step: FrequencyShift):
+        # Activations at origin + (t_idx * tatum, f_idx * step), kept as an array until iterated
+        f_idx = np.asarray(f_idx, dtype=np.int64)
+        t_idx = np.asarray(t_idx, dtype=np.int64)
+        if f_idx.size == 0:
+            return cls()
+
+        # Reduce to the bounding box and to the coarsest tatum, as the constructor does
+        f_min = int(f_idx.min())
+        t_min = int(t_idx.min())
+        f_idx = f_idx - f_min
+        t_idx = t_idx - t_min
+        t_gcd = int(np.gcd.reduce(t_idx))
+        if t_gcd != 0:
+            t_idx = t_idx // t_gcd
+
+        array = np.zeros((int(f_idx.max()) + 1, int(t_idx.max()) + 1), dtype=bool)
+        array[f_idx, t_idx] = True
+
+        activations = cls.__new__(cls)
+        activations._activations = None
+        PianoRoll.__init__(activations, array,
+                           TimeFrequency(origin.time + t_min * tatum, origin.frequency + f_min * step),
+                           tatum * t_gcd, step)
+        return activations
+
+    @property
+    def activations(self):
+        # Materialized on demand for activations built from indices
+        if self._activations is None:
+            f, t = np.nonzero(self.array)
+            self._activations = tuple(TimeFrequency.from_values(self.origin.time + int(t[i]) * self.tatum,
+                                                                self.origin.frequency + int(f[i]) * self.step)
+                                      for i in range(len(f)))
+        return self._activations
+
+    @activations.setter
+    def activations(self, activations):
+        self._activations = activations
+
+    def __setstate__(self, state):
+        # Activations pickled before the lazy view stored the tuple as a plain attribute
+        if 'activations' in state:
+            state['_activations'] = state.pop('activations')
+        self.__dict__.update(state)
+
     def __len__(self):
-        return len(self.activations)
+        if self._activations is None:
+            return int(np.count_nonzero(self.array))
+        return len(self._activations)
 
     def __iter__(self):
         return iter(self.activations)
@@ -1716,6 +1867,15 @@ class ActivationsStack(PianoRollStack):
 
         self.activations_list = activations_list
 
+    def __len__(self):
+        return len(self.activations_list)
+
+    def __iter__(self):
+        return iter(self.activations_list)
+
+    def __getitem__(self, item):
+        return self.activations_list[item]
+
     def __add__(self, other: PianoRollStack):
         assert isinstance(other, PianoRollStack)
         assert len(self.piano_rolls) == len(other.piano_rolls)
@@ -1771,9 +1931,8 @@ class ActivationsStack(PianoRollStack):
 
         activations_list = []
         for k in range(len(self.activations_list)):
-            t = np.array([self.activations_list[k].origin.time]) + n[i == k] * self.activations_list[k].tatum
-            f = np.array([self.activations_list[k].origin.frequency]) + m[i == k] * self.activations_list[k].step
-            activations_list.append(Activations(*[TimeFrequency(ti, fi) for ti, fi in zip(t, f)]))
+            a = self.activations_list[k]
+            activations_list.append(Activations.from_indices(m[i == k], n[i == k], a.origin, a.tatum, a.step))
 
         return ActivationsStack(*activations_list)
 
@@ -18,3 +18,14 @@
 # _ = [wav, np, numbers, warnings, torch, stft, cqt, pickle, plt, tick, mpl, wid, func, win, greyscale, image,
 #      sig, fft, binary, time]
 # _ = [Union, List, Optional, Tuple]
+import importlib
+
+# Submodules are imported on first access, so that importing the package does not pull torch, nnAudio or nnMorpho
+SUBMODULES = ['animation', 'layers', 'morphology', 'parameters', 'phd_settings', 'plot', 'processing', 'profiling',
+              'synthesis', 'templates', 'tfst', 'utils']
+
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
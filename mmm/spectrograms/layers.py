@@ -1,11 +1,14 @@
 import time
 import torch
+import numpy as np
 import nnAudio.features.cqt as cqt
 import nnAudio.features.stft as stft
-from .utils import to_db
+from .utils import to_db, synchronize, get_device
+from .profiling import profiled
 from .parameters import *
 
 
+@profiled()
 def create_cqt_layer(fs=FS,
                      hop_length=HOP_LENGTH,
                      f_min=F_MIN,
@@ -31,16 +34,17 @@ def create_cqt_layer(fs=FS,
                         pad_mode='constant',
                         trainable=False,
                         output_format='Magnitude',
-                        verbose=verbose).to(device)
+                        verbose=verbose).to(get_device(device))
     cqt_layer.fs = fs
 
     if verbose:
-        torch.cuda.synchronize(device)
+        synchronize(device)
         print('Time to create CQT layer: %.3f seconds' % (time.time() - start))
 
     return cqt_layer
 
 
+@profiled()
 def create_stft_layer(n_fft=N_FFT,
                       win_length=WIN_LENGTH,
                       hop_length=HOP_LENGTH,
@@ -68,32 +72,34 @@ def create_stft_layer(n_fft=N_FFT,
                            sr=sr,
                            trainable=trainable,
                            output_format=output_format,
-                           verbose=verbose).to(device)
+                           verbose=verbose).to(get_device(device))
     stft_layer.fs = FS
     if verbose:
-        torch.cuda.synchronize(device)
+        synchronize(device)
         print('Time to create STFT layer: %.3f seconds' % (time.time() - start))
 
     return stft_layer
 
 
+@profiled()
 def apply_cqt_layer(signal, cqt_layer, verbose=True, input_name='signal', device=DEVICE):
     # Apply to signal
-    signal_tensor = torch.tensor(signal, device=device, dtype=torch.float32)
+    signal_tensor = torch.tensor(signal, device=get_device(device), dtype=torch.float32)
 
     start = time.time()
     spectrogram = cqt_layer(signal_tensor, normalization_type='convolutional')
     spectrogram = to_db(spectrogram)
     if verbose:
-        torch.cuda.synchronize(device)
+        synchronize(device)
         print('Time to apply CQT to %s: %.3f seconds' % (input_name, time.time() - start))
 
     return spectrogram
 
 
+@profiled()
 def apply_stft_layer(signal, stft_layer, verbose=True, output_format='Magnitude', input_name='signal', device=DEVICE):
     # Apply to signal
-    signal_tensor = torch.tensor(signal, device=device, dtype=torch.float32)
+    signal_tensor = torch.tensor(signal, device=get_device(device), dtype=torch.float32)
 
     start = time.time()
     spectrogram_complex = stft_layer(signal_tensor)
@@ -104,7 +110,110 @@ def apply_stft_layer(signal, stft_layer, verbose=True, output_format='Magnitude'
         spectrogram = spectrogram_complex[0, :, :, :]
 
     if verbose:
-        torch.cuda.synchronize(device)
+        synchronize(device)
         print('Time to apply STFT to %s: %.3f seconds' % (input_name, time.time() - start))
 
     return spectrogram
+
+
+def column_samples(stft_layer, start, end):
+    # Samples read by the columns start to end - 1 of the centred STFT of a signal, before and after which the
+    # constant padding is zero; a non-centred layer applied to them returns exactly these columns
+    first = start * stft_layer.stride - stft_layer.n_fft // 2
+    last = first + (end - start - 1) * stft_layer.stride + stft_layer.n_fft
+
+    return first, last
+
+
+def stft_length(n_samples, stft_layer):
+    # Number of columns of the centred STFT of a signal
+    return 1 + (n_samples + 2 * (stft_layer.n_fft // 2) - stft_layer.n_fft) // stft_layer.stride
+
+
+# Batches
+def batch_signals(signals, batch_size=BATCH_SIZE, padding=BATCH_PADDING):
+    # Signals sorted by length and cut into batches in which each one is padded by at most a fraction of the
+    # longest one
+    lengths = np.array([len(signal) for signal in signals])
+    order = np.argsort(-lengths, kind='stable')
+
+    batches = []
+    first = 0
+    for k in range(1, order.size + 1):
+        if k == order.size or k - first == batch_size or lengths[order[k]] < (1 - padding) * lengths[order[first]]:
+            batches.append(order[first: k])
+            first = k
+
+    return batches
+
+
+def stack_signals(signals, indices, device=DEVICE):
+    # Signals of a batch, zero-padded at the end; the padding is read by no column of the shorter signals
+    batch = np.zeros((len(indices), max(len(signals[i]) for i in indices)), dtype=np.float32)
+    for row, i in enumerate(indices):
+        batch[row, :len(signals[i])] = signals[i]
+
+    return torch.from_numpy(batch).to(get_device(device))
+
+
+@profiled()
+def apply_stft_layer_batch(signals, stft_layer, verbose=True, output_format='Magnitude', device=DEVICE,
+                           batch_size=BATCH_SIZE, padding=BATCH_PADDING):
+    # Same spectrograms as apply_stft_layer on each signal, as views of one batched transform per batch
+    if stft_layer.center and stft_layer.pad_mode != 'constant':
+        raise ValueError("Parameter 'stft_layer' must pad with zeros to be applied to batches")
+
+    start = time.time()
+    spectrograms = [None] * len(signals)
+    for indices in batch_signals(signals, batch_size, padding):
+        spectrogram_complex = stft_layer(stack_signals(signals, indices, device))
+        if output_format == 'Magnitude':
+            spectrogram = torch.sqrt(spectrogram_complex[:, :, :, 0]**2 + spectrogram_complex[:, :, :, 1]**2)
+            spectrogram = to_db(spectrogram)
+        else:
+            spectrogram = spectrogram_complex
+
+        for row, i in enumerate(indices):
+            spectrograms[i] = spectrogram[row, :, :stft_length(len(signals[i]), stft_layer)]
+
+    if verbose:
+        synchronize(device)
+        print('Time to apply STFT to %d signals: %.3f seconds' % (len(signals), time.time() - start))
+
+    return spectrograms
+
+
+@profiled()
+def apply_cqt_layer_batch(signals, cqt_layer, verbose=True, device=DEVICE, batch_size=BATCH_SIZE,
+                          padding=BATCH_PADDING):
+    # Same spectrograms as apply_cqt_layer on each signal, as views of one batched transform per batch
+    start = time.time()
+    spectrograms = [None] * len(signals)
+    for indices in batch_signals(signals, batch_size, padding):
+        spectrogram = to_db(cqt_layer(stack_signals(signals, indices, device), normalization_type='convolutional'))
+        for row, i in enumerate(indices):
+            spectrograms[i] = spectrogram[row: row + 1, :, :1 + len(signals[i]) // cqt_layer.hop_length]
+
+    if verbose:
+        synchronize(device)
+        print('Time to apply CQT to %d signals: %.3f seconds' % (len(signals), time.time() - start))
+
+    return spectrograms
+
+
+@profiled()
+def apply_tfst_layer_batch(signals, tfst_layer, verbose=True, device=DEVICE, batch_size=BATCH_SIZE,
+                           padding=BATCH_PADDING):
+    # Same output as the TFST layer on each signal, as views of one batched transform per batch
+    start = time.time()
+    spectrograms = [None] * len(signals)
+    for indices in batch_signals(signals, batch_size, padding):
+        spectrogram = tfst_layer(stack_signals(signals, indices, device))
+        for row, i in enumerate(indices):
+            spectrograms[i] = spectrogram[row, ..., :len(signals[i]) // tfst_layer.hop_length]
+
+    if verbose:
+        synchronize(device)
+        print('Time to apply TFST to %d signals: %.3f seconds' % (len(signals), time.time() - start))
+
+    return spectrograms
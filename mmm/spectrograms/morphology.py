@@ -1,8 +1,14 @@
 import time
 import numpy as np
+from pathlib import Path
 from typing import Optional, Tuple
-import matplotlib.pyplot as plt
-from .templates import *
+from concurrent.futures import ThreadPoolExecutor
+import torch
+import torch.nn.functional as func
+from .templates import template
+from .parameters import CPU_THREADS, CPU_TILE_WIDTH
+from .utils import get_device
+from .profiling import record
 import nnMorpho.greyscale_operators as greyscale
 import nnMorpho.binary_operators as binary
 
@@ -17,8 +23,325 @@ def dilation_geodesic(marker: torch.Tensor, condition: torch.Tensor):
     return torch.minimum(condition, d)
 
 
+# Flat rectangular structuring elements
+def flat_erosion(x: torch.Tensor, shape: Tuple[int, int], value=0., border='g'):
+    # Same as nnMorpho with the default origin: a minimum filter, computed by separable max pooling of -x
+    origin = (shape[0] // 2, shape[1] // 2)
+    padding = (origin[1], shape[1] - 1 - origin[1], origin[0], shape[0] - 1 - origin[0])
+    padded = func.pad(- x[None, None], padding, value=np.inf if border[0] == 'e' else -np.inf)
+    y = func.max_pool2d(func.max_pool2d(padded, (shape[0], 1), stride=1), (1, shape[1]), stride=1)
+    return - y[0, 0] - value
+
+
+def flat_dilation(x: torch.Tensor, shape: Tuple[int, int], value=0.):
+    origin = (shape[0] // 2, shape[1] // 2)
+    padding = (shape[1] - 1 - origin[1], origin[1], shape[0] - 1 - origin[0], origin[0])
+    padded = func.pad(x[None, None], padding, value=-np.inf)
+    y = func.max_pool2d(func.max_pool2d(padded, (shape[0], 1), stride=1), (1, shape[1]), stride=1)
+    return y[0, 0] + value
+
+
+def tiled_columns(operator, x: torch.Tensor, halo: int, tile_width=CPU_TILE_WIDTH, n_threads=CPU_THREADS):
+    # Applies a local operator to strips of columns extended by the halo on both sides, in a thread pool
+    width = x.shape[-1]
+    if width <= tile_width or n_threads is None or n_threads <= 1:
+        return operator(x)
+
+    result = torch.empty_like(x)
+
+    def apply(start):
+        end = min(start + tile_width, width)
+        start_halo = max(start - halo, 0)
+        end_halo = min(end + halo, width)
+        result[:, start: end] = operator(x[:, start_halo: end_halo])[:, start - start_halo: end - start_halo]
+
+    with ThreadPoolExecutor(n_threads) as pool:
+        list(pool.map(apply, range(0, width, tile_width)))
+
+    return result
+
+
+def greyscale_flat(operation: str, x: torch.Tensor, shape: Tuple[int, int], value=0., border='e',
+                   tile_width=CPU_TILE_WIDTH, n_threads=CPU_THREADS):
+    # Operators by a flat rectangle; on CPU they are computed by pooling in column strips, whose halo is the reach of
+    # the rectangle times the number of elementary operations
+    if x.device.type != 'cpu':
+        str_el = torch.full(shape, value, dtype=x.dtype, device=x.device)
+        if operation == 'erosion':
+            return greyscale.erosion(x, str_el, border=border)
+        elif operation == 'dilation':
+            return greyscale.dilation(x, str_el)
+        elif operation == 'opening':
+            return greyscale.opening(x, str_el, border=border)
+        elif operation == 'closing':
+            return greyscale.closing(x, str_el, border=border)
+        raise ValueError("Parameter 'operation' must be 'erosion', 'dilation', 'opening' or 'closing'")
+
+    reach = shape[1] // 2
+    if operation == 'erosion':
+        operator, halo = lambda y: flat_erosion(y, shape, value, border), reach
+    elif operation == 'dilation':
+        operator, halo = lambda y: flat_dilation(y, shape, value), reach
+    elif operation == 'opening':
+        operator, halo = lambda y: flat_dilation(flat_erosion(y, shape, value, border), shape, value), 2 * reach
+    elif operation == 'closing':
+        operator, halo = lambda y: flat_erosion(flat_dilation(y, shape, value), shape, value, border), 2 * reach
+    else:
+        raise ValueError("Parameter 'operation' must be 'erosion', 'dilation', 'opening' or 'closing'")
+    return tiled_columns(operator, x, halo, tile_width, n_threads)
+
+
+# Queue-based reconstruction
+NEIGHBOURS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+
+def shifted_maximum(x: np.ndarray):
+    padded = np.pad(x, 1, constant_values=-np.inf)
+    result = np.copy(x)
+    for di, dj in NEIGHBOURS:
+        np.maximum(result, padded[1 + di: 1 + di + x.shape[0], 1 + dj: 1 + dj + x.shape[1]], out=result)
+    return result
+
+
+def raster_scans(x: np.ndarray, condition: np.ndarray):
+    # Line by line propagation along both axes, in both directions
+    for axis in (0, 1):
+        x_axis = np.moveaxis(x, axis, 0)
+        condition_axis = np.moveaxis(condition, axis, 0)
+        n = x_axis.shape[0]
+        for lines in (range(1, n), range(n - 2, -1, -1)):
+            step = 1 if lines.step == 1 else -1
+            for i in lines:
+                previous = x_axis[i - step]
+                candidate = np.copy(previous)
+                np.maximum(candidate[1:], previous[:-1], out=candidate[1:])
+                np.maximum(candidate[:-1], previous[1:], out=candidate[:-1])
+                np.minimum(candidate, condition_axis[i], out=candidate)
+                np.maximum(x_axis[i], candidate, out=x_axis[i])
+
+
+def fifo_propagation(x: np.ndarray, condition: np.ndarray, queue: np.ndarray, iterations: Optional[int] = None,
+                     verbose=False, verbose_it_step=10):
+    height, width = x.shape
+    x_flat = x.reshape(-1)
+    condition_flat = condition.reshape(-1)
+
+    count = 0
+    visits = 0
+    while queue.size > 0:
+        if count == iterations:
+            break
+
+        q_i, q_j = np.divmod(queue, width)
+        values = x_flat[queue]
+        visits += queue.size
+
+        # Candidates of the whole wave are computed before updating, as in the iterative version
+        pixels_list = []
+        candidates_list = []
+        for di, dj in NEIGHBOURS:
+            n_i = q_i + di
+            n_j = q_j + dj
+            inside = (0 <= n_i) & (n_i < height) & (0 <= n_j) & (n_j < width)
+            pixels = n_i[inside] * width + n_j[inside]
+            candidates = np.minimum(values[inside], condition_flat[pixels])
+            raised = candidates > x_flat[pixels]
+            pixels_list.append(pixels[raised])
+            candidates_list.append(candidates[raised])
+
+        pixels = np.concatenate(pixels_list)
+        np.maximum.at(x_flat, pixels, np.concatenate(candidates_list))
+        queue = np.unique(pixels)
+
+        count += 1
+        if verbose:
+            if count % verbose_it_step == 0:
+                print("it: %d, queue: %d" % (count, queue.size))
+
+    return count, visits
+
+
+def reconstruction_dilation_queue(marker: np.ndarray, condition: np.ndarray, iterations: Optional[int] = None,
+                                  hybrid=True, pin_border=False, verbose=False, verbose_it_step=10):
+    # First geodesic step, so that the marker lies below the condition
+    x = np.minimum(condition, shifted_maximum(marker))
+    if pin_border:
+        x[[0, -1], :] = condition[[0, -1], :]
+        x[:, [0, -1]] = condition[:, [0, -1]]
+    count = 1
+
+    if hybrid:
+        raster_scans(x, condition)
+        iterations = None
+    elif count == iterations:
+        return x
+
+    # Initial queue: pixels changed by a full geodesic step
+    x_next = np.minimum(condition, shifted_maximum(x))
+    queue = np.flatnonzero(x_next != x)
+    x = x_next
+    count += 1
+
+    if iterations is not None:
+        iterations = max(iterations - count, 0)
+    waves, visits = fifo_propagation(x, condition, queue, iterations, verbose, verbose_it_step)
+    record(iterations=count + waves, visits=visits)
+
+    if verbose:
+        print('Queue reconstruction: %d waves, %d pixel visits (%.2f per pixel)' %
+              (count + waves, visits, visits / max(x.size, 1)))
+
+    return x
+
+
+def reconstruction_queue(marker: torch.Tensor, condition: torch.Tensor, operation: str,
+                         iterations: Optional[int] = None, engine='hybrid', verbose=False, verbose_it_step=10):
+    if engine not in ['queue', 'hybrid']:
+        raise ValueError("Parameter 'engine' must be 'iterative', 'queue' or 'hybrid'")
+
+    marker_array = marker.cpu().numpy()
+    condition_array = condition.cpu().numpy()
+
+    if operation == 'dilation':
+        result = reconstruction_dilation_queue(marker_array, condition_array, iterations, engine == 'hybrid',
+                                               False, verbose, verbose_it_step)
+    elif operation == 'erosion':
+        # Duality; the Euclidean border of the erosion pins the border pixels to the condition
+        result = - reconstruction_dilation_queue(- marker_array, - condition_array, iterations, engine == 'hybrid',
+                                                 True, verbose, verbose_it_step)
+    else:
+        raise ValueError("Parameter 'operation' must be 'erosion' or 'dilation'")
+
+    return torch.from_numpy(result).to(condition.device)
+
+
+class DeltaStack:
+    def __init__(self, base: np.ndarray):
+        # Frame k is the base with the changes of frames 1 to k applied, the changes of frame k being
+        # pixels[offsets[k - 1]: offsets[k]] (flat indices) and values[offsets[k - 1]: offsets[k]]
+        self.base = np.ascontiguousarray(base, dtype=np.float32)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.pixels = np.zeros(0, dtype=np.int64)
+        self.values = np.zeros(0, dtype=np.float32)
+
+        self._pending = []
+        self._cursor = None
+        self._frame = None
+
+    def __len__(self):
+        return self.offsets.size + len(self._pending)
+
+    def __getitem__(self, item):
+        if isinstance(item, tuple):
+            # The pixel indices apply after the frame axis, which a slice of frames keeps
+            if isinstance(item[0], slice):
+                return self[item[0]][(slice(None),) + item[1:]]
+            return self[item[0]][item[1:]]
+        if isinstance(item, slice):
+            return np.stack([self.frame(k) for k in range(*item.indices(len(self)))])
+        return self.frame(item)
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self.frame(k)
+
+    def __array__(self, dtype=None, copy=None):
+        return self[:].astype(dtype if dtype is not None else np.float32, copy=False)
+
+    def __getstate__(self):
+        self.flush()
+        return {'base': self.base, 'offsets': self.offsets, 'pixels': self.pixels, 'values': self.values}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pending = []
+        self._cursor = None
+        self._frame = None
+
+    @property
+    def shape(self):
+        return (len(self), *self.base.shape)
+
+    @property
+    def dtype(self):
+        return self.base.dtype
+
+    @property
+    def nbytes(self):
+        self.flush()
+        return self.base.nbytes + self.offsets.nbytes + self.pixels.nbytes + self.values.nbytes
+
+    def append(self, pixels: np.ndarray, values: np.ndarray):
+        # Changes of a new frame with respect to the last one
+        self._pending.append((np.asarray(pixels, dtype=np.int64), np.asarray(values, dtype=np.float32)))
+
+    def flush(self):
+        if len(self._pending) == 0:
+            return
+        lengths = [pixels.size for pixels, _ in self._pending]
+        self.offsets = np.concatenate((self.offsets, self.offsets[-1] + np.cumsum(lengths)))
+        self.pixels = np.concatenate([self.pixels] + [pixels for pixels, _ in self._pending])
+        self.values = np.concatenate([self.values] + [values for _, values in self._pending])
+        self._pending = []
+
+    def frame(self, k: int):
+        n_frames = len(self)
+        if not -n_frames <= k < n_frames:
+            raise IndexError('Frame %d out of range for a stack of %d frames' % (k, n_frames))
+        k = k % n_frames
+        self.flush()
+
+        # Sequential reads only apply the changes since the last frame read
+        if self._cursor is None or k < self._cursor:
+            self._cursor = 0
+            self._frame = np.array(self.base, order='C')
+        frame_flat = self._frame.reshape(-1)
+        for n in range(self._cursor, k):
+            frame_flat[self.pixels[self.offsets[n]: self.offsets[n + 1]]] = \
+                self.values[self.offsets[n]: self.offsets[n + 1]]
+        self._cursor = k
+
+        return np.copy(self._frame)
+
+    def save(self, folder: Path):
+        folder = Path(folder)
+        folder.mkdir(parents=True, exist_ok=True)
+        for name, array in self.__getstate__().items():
+            np.save(folder / (name + '.npy'), array)
+
+    @classmethod
+    def load(cls, folder: Path, mmap_mode: Optional[str] = 'r'):
+        folder = Path(folder)
+        stack = cls.__new__(cls)
+        stack.__setstate__({name: np.load(folder / (name + '.npy'), mmap_mode=mmap_mode)
+                            for name in ['base', 'offsets', 'pixels', 'values']})
+        return stack
+
+
+def iteration_stack(x: torch.Tensor, step, max_iterations: Optional[int] = None, verbose=False,
+                    verbose_it_step=10):
+    # Iterates until idempotence or max_iterations frames, keeping only the pixels changed by each iteration
+    x_stack = DeltaStack(x.cpu().numpy())
+
+    while max_iterations is None or len(x_stack) < max_iterations:
+        x_out = step(x)
+        pixels = torch.nonzero(torch.ne(x_out, x).reshape(-1)).reshape(-1)
+        if pixels.numel() == 0:
+            break
+        x_stack.append(pixels.cpu().numpy(), x_out.reshape(-1)[pixels].cpu().numpy())
+        x = x_out
+
+        if verbose:
+            if (len(x_stack) - 1) % verbose_it_step == 0:
+                print("it:", len(x_stack) - 1)
+
+    x_stack.flush()
+
+    return x_stack
+
+
 def reconstruction_erosion(marker: Optional[torch.Tensor], condition: torch.Tensor, iterations: Optional[int] = None,
-                           verbose=False, verbose_it_step=10):
+                           verbose=False, verbose_it_step=10, engine='iterative'):
     start = time.time()
 
     if verbose:
@@ -27,6 +350,12 @@ def reconstruction_erosion(marker: Optional[torch.Tensor], condition: torch.Tens
     if marker is None:
         marker = torch.zeros_like(condition)
 
+    if engine != 'iterative':
+        x_recons = reconstruction_queue(marker, condition, 'erosion', iterations, engine, verbose, verbose_it_step)
+        if verbose:
+            print('Time to apply reconstruction by erosion: %.3f seconds' % (time.time() - start))
+        return x_recons
+
     x_recons = torch.clone(marker)
 
     count = 0
@@ -46,6 +375,8 @@ def reconstruction_erosion(marker: Optional[torch.Tensor], condition: torch.Tens
         if count == iterations:
             break
 
+    record(iterations=count, converged=count != iterations)
+
     if verbose:
         print('Time to apply reconstruction by erosion: %.3f seconds' % (time.time() - start))
 
@@ -62,23 +393,8 @@ def reconstruction_erosion_stack(marker: Optional[torch.Tensor], condition: torc
     if marker is None:
         marker = torch.zeros_like(condition)
 
-    x_stack = np.zeros((max_iterations, *marker.shape), dtype=np.float32)
-    x_stack[0, :, :] = marker.cpu().numpy()
-
-    i = 0
-    while True:
-        x_in = torch.from_numpy(x_stack[i, :, :]).to(DEVICE)
-        x_out = erosion_geodesic(x_in, condition)
-        x_stack[i+1, :, :] = x_out.cpu().numpy()
-
-        i += 1
-
-        if i == max_iterations-1 or np.all(np.equal(x_stack[i+1, :, :], x_stack[i, :, :])):
-            break
-
-        if verbose:
-            if i % verbose_it_step == 0:
-                print("it:", i)
+    x_stack = iteration_stack(marker.to(get_device()), lambda x: erosion_geodesic(x, condition), max_iterations,
+                              verbose, verbose_it_step)
 
     if verbose:
         print('Time to apply reconstruction by erosion: %.3f seconds' % (time.time() - start))
@@ -87,13 +403,19 @@ def reconstruction_erosion_stack(marker: Optional[torch.Tensor], condition: torc
 
 
 def reconstruction_dilation(marker: Optional[torch.Tensor], condition: torch.Tensor, iterations: Optional[int] = None,
-                            verbose=False, verbose_it_step=10):
+                            verbose=False, verbose_it_step=10, engine='iterative'):
     start = time.time()
 
     if marker is None:
         marker = torch.zeros_like(condition) - 128
         marker[condition == torch.max(condition)] = torch.max(condition)
 
+    if engine != 'iterative':
+        x_recons = reconstruction_queue(marker, condition, 'dilation', iterations, engine, verbose, verbose_it_step)
+        if verbose:
+            print('Time to apply reconstruction by dilation: %.3f seconds' % (time.time() - start))
+        return x_recons
+
     x_recons = torch.clone(marker)
 
     count = 0
@@ -109,6 +431,7 @@ def reconstruction_dilation(marker: Optional[torch.Tensor], condition: torch.Ten
         if verbose:
             if count % verbose_it_step == 0:
                 print("it:", count)
+                import matplotlib.pyplot as plt
                 from .plot import plot_two_spectrogram
                 from .processing import MIN_DB
                 plot_two_spectrogram(marker.cpu().numpy(), x_out.cpu().numpy(),
@@ -119,6 +442,8 @@ def reconstruction_dilation(marker: Optional[torch.Tensor], condition: torch.Ten
         if count == iterations:
             break
 
+    record(iterations=count, converged=count != iterations)
+
     if verbose:
         print('Time to apply reconstruction by dilation: %.3f seconds' % (time.time() - start))
 
@@ -138,29 +463,8 @@ def reconstruction_dilation_stack(marker: Optional[torch.Tensor],
         marker = torch.zeros_like(condition) - 128
         marker[condition == torch.max(condition)] = torch.max(condition)
 
-    x_stack = np.zeros((iterations, *marker.shape), dtype=np.float32)
-    x_stack[0, :, :] = marker.cpu().numpy()
-
-    i = 0
-    while True:
-        x_in = torch.from_numpy(x_stack[i, :, :]).to(DEVICE)
-        x_out = dilation_geodesic(x_in, condition)
-        x_stack[i+1, :, :] = x_out.cpu().numpy()
-
-        i += 1
-
-        if i == iterations-1 or np.all(np.equal(x_stack[i+1, :, :], x_stack[i, :, :])):
-            break
-
-        if verbose:
-            if i % verbose_it_step == 0:
-                print("it:", i)
-                # from .plot import plot_two_spectrogram
-                # from .processing import MIN_DB
-                # plot_two_spectrogram(marker.cpu().numpy(), x_out.cpu().numpy(),
-                #                      v_min_1=MIN_DB, v_min_2=MIN_DB, v_max_1=0, v_max_2=0, c_map_1='Greys',
-                #                      c_map_2='Greys')
-                # plt.show()
+    x_stack = iteration_stack(marker.to(get_device()), lambda x: dilation_geodesic(x, condition), iterations,
+                              verbose, verbose_it_step)
 
     if verbose:
         print('Time to apply reconstruction by dilation: %.3f seconds' % (time.time() - start))
@@ -200,54 +504,201 @@ def binary_hit_or_miss(input_image: torch.Tensor,
     return torch.logical_and(e, d)
 
 
-def elementary_greyscale_sequential_thinning(x: torch.Tensor, direction: str = 'a', border='g', alpha=0):
-    if direction == 'h':
-        x_simple = greyscale_hit_or_miss(x, C_E, D_E, border=border, alpha=alpha)
-        x_thin = x - x_simple
+def sequential_greyscale_hit_or_miss(x: torch.Tensor, templates, border: str = 'g', alpha=0) -> torch.Tensor:
+    # Removes the simple points of each pair of templates in turn, as successive calls to greyscale_hit_or_miss
+    # would, with shifted views of a single padded copy of the image instead of full erosions and dilations
+    height, width = x.shape
+    padded = torch.empty((height + 2, width + 2), dtype=x.dtype, device=x.device)
+    x_thin = padded[1: height + 1, 1: width + 1]
+    x_thin.copy_(x)
+
+    e = torch.empty_like(x_thin)
+    d = torch.empty_like(x_thin)
+    x_simple = torch.empty_like(x_thin)
+
+    for str_el_in, str_el_out in templates:
+        # Erosion by the flat template; outside pixels are ignored unless the border is Euclidean
+        padded[[0, -1], :] = -np.inf if border[0] == 'e' else np.inf
+        padded[:, [0, -1]] = -np.inf if border[0] == 'e' else np.inf
+        origin = (str_el_in.shape[0] // 2, str_el_in.shape[1] // 2)
+        views = [padded[1 + i - origin[0]: 1 + i - origin[0] + height, 1 + j - origin[1]: 1 + j - origin[1] + width]
+                 for i, j in torch.nonzero(str_el_in).tolist()]
+        e.copy_(views[0])
+        for view in views[1:]:
+            torch.minimum(e, view, out=e)
+
+        # Dilation by the flipped template, outside pixels being ignored
+        padded[[0, -1], :] = -np.inf
+        padded[:, [0, -1]] = -np.inf
+        shape = str_el_out.shape
+        origin = (shape[0] - 1 - shape[0] // 2, shape[1] - 1 - shape[1] // 2)
+        views = [padded[1 + i - origin[0]: 1 + i - origin[0] + height, 1 + j - origin[1]: 1 + j - origin[1] + width]
+                 for i, j in torch.nonzero(str_el_out).tolist()]
+        d.copy_(views[0])
+        for view in views[1:]:
+            torch.maximum(d, view, out=d)
+        is_inf = torch.isinf(d)
+        if torch.any(is_inf):
+            d[is_inf] = torch.min(d[torch.logical_not(is_inf)])
+
+        # Same operations as greyscale_hit_or_miss, so that the result is bit-exact
+        torch.sub(x_thin, d, out=x_simple)
+        is_simple = torch.logical_and(torch.greater_equal(e, x_thin - alpha), torch.greater(x_thin, d))
+        x_simple.masked_fill_(torch.logical_not(is_simple), 0)
+        x_thin.sub_(x_simple)
+
+    return torch.clone(x_thin)
+
+
+def template_views(str_el: torch.Tensor, flip: bool):
+    # Corners of the views of a padded tile giving the shifted pixels of a template
+    shape = str_el.shape
+    assert shape[0] <= 3 and shape[1] <= 3, 'Templates are at most 3x3'
+    if flip:
+        origin = (shape[0] - 1 - shape[0] // 2, shape[1] - 1 - shape[1] // 2)
+    else:
+        origin = (shape[0] // 2, shape[1] // 2)
+    return [(1 + i - origin[0], 1 + j - origin[1]) for i, j in torch.nonzero(str_el).tolist()]
+
 
-        x_simple = greyscale_hit_or_miss(x_thin, C_W, D_W, border=border, alpha=alpha)
-        x_thin = x_thin - x_simple
+def fold_views(patches: torch.Tensor, views, size: int, function):
+    # Pixel-wise reduction of the shifted views of a batch of padded tiles
+    result = torch.clone(patches[:, views[0][0]: views[0][0] + size, views[0][1]: views[0][1] + size])
+    for i, j in views[1:]:
+        function(result, patches[:, i: i + size, j: j + size], out=result)
+    return result
 
-        x_simple = greyscale_hit_or_miss(x_thin, C_NW, D_NW, border=border, alpha=alpha)
-        x_thin = x_thin - x_simple
 
-        x_simple = greyscale_hit_or_miss(x_thin, C_SE, D_SE, border=border, alpha=alpha)
-        x_thin = x_thin - x_simple
+def any_pixel(mask: torch.Tensor):
+    return mask.reshape(mask.shape[0], -1).view(torch.uint8).amax(dim=1).to(torch.bool)
 
-        x_simple = greyscale_hit_or_miss(x_thin, C_NE, D_NE, border=border, alpha=alpha)
-        x_thin = x_thin - x_simple
 
-        x_simple = greyscale_hit_or_miss(x_thin, C_SW, D_SW, border=border, alpha=alpha)
-        x_thin = x_thin - x_simple
+def tiled_greyscale_hit_or_miss(input_image: torch.Tensor, templates, iterations: Optional[int] = None,
+                                border: str = 'g', alpha=0, tile_size=32, verbose=False, verbose_it_step=10):
+    # Same iterations as sequential_greyscale_hit_or_miss, each template only re-evaluating the tiles whose pixels or
+    # one-pixel halo changed since its last pass
+    height, width = input_image.shape
+    n_rows = -(-height // tile_size)
+    n_cols = -(-width // tile_size)
+    device = input_image.device
 
-        return x_thin
+    # Outside pixels are minus infinity, as for the dilation, so that they are never simple
+    padded = torch.full((n_rows * tile_size + 2, n_cols * tile_size + 2), -np.inf, dtype=input_image.dtype,
+                        device=device)
+    padded[1: height + 1, 1: width + 1] = input_image
+    inside = torch.zeros(padded.shape, dtype=torch.bool, device=device)
+    inside[1: height + 1, 1: width + 1] = True
 
-    elif direction == 'v':
-        x_simple = greyscale_hit_or_miss(x, C_N, D_N, border=border, alpha=alpha)
-        x_thin = x - x_simple
+    # Tiles with their halo, and without it for writing back
+    tiles = padded.unfold(0, tile_size + 2, tile_size).unfold(1, tile_size + 2, tile_size)
+    inside_tiles = inside.unfold(0, tile_size + 2, tile_size).unfold(1, tile_size + 2, tile_size)
+    cores = padded[1: -1, 1: -1].unfold(0, tile_size, tile_size).unfold(1, tile_size, tile_size)
 
-        x_simple = greyscale_hit_or_miss(x_thin, C_S, D_S, border=border, alpha=alpha)
-        x_thin = x_thin - x_simple
+    views = [(template_views(str_el_in, False), template_views(str_el_out, True))
+             for str_el_in, str_el_out in templates]
+    border_value = -np.inf if border[0] == 'e' else np.inf
 
-        x_simple = greyscale_hit_or_miss(x_thin, C_NE, D_NE, border=border, alpha=alpha)
-        x_thin = x_thin - x_simple
+    # Dirty tiles of each template, and tiles where the dilation is infinite and takes the minimum of the image
+    dirty = [np.ones((n_rows, n_cols), dtype=bool) for _ in templates]
+    infinite = [np.zeros((n_rows, n_cols), dtype=bool) for _ in templates]
+    minimum = [np.inf for _ in templates]
 
-        x_simple = greyscale_hit_or_miss(x_thin, C_SW, D_SW, border=border, alpha=alpha)
-        x_thin = x_thin - x_simple
+    count = 0
+    while True:
+        changed_any = False
+        for k, (views_in, views_out) in enumerate(views):
+            selected = np.copy(dirty[k])
+            while True:
+                rows, cols = np.nonzero(selected)
+                if rows.size == 0:
+                    break
+                index = (torch.from_numpy(rows).to(device), torch.from_numpy(cols).to(device))
+                patches = tiles[index]
+                inside_patches = inside_tiles[index]
+                x = patches[:, 1: -1, 1: -1]
+                inside_x = inside_patches[:, 1: -1, 1: -1]
+
+                if len(views_in) == 1:
+                    e = fold_views(patches, views_in, tile_size, torch.minimum)
+                else:
+                    e = fold_views(torch.where(inside_patches, patches, border_value), views_in, tile_size,
+                                   torch.minimum)
+                d = fold_views(patches, views_out, tile_size, torch.maximum)
+
+                # Pixels only decrease, so the minimum of the finite dilation over the image is the minimum of its
+                # previous value and of the new tiles; when it decreases, the infinite tiles are evaluated again
+                is_inf = torch.isinf(d)
+                excluded = torch.logical_or(is_inf, torch.logical_not(inside_x))
+                new_minimum = min(minimum[k], torch.min(torch.where(excluded, np.inf, d)).item())
+                if new_minimum < minimum[k] and np.any(infinite[k] & ~selected):
+                    minimum[k] = new_minimum
+                    selected |= infinite[k]
+                    continue
+                minimum[k] = new_minimum
+                d.masked_fill_(is_inf, minimum[k])
+                infinite[k][rows, cols] = any_pixel(torch.logical_and(is_inf, inside_x)).cpu().numpy()
+
+                x_simple = x - d
+                is_simple = torch.logical_and(torch.greater_equal(e, x - alpha), torch.greater(x, d))
+                x_simple.masked_fill_(torch.logical_not(is_simple), 0)
+                x_thin = x - x_simple
+                changed = torch.logical_and(torch.ne(x_thin, x), is_simple)
+                cores[index] = x_thin
+
+                # A change is seen by the tile and, through the halo, by the neighbours on its side
+                flags = torch.stack([any_pixel(changed),
+                                     any_pixel(changed[:, 0, :]), any_pixel(changed[:, -1, :]),
+                                     any_pixel(changed[:, :, 0]), any_pixel(changed[:, :, -1]),
+                                     changed[:, 0, 0], changed[:, 0, -1], changed[:, -1, 0], changed[:, -1, -1]],
+                                    dim=1).cpu().numpy()
+                marks = np.zeros((n_rows + 2, n_cols + 2), dtype=bool)
+                for flag, (di, dj) in enumerate([(0, 0), (-1, 0), (1, 0), (0, -1), (0, 1),
+                                                 (-1, -1), (-1, 1), (1, -1), (1, 1)]):
+                    marks[rows[flags[:, flag]] + 1 + di, cols[flags[:, flag]] + 1 + dj] = True
+                dirty[k][rows, cols] = False
+                if np.any(marks):
+                    changed_any = True
+                    for dirty_tiles in dirty:
+                        dirty_tiles |= marks[1: -1, 1: -1]
+                break
 
-        x_simple = greyscale_hit_or_miss(x_thin, C_NW, D_NW, border=border, alpha=alpha)
-        x_thin = x_thin - x_simple
+        if not changed_any:
+            break
+        count += 1
 
-        x_simple = greyscale_hit_or_miss(x_thin, C_SE, D_SE, border=border, alpha=alpha)
-        x_thin = x_thin - x_simple
+        if verbose:
+            if count % verbose_it_step == 0:
+                print("it:", count)
 
-        return x_thin
+        if count == iterations:
+            break
+
+    record(iterations=count, converged=count != iterations)
+    return torch.clone(padded[1: height + 1, 1: width + 1])
+
+
+def thinning_templates(direction: str):
+    if direction == 'h':
+        names = ['E', 'W', 'NW', 'SE', 'NE', 'SW']
+    elif direction == 'v':
+        names = ['N', 'S', 'NE', 'SW', 'NW', 'SE']
     else:
         raise ValueError("Parameter 'direction' must be 'h' or 'v'")
+    return [(template('C_' + name), template('D_' + name)) for name in names]
+
+
+def elementary_greyscale_sequential_thinning(x: torch.Tensor, direction: str = 'a', border='g', alpha=0):
+    return sequential_greyscale_hit_or_miss(x, thinning_templates(direction), border=border, alpha=alpha)
 
 
 def greyscale_thinning(input_image: torch.Tensor, iterations: Optional[int] = None, direction: str = 'a',
-                       verbose=False, verbose_it_step=10, alpha=0):
+                       verbose=False, verbose_it_step=10, alpha=0, engine='iterative', tile_size=32):
+    if engine == 'tiles':
+        return tiled_greyscale_hit_or_miss(input_image, thinning_templates(direction), iterations, alpha=alpha,
+                                           tile_size=tile_size, verbose=verbose, verbose_it_step=verbose_it_step)
+    elif engine != 'iterative':
+        raise ValueError("Parameter 'engine' must be 'iterative' or 'tiles'")
+
     x_thin = torch.clone(input_image)
     count = 0
     while True:
@@ -266,6 +717,7 @@ def greyscale_thinning(input_image: torch.Tensor, iterations: Optional[int] = No
         if count == iterations:
             break
 
+    record(iterations=count, converged=count != iterations)
     return x_thin
 
 
@@ -277,26 +729,9 @@ def greyscale_thinning_stack(input_image: torch.Tensor, direction: str = 'a',
     if verbose:
         print('Starting %s thinning stack...' % direction)
 
-    x_stack = np.zeros((max_iterations, *input_image.shape), dtype=np.float32)
-    x_stack[0, :, :] = input_image.cpu().numpy()
-
-    i = 0
-    while True:
-        x_in = torch.from_numpy(x_stack[i, :, :]).to(DEVICE)
-        x_out = elementary_greyscale_sequential_thinning(x_in, direction)
-        x_stack[i + 1, :, :] = x_out.cpu().numpy()
-
-        if np.all(np.equal(x_stack[i+1, :, :], x_stack[i, :, :])):
-            break
-
-        i += 1
-
-        if verbose:
-            if i % verbose_it_step == 0:
-                print("it:", i)
-
-        if i == max_iterations-1 or np.all(np.equal(x_stack[i+1, :, :], x_stack[i, :, :])):
-            break
+    x_stack = iteration_stack(input_image.to(get_device()),
+                              lambda x: elementary_greyscale_sequential_thinning(x, direction), max_iterations,
+                              verbose, verbose_it_step)
 
     if verbose:
         print('Time to apply thinning: %.3f seconds' % (time.time() - start))
@@ -304,30 +739,28 @@ def greyscale_thinning_stack(input_image: torch.Tensor, direction: str = 'a',
     return x_stack
 
 
-def elementary_greyscale_trimming(x: torch.Tensor, direction: str = 'a', border='g', alpha=0):
+def trimming_templates(direction: str):
     if direction == 'h':
-        x_simple = greyscale_hit_or_miss(x, C, D_E, border=border, alpha=alpha)
-        x_trim = x - x_simple
-
-        x_simple = greyscale_hit_or_miss(x_trim, C, D_W, border=border, alpha=alpha)
-        x_trim = x_trim - x_simple
-
-        return x_trim
-
+        names = ['E', 'W']
     elif direction == 'v':
-        x_simple = greyscale_hit_or_miss(x, C, D_N, border=border, alpha=alpha)
-        x_trim = x - x_simple
-
-        x_simple = greyscale_hit_or_miss(x_trim, C, D_S, border=border, alpha=alpha)
-        x_trim = x_trim - x_simple
-
-        return x_trim
+        names = ['N', 'S']
     else:
         raise ValueError("Parameter 'direction' must be 'h' or 'v'")
+    return [(template('C'), template('D_' + name)) for name in names]
+
+
+def elementary_greyscale_trimming(x: torch.Tensor, direction: str = 'a', border='g', alpha=0):
+    return sequential_greyscale_hit_or_miss(x, trimming_templates(direction), border=border, alpha=alpha)
 
 
 def greyscale_trimming(input_image: torch.Tensor, iterations: Optional[int] = None, direction: str = 'a',
-                       verbose=False, verbose_it_step=10, alpha=0):
+                       verbose=False, verbose_it_step=10, alpha=0, engine='iterative', tile_size=32):
+    if engine == 'tiles':
+        return tiled_greyscale_hit_or_miss(input_image, trimming_templates(direction), iterations, alpha=alpha,
+                                           tile_size=tile_size, verbose=verbose, verbose_it_step=verbose_it_step)
+    elif engine != 'iterative':
+        raise ValueError("Parameter 'engine' must be 'iterative' or 'tiles'")
+
     x_thin = torch.clone(input_image)
     count = 0
     while True:
@@ -346,6 +779,7 @@ def greyscale_trimming(input_image: torch.Tensor, iterations: Optional[int] = No
         if count == iterations:
             break
 
+    record(iterations=count, converged=count != iterations)
     return x_thin
 
 
@@ -356,26 +790,9 @@ def greyscale_trimming_stack(input_image: torch.Tensor, iterations: Optional[int
     if verbose:
         print('Starting %s trimming stack...' % direction)
 
-    x_stack = np.zeros((iterations, *input_image.shape), dtype=np.float32)
-    x_stack[0, :, :] = input_image.cpu().numpy()
-
-    i = 0
-    while True:
-        x_in = torch.from_numpy(x_stack[i, :, :]).to(DEVICE)
-        x_out = elementary_greyscale_trimming(x_in, direction, alpha=alpha)
-        x_stack[i+1, :, :] = x_out.cpu().numpy()
-
-        if np.all(np.equal(x_stack[i+1, :, :], x_stack[i, :, :])):
-            break
-
-        i += 1
-
-        if verbose:
-            if i % verbose_it_step == 0:
-                print("it:", i)
-
-        if i == iterations-1 or np.all(np.equal(x_stack[i+1, :, :], x_stack[i, :, :])):
-            break
+    x_stack = iteration_stack(input_image.to(get_device()),
+                              lambda x: elementary_greyscale_trimming(x, direction, alpha=alpha), iterations,
+                              verbose, verbose_it_step)
 
     if verbose:
         print('Time to apply trimming: %.3f seconds' % (time.time() - start))
@@ -402,52 +819,17 @@ def binary_thinning(image_input: torch.Tensor, iterations: Optional[int] = None,
         if count == iterations:
             break
 
+    record(iterations=count, converged=count != iterations)
     return x_thin
 
 
 def elementary_binary_thinning(x: torch.Tensor, direction: str = 'h', border='g'):
-    if direction == 'h':
-        x_simple = binary_hit_or_miss(x, C_E, D_E, border=border)
-        x_thin = torch.logical_and(x, torch.logical_not(x_simple))
-
-        x_simple = binary_hit_or_miss(x_thin, C_W, D_W, border=border)
+    x_thin = x
+    for str_el_in, str_el_out in thinning_templates(direction):
+        x_simple = binary_hit_or_miss(x_thin, str_el_in, str_el_out, border=border)
         x_thin = torch.logical_and(x_thin, torch.logical_not(x_simple))
 
-        x_simple = binary_hit_or_miss(x_thin, C_NW, D_NW, border=border)
-        x_thin = torch.logical_and(x_thin, torch.logical_not(x_simple))
-
-        x_simple = binary_hit_or_miss(x_thin, C_SE, D_SE, border=border)
-        x_thin = torch.logical_and(x_thin, torch.logical_not(x_simple))
-
-        x_simple = binary_hit_or_miss(x_thin, C_NE, D_NE, border=border)
-        x_thin = torch.logical_and(x_thin, torch.logical_not(x_simple))
-
-        x_simple = binary_hit_or_miss(x_thin, C_SW, D_SW, border=border)
-        x_thin = torch.logical_and(x_thin, torch.logical_not(x_simple))
-
-        return x_thin
-    elif direction == 'v':
-        x_simple = binary_hit_or_miss(x, C_N, D_N, border=border)
-        x_thin = torch.logical_and(x, torch.logical_not(x_simple))
-
-        x_simple = binary_hit_or_miss(x_thin, C_S, D_S, border=border)
-        x_thin = torch.logical_and(x_thin, torch.logical_not(x_simple))
-
-        x_simple = binary_hit_or_miss(x_thin, C_NE, D_NE, border=border)
-        x_thin = torch.logical_and(x_thin, torch.logical_not(x_simple))
-
-        x_simple = binary_hit_or_miss(x_thin, C_SW, D_SW, border=border)
-        x_thin = torch.logical_and(x_thin, torch.logical_not(x_simple))
-
-        x_simple = binary_hit_or_miss(x_thin, C_NW, D_NW, border=border)
-        x_thin = torch.logical_and(x_thin, torch.logical_not(x_simple))
-
-        x_simple = binary_hit_or_miss(x_thin, C_SE, D_SE, border=border)
-        x_thin = torch.logical_and(x_thin, torch.logical_not(x_simple))
-
-        return x_thin
-    else:
-        raise ValueError("Parameter 'direction' must be 'h' or 'v'")
+    return x_thin
 
 
 def skeleton(image_input, shape=(3, 3), n_max=None):
@@ -473,8 +855,9 @@ def skeleton(image_input, shape=(3, 3), n_max=None):
 
 
 def remove_isolated_greyscale(input_image: torch.Tensor):
-    d = greyscale.dilation(input_image, torch.zeros_like(B_O, dtype=input_image.dtype), B_O)
-    e = greyscale.erosion(input_image, torch.zeros_like(B_O, dtype=input_image.dtype), B_O, border='g')
+    str_el = template('B_O', input_image.device)
+    d = greyscale.dilation(input_image, torch.zeros_like(str_el, dtype=input_image.dtype), str_el)
+    e = greyscale.erosion(input_image, torch.zeros_like(str_el, dtype=input_image.dtype), str_el, border='g')
     is_plateau = torch.eq(d, e)
     is_bigger = torch.gt(input_image, d)
 
@@ -1,8 +1,9 @@
+import os
 import numpy as np
 
 # STFT parameters
 FS = 44100  # Hz
-DEVICE = 'cuda:0'  # 'cpu' or 'cuda:0'
+DEVICE = os.environ.get('MMM_DEVICE', 'auto')  # 'auto', 'cpu' or 'cuda:0'
 WIN_LENGTH = 2048*2  # samples
 OVERSAMPLING = 2  # no unit
 N_FFT = WIN_LENGTH * OVERSAMPLING  # samples
@@ -14,6 +15,8 @@ PAD_MODE = 'constant'  # 'constant' or 'reflect'
 OUTPUT_FORMAT = 'Complex'  # 'Magnitude' or 'Complex'
 FREQ_SCALE = 'no'  # 'no', 'linear', 'log', 'mel', 'cqt_hz', 'cqt_note'
 CENTER = True  # True or False
+BATCH_SIZE = 64  # signals
+BATCH_PADDING = 0.1  # fraction of the longest signal of a batch
 
 # CQT parameters
 F_MIN = 55  # Hz
@@ -29,6 +32,8 @@ MIN_DB = 20 * np.log10(EPS)
 
 # Synthesis parameters
 NOISE_SIGMA = 30.  # no unit
+SYNTHESIS_ENGINE = 'bank'  # 'loop' or 'bank'
+SYNTHESIS_BLOCK = 2**16  # samples
 
 # Morphology parameters
 DROP = 60  # dB
@@ -37,6 +42,30 @@ TOP_HAT_ABS_THRESHOLD = -100  # dB
 VERTICAL_THINNING_ITERATIONS = 100  # no unit
 HORIZONTAL_THINNING_ITERATIONS = 100  # no unit
 RECONSTRUCTION_EROSION_ITERATIONS = 100  # no unit
+RECONSTRUCTION_ENGINE = 'hybrid'  # 'iterative', 'queue' or 'hybrid'
+THINNING_ENGINE = 'tiles'  # 'iterative' or 'tiles'
+TILE_SIZE = 32  # pixels
+CPU_THREADS = os.cpu_count()  # no unit
+CPU_TILE_WIDTH = 1024  # pixels
+
+# Streaming parameters
+STREAM_CHUNK_DURATION = 10.  # s
+STREAM_RECONSTRUCTION_SUPPORT = 0.5  # s
+
+# Cache parameters
+CACHE_ENABLED = True  # True or False
+CACHE_BUDGET = 2**34  # bytes per folder
+
+# Scheduler parameters
+SCHEDULER_ENGINE = 'thread'  # 'sequential' or 'thread'
+SCHEDULER_WORKERS = 3  # threads, one per branch of the pipeline
+
+# Profiling parameters
+PROFILING = os.environ.get('MMM_PROFILING', '0') == '1'  # True or False
+
+# Array store parameters
+ARRAY_COMPRESSION = None  # None, 'float16' or 'int16'
+ARRAY_DB_STEP = 0.01  # dB, step of the int16 compression
 
 # Sinusoids parameters
 MIN_AMPLI_DB = -100  # dB
@@ -53,4 +82,6 @@ CLOSING_TRANSIENT_FREQUENCY_FACTOR = 1.5  # no unit
 CLOSING_TRANSIENT_TIME_FACTOR = 2  # no unit
 FADE_OUT_FREQ = 50  # Hz
 FADE_IN_FREQ = 50  # Hz
+TRANSIENT_ENGINE = 'local'  # 'full' or 'local'
+TRANSIENT_MARGIN = 1.  # s
 CONNECTION_SIZE_TRANSIENT = (7, 7)  # no unit
@@ -105,9 +105,10 @@ def plot_time_frequency(a, t, f, v_min=0, v_max=1, c_map='Greys',
 
 def plot_stft(spectrogram: np.ndarray, v_min: float, v_max: float, title: str = '',
               c_map: str = 'afmhot', fig_size: (float, float) = (6., 4.),
-              full_screen: bool = False, cb: bool = True, ax: Optional[plt.Axes] = None):
+              full_screen: bool = False, cb: bool = True, ax: Optional[plt.Axes] = None, origin=(0, 0)):
+    # The origin is the (frequency, time) index of the first pixel, so that a window is drawn at its place
     frequency_vector = create_frequency_vector()
-    time_vector = create_time_vector(spectrogram.shape[-1])
+    time_vector = create_time_vector(origin[1] + spectrogram.shape[-1])
 
     if ax is None:
         fig = plt.figure(figsize=fig_size)
@@ -119,7 +120,9 @@ def plot_stft(spectrogram: np.ndarray, v_min: float, v_max: float, title: str =
 
     if len(spectrogram.shape) == 3:
         spectrogram = spectrogram[0, :, :]
-    im = ax.imshow(spectrogram, cmap=c_map, aspect='auto', vmin=v_min, vmax=v_max, origin='lower')
+    extent = (origin[1] - 0.5, origin[1] + spectrogram.shape[1] - 0.5,
+              origin[0] - 0.5, origin[0] + spectrogram.shape[0] - 0.5)
+    im = ax.imshow(spectrogram, cmap=c_map, aspect='auto', vmin=v_min, vmax=v_max, origin='lower', extent=extent)
 
     # Freq axis
     ax.yaxis.set_major_formatter(tick.FuncFormatter(lambda x, pos: format_freq(x, pos, frequency_vector)))
@@ -1,5 +1,21 @@
-from mmm.spectrograms import *
-from ..parameters import FS
+import json
+import time
+import types
+import torch
+import pickle
+import hashlib
+import numbers
+import weakref
+import threading
+import warnings
+import functools
+import numpy as np
+import scipy.io.wavfile as wav
+from pathlib import Path
+from typing import Optional
+from ..parameters import FS, CACHE_ENABLED, CACHE_BUDGET, ARRAY_COMPRESSION, ARRAY_DB_STEP, TIME_RESOLUTION, \
+    FREQUENCY_PRECISION, HOP_LENGTH
+from ..profiling import record
 
 
 def take_excerpt(file_path: Path, start: Optional[float], end: Optional[float]):
@@ -12,11 +28,20 @@ def take_excerpt(file_path: Path, start: Optional[float], end: Optional[float]):
 
 
 def read_wav(file_path: Path):
+    return normalize_samples(open_wav(file_path, mmap=False))
+
+
+def open_wav(file_path: Path, mmap=True):
+    # Raw samples, memory-mapped by default so that long recordings can be read block by block
     warnings.filterwarnings("ignore", category=wav.WavFileWarning)
-    fs, data = wav.read(file_path)
+    fs, data = wav.read(file_path, mmap=mmap)
 
     assert fs == FS, f"Sampling frequency must be {FS} Hz"
 
+    return data
+
+
+def normalize_samples(data: np.ndarray):
     if issubclass(data.dtype.type, numbers.Integral):
         data = data / np.iinfo(data.dtype).max
 
@@ -61,7 +86,389 @@ def try_to_read_wav(file_path):
     return data
 
 
-def load_or_compute(name, folder, load, function, extension='.pickle', verbose=True):
+class StoredArray:
+    def __init__(self, file_path: Path, mode='r'):
+        # Array of a .npy file, memory-mapped, with the metadata of the .json file next to it; items are read and
+        # written decoded, so that only the requested window is read from the disk
+        self.file_path = Path(file_path)
+        with open(self.file_path.with_suffix('.json')) as f:
+            self.metadata = json.load(f)
+        self.array = np.load(self.file_path, mmap_mode=mode)
+
+    @classmethod
+    def create(cls, file_path: Path, shape, compression=ARRAY_COMPRESSION, **metadata):
+        if compression not in [None, 'float16', 'int16']:
+            raise ValueError("Parameter 'compression' must be None, 'float16' or 'int16'")
+
+        metadata = dict({'time_resolution': TIME_RESOLUTION, 'frequency_precision': FREQUENCY_PRECISION,
+                         'hop_length': HOP_LENGTH, 'type': 'tensor', 'device': 'cpu'}, **metadata)
+        metadata.update({'shape': list(shape), 'compression': compression, 'db_step': ARRAY_DB_STEP,
+                         'dtype': {None: 'float32', 'float16': 'float16', 'int16': 'int16'}[compression]})
+        file_path = Path(file_path)
+        with open(file_path.with_suffix('.json'), 'w') as f:
+            json.dump(metadata, f)
+        np.lib.format.open_memmap(file_path, mode='w+', dtype=metadata['dtype'], shape=tuple(shape)).flush()
+        return cls(file_path, mode='r+')
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    def encode(self, values):
+        if isinstance(values, torch.Tensor):
+            values = values.detach().cpu().numpy()
+        if self.metadata['compression'] == 'int16':
+            # Values in dB by steps of db_step, saturated to the range of int16
+            steps = np.round(np.asarray(values, dtype=np.float64) / self.metadata['db_step'])
+            return np.clip(steps, np.iinfo(np.int16).min, np.iinfo(np.int16).max).astype(np.int16)
+        return np.asarray(values).astype(self.array.dtype)
+
+    def decode(self, values):
+        if self.metadata['compression'] == 'int16':
+            values = values * np.float32(self.metadata['db_step'])
+        values = np.array(values, dtype=np.float32)
+        return torch.from_numpy(values) if self.metadata['type'] == 'tensor' else values
+
+    def __getitem__(self, item):
+        return self.decode(self.array[item])
+
+    def __setitem__(self, item, values):
+        self.array[item] = self.encode(values)
+
+    def flush(self):
+        self.array.flush()
+
+    def load(self):
+        # Whole array; without compression it stays memory-mapped on the CPU, copy-on-write
+        if self.metadata['compression'] is None:
+            values = np.load(self.file_path, mmap_mode='c')
+            if self.metadata['type'] == 'tensor':
+                values = torch.from_numpy(values)
+        else:
+            values = self[...]
+        device = self.metadata['device']
+        if isinstance(values, torch.Tensor) and torch.device(device).type == 'cuda' and torch.cuda.is_available():
+            values = values.to(device)
+        return values
+
+    def window_slices(self, time_range=None, frequency_range=None):
+        return window_slices(self.shape, time_range, frequency_range, self.metadata['time_resolution'],
+                             self.metadata['frequency_precision'])
+
+
+def window_slices(shape, time_range=None, frequency_range=None, time_resolution=TIME_RESOLUTION,
+                  frequency_precision=FREQUENCY_PRECISION):
+    # Frequency and time slices of the pixels of a spectrogram of the given shape in the ranges, in s and Hz
+    slices = []
+    for size, bounds, precision in [(shape[-2], frequency_range, frequency_precision),
+                                    (shape[-1], time_range, time_resolution)]:
+        if bounds is None:
+            slices.append(slice(0, size))
+        else:
+            start = min(max(int(np.floor(bounds[0] / precision)), 0), size)
+            stop = min(max(int(np.ceil(bounds[1] / precision)) + 1, start), size)
+            slices.append(slice(start, stop))
+    return tuple(slices)
+
+
+def read_window(spectrogram, time_range=None, frequency_range=None):
+    # Pixels of a tensor or of a StoredArray in the ranges, in s and Hz, and the (frequency, time) index of the first
+    if isinstance(spectrogram, StoredArray):
+        slices = spectrogram.window_slices(time_range, frequency_range)
+    else:
+        slices = window_slices(spectrogram.shape, time_range, frequency_range)
+    return spectrogram[(Ellipsis,) + slices], (slices[0].start, slices[1].start)
+
+
+def save_array(file_path: Path, array, compression=ARRAY_COMPRESSION, **metadata):
+    if isinstance(array, torch.Tensor):
+        metadata = dict({'type': 'tensor', 'device': str(array.device)}, **metadata)
+    else:
+        metadata = dict({'type': 'ndarray'}, **metadata)
+    stored = StoredArray.create(file_path, array.shape, compression, **metadata)
+    stored[...] = array
+    stored.flush()
+    return stored
+
+
+def open_array(file_path: Path):
+    return StoredArray(file_path)
+
+
+# Keys of the results returned by the caches, by id of the result, so that a result passed to a later stage is
+# identified by its key instead of being hashed again; results must then not be modified in place
+RESULT_KEYS = {}
+# Attributes that nnAudio layers set when they are called, from the last signal they transformed
+LAYER_CALL_STATE = {'num_samples', 'w_sum', 'nonzero_indices'}
+
+
+def remember_key(result, key):
+    try:
+        reference = weakref.ref(result, lambda _, result_id=id(result): RESULT_KEYS.pop(result_id, None))
+    except TypeError:
+        return
+    RESULT_KEYS[id(result)] = (reference, key)
+
+
+def known_key(value):
+    entry = RESULT_KEYS.get(id(value))
+    if entry is not None and entry[0]() is value:
+        return entry[1]
+    return None
+
+
+def is_data(value):
+    return value is None or isinstance(value, (bool, numbers.Number, str, bytes, Path, np.generic, np.ndarray,
+                                               torch.Tensor, list, tuple, dict))
+
+
+def code_names(code):
+    # Global names read by the code and by the functions it defines
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            names |= code_names(constant)
+    return names
+
+
+def update_code(h, code):
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            update_code(h, constant)
+        elif isinstance(constant, frozenset):
+            h.update(repr(sorted(constant, key=repr)).encode())
+        else:
+            h.update(repr(constant).encode())
+
+
+def update_digest(h, value, inputs, seen):
+    # Feeds the content of the value to the hash object; known results are fed by key, which is added to inputs.
+    # Containers already fed are kept in seen by id until the end, so that the id of a temporary one is not reused
+    key = known_key(value)
+    if key is not None:
+        inputs.add(key)
+        h.update(('key:%s' % key).encode())
+    elif value is None or isinstance(value, (bool, numbers.Number, str, bytes, Path, np.generic)):
+        h.update(('%s:%r' % (type(value).__name__, value)).encode())
+    elif isinstance(value, np.ndarray):
+        h.update(('ndarray:%s:%s' % (value.dtype.str, value.shape)).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, torch.Tensor):
+        update_digest(h, value.detach().cpu().numpy(), inputs, seen)
+    elif id(value) in seen:
+        h.update(b'seen')
+    else:
+        seen[id(value)] = value
+        if isinstance(value, (list, tuple, set, frozenset)):
+            h.update(('%s:%d' % (type(value).__name__, len(value))).encode())
+            for item in sorted(value, key=repr) if isinstance(value, (set, frozenset)) else value:
+                update_digest(h, item, inputs, seen)
+        elif isinstance(value, dict):
+            h.update(('dict:%d' % len(value)).encode())
+            for item in sorted(value, key=repr):
+                update_digest(h, item, inputs, seen)
+                update_digest(h, value[item], inputs, seen)
+        elif isinstance(value, types.FunctionType):
+            update_function_digest(h, value, inputs, seen)
+        elif isinstance(value, types.MethodType):
+            update_digest(h, value.__func__, inputs, seen)
+            update_digest(h, value.__self__, inputs, seen)
+        elif isinstance(value, functools.partial):
+            update_digest(h, (value.func, value.args, value.keywords), inputs, seen)
+        elif isinstance(value, (type, types.ModuleType, types.BuiltinFunctionType)):
+            h.update(('%s:%s' % (type(value).__name__, getattr(value, '__qualname__', value.__name__))).encode())
+        elif isinstance(value, torch.nn.Module):
+            # Layers by their configuration and kernels, which other threads may be calling at the same time
+            h.update(('module:%s' % type(value).__qualname__).encode())
+            update_digest(h, {name: item for name, item in list(vars(value).items()) if name not in LAYER_CALL_STATE},
+                          inputs, seen)
+        elif hasattr(value, '__dict__'):
+            h.update(('object:%s' % type(value).__qualname__).encode())
+            update_digest(h, vars(value), inputs, seen)
+        else:
+            h.update(('%s:%r' % (type(value).__name__, value)).encode())
+
+
+def update_function_digest(h, function, inputs, seen):
+    # Code, defaults and closure of the function, and the globals it reads: data and the functions of this package
+    # or of the module of the function are fed by content, anything else by name
+    update_code(h, function.__code__)
+    update_digest(h, (function.__defaults__, function.__kwdefaults__), inputs, seen)
+    for cell in function.__closure__ or ():
+        try:
+            update_digest(h, cell.cell_contents, inputs, seen)
+        except ValueError:
+            h.update(b'empty')
+    for name in sorted(code_names(function.__code__)):
+        if name not in function.__globals__:
+            continue
+        value = function.__globals__[name]
+        h.update(('global:%s' % name).encode())
+        if known_key(value) is not None or is_data(value):
+            update_digest(h, value, inputs, seen)
+        elif isinstance(value, types.FunctionType) and \
+                (str(value.__module__).startswith('mmm.') or value.__module__ == function.__module__):
+            update_digest(h, value, inputs, seen)
+
+
+class ResultCache:
+    def __init__(self, folder: Path, budget=CACHE_BUDGET):
+        # Results stored in the array store or as pickles, named by their key, with an index of their stage, size, last
+        # access, digest of their content and the keys of the results they were computed from; the results of earlier
+        # inputs or parameters of a stage stay until they are evicted, and the last key of each stage is kept
+        self.folder = Path(folder)
+        self.budget = budget
+        self.lock = threading.RLock()
+        self.statistics = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+        try:
+            with open(self.folder / 'index.json') as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            index = {'entries': {}, 'stages': {}}
+        self.entries = index['entries']
+        self.stages = index['stages']
+
+    def key(self, name, function):
+        h = hashlib.blake2b(digest_size=16)
+        inputs = set()
+        update_digest(h, (name, function), inputs, {})
+        return h.hexdigest(), sorted(inputs)
+
+    @staticmethod
+    def digest(result):
+        h = hashlib.blake2b(digest_size=16)
+        update_digest(h, result, set(), {})
+        return h.hexdigest()
+
+    def path(self, key, extension='.pickle'):
+        return self.folder / (key + extension)
+
+    def size(self):
+        return sum(entry['size'] for entry in self.entries.values())
+
+    def stats(self):
+        return dict(self.statistics, entries=len(self.entries), size=self.size())
+
+    def save_index(self):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        with open(self.folder / 'index.json', 'w') as f:
+            json.dump({'entries': self.entries, 'stages': self.stages}, f)
+
+    def get(self, key, verbose=False, name=''):
+        if key not in self.entries:
+            return None
+        if self.entries[key].get('format') == 'npy':
+            start = time.time()
+            try:
+                result = StoredArray(self.path(key, '.npy')).load()
+            except (FileNotFoundError, ValueError):
+                result = None
+            if verbose and result is not None:
+                print('Time to open %s: %.3f seconds' % (name, time.time() - start))
+        else:
+            result = try_to_load_pickle(self.path(key), verbose=verbose, name=name)
+        if result is None:
+            self.remove(key)
+        else:
+            self.entries[key]['access'] = time.time()
+        return result
+
+    def put(self, name, key, inputs, result):
+        # Float arrays in the array store, memory-mapped when loaded, anything else pickled
+        self.folder.mkdir(parents=True, exist_ok=True)
+        if isinstance(result, (np.ndarray, torch.Tensor)) and result.dtype in [np.float32, torch.float32]:
+            save_array(self.path(key, '.npy'), result)
+            entry_format = 'npy'
+            size = self.path(key, '.npy').stat().st_size + self.path(key, '.json').stat().st_size
+        else:
+            save_pickle(self.path(key), result)
+            entry_format = 'pickle'
+            size = self.path(key).stat().st_size
+        self.entries[key] = {'name': name, 'size': size, 'access': time.time(), 'inputs': inputs,
+                             'format': entry_format, 'digest': self.digest(result)}
+
+    def remove(self, key):
+        self.entries.pop(key, None)
+        for extension in ['.pickle', '.npy', '.json']:
+            self.path(key, extension).unlink(missing_ok=True)
+        self.stages = {name: stage_key for name, stage_key in self.stages.items() if stage_key in self.entries}
+
+    def invalidate(self, key):
+        # Removes the result and, transitively, the results computed from it
+        stale = [key]
+        while len(stale) > 0:
+            key = stale.pop()
+            if key in self.entries:
+                self.remove(key)
+                self.statistics['invalidations'] += 1
+                stale.extend(other for other, entry in self.entries.items() if key in entry['inputs'])
+
+    def invalidate_dependents(self, key):
+        # Results computed from the one of the key, transitively, when it was computed again and changed
+        for other in [other for other, entry in self.entries.items() if key in entry['inputs']]:
+            self.invalidate(other)
+
+    def evict(self, keep=None):
+        # Least recently used results removed until the cache fits in its budget
+        size = self.size()
+        for key in sorted(self.entries, key=lambda k: self.entries[k]['access']):
+            if size <= self.budget:
+                break
+            if key != keep:
+                size -= self.entries[key]['size']
+                self.remove(key)
+                self.statistics['evictions'] += 1
+
+    def load_or_compute(self, name, function, load=True, verbose=True):
+        # The index is locked, but not the computation, so that stages running on other threads share the cache
+        key, inputs = self.key(name, function)
+
+        with self.lock:
+            result = self.get(key, verbose=verbose, name=name) if load else None
+        hit = result is not None
+        if not hit:
+            result = function()
+        record(cache='hit' if hit else 'miss')
+
+        with self.lock:
+            if hit:
+                self.statistics['hits'] += 1
+            else:
+                self.statistics['misses'] += 1
+                # A stage computed again without loading, e.g. a random one, may give another result for the same
+                # key; the results computed from the old one no longer match their inputs
+                previous = self.entries.get(key, {}).get('digest')
+                self.put(name, key, inputs, result)
+                if previous is not None and previous != self.entries[key]['digest']:
+                    self.invalidate_dependents(key)
+
+            self.stages[name] = key
+            self.evict(keep=key)
+            self.save_index()
+
+        remember_key(result, key)
+        return result
+
+
+RESULT_CACHES = {}
+RESULT_CACHES_LOCK = threading.Lock()
+
+
+def result_cache(folder: Path):
+    # One cache per folder, also when the first stages using it run on several threads
+    with RESULT_CACHES_LOCK:
+        if Path(folder) not in RESULT_CACHES:
+            RESULT_CACHES[Path(folder)] = ResultCache(Path(folder) / 'cache')
+        return RESULT_CACHES[Path(folder)]
+
+
+def load_or_compute(name, folder, load, function, extension='.pickle', verbose=True, cache=CACHE_ENABLED):
+    if cache and function is not None:
+        # Results keyed by the content of the stage, so that changing its inputs, code or parameters recomputes it
+        return result_cache(folder).load_or_compute(name, function, load=load.get(name, False), verbose=verbose)
+
     path = folder / (name + extension)
 
     if load.get(name, False):
@@ -1,102 +1,165 @@
 from mmm.spectrograms.processing import *
-from .io import load_or_compute
+from mmm.spectrograms.layers import create_stft_layer, apply_stft_layer, column_samples, stft_length
+from .io import load_or_compute, normalize_samples, StoredArray
+from .scheduler import StageGraph
+from ..profiling import stage
+
+
+# Stages of the morphology with the spectrograms they read; after the reconstruction by erosion, the noise,
+# sinusoids and transient branches are independent
+MORPHOLOGY_STAGES = {
+    'closing': ['input'],
+    'reconstruction_erosion': ['closing', 'input'],
+    'opening': ['reconstruction_erosion'],
+    'vertical_thin': ['reconstruction_erosion'],
+    'vertical_top_hat': ['vertical_thin'],
+    'vertical_threshold': ['reconstruction_erosion', 'vertical_top_hat'],
+    'horizontal_filtered': ['vertical_threshold'],
+    'horizontal_thin': ['reconstruction_erosion'],
+    'horizontal_top_hat': ['horizontal_thin'],
+    'horizontal_threshold': ['reconstruction_erosion', 'horizontal_top_hat'],
+    'vertical_filtered': ['horizontal_threshold'],
+}
+
+
+def morphology_functions(parameters):
+    return {
+        'closing': lambda x: apply_closing(x, parameters),
+        'reconstruction_erosion': lambda closing, x: apply_reconstruction_by_erosion(closing, x, parameters),
+        'opening': lambda x: apply_opening(x, parameters),
+        'vertical_thin': apply_vertical_thinning,
+        'vertical_top_hat': apply_vertical_top_hat,
+        'vertical_threshold': apply_top_hat_threshold,
+        'horizontal_filtered': remove_small_horizontal_lines,
+        'horizontal_thin': apply_horizontal_thinning,
+        'horizontal_top_hat': apply_horizontal_top_hat,
+        'horizontal_threshold': apply_top_hat_threshold,
+        'vertical_filtered': remove_small_vertical_lines,
+    }
+
+
+def morphology_stage(name, function, arrays_folder, load):
+    # Stage called with the spectrograms it reads, which are also the only arrays its cache key depends on
+    def compute(*inputs):
+        return load_or_compute(name, arrays_folder, load, lambda: function(*inputs))
+    return compute
+
+
+def morphology_graph(spectrograms, paths, load, components, parameters):
+    # Stages of the enabled components; the spectrograms of the stages left out must already be in spectrograms
+    functions = morphology_functions(parameters)
+    graph = StageGraph(spectrograms)
+    for component in ['input', 'noise', 'sinusoids', 'transient']:
+        if components[component]:
+            for name in STREAM_STAGES[component]:
+                graph.add(name, morphology_stage(name, functions[name], paths['arrays_folder'], load),
+                          after=MORPHOLOGY_STAGES[name])
+    return graph
+
+
+def apply_morphology(spectrograms, paths, load, components, parameters, engine=SCHEDULER_ENGINE,
+                     workers=SCHEDULER_WORKERS):
+    print('\nMorphology')
+    graph = morphology_graph(spectrograms, paths, load, components, parameters)
+    results = graph.run(engine=engine, workers=workers)
+    spectrograms.update((name, results[name]) for name in graph.stages)
+    return results
+
+
+# Streaming
+STREAM_STAGES = {
+    'input': ['closing', 'reconstruction_erosion'],
+    'noise': ['opening'],
+    'sinusoids': ['vertical_thin', 'vertical_top_hat', 'vertical_threshold', 'horizontal_filtered'],
+    'transient': ['horizontal_thin', 'horizontal_top_hat', 'horizontal_threshold', 'vertical_filtered'],
+}
+
+
+def stream_halo(components, parameters):
+    # Every stage reads its input over its own time support, so a chain needs the sum of the supports
+    support = time_support(parameters)
+    input_halo = sum(support[stage] for stage in STREAM_STAGES['input'])
+    halo = input_halo
+    for component in ['noise', 'sinusoids', 'transient']:
+        if components[component]:
+            halo = max(halo, input_halo + sum(support[stage] for stage in STREAM_STAGES[component]))
+
+    return halo
+
+
+def apply_stft_columns(signal, stft_layer, start, end):
+    first, last = column_samples(stft_layer, start, end)
+    block = np.zeros(last - first, dtype=np.float32)
+    block_start, block_end = max(first, 0), min(last, len(signal))
+    block[block_start - first: block_end - first] = normalize_samples(signal[block_start: block_end])
+
+    return apply_stft_layer(block, stft_layer, verbose=False)
+
+
+def apply_morphology_chunk(spectrogram, components, parameters):
+    chunk = {'input': spectrogram}
+
+    chunk['closing'] = apply_closing(spectrogram, parameters, verbose=False)
+    chunk['reconstruction_erosion'] = apply_reconstruction_by_erosion(chunk['closing'], spectrogram, verbose=False)
 
-
-def apply_morphology_input(spectrograms, arrays_folder, load, parameters):
-    spectrogram = spectrograms['input']
-
-    print('\nMorphology - Input')
-
-    # Closing
-    spectrogram_closing = load_or_compute('closing', arrays_folder, load,
-                                          lambda: apply_closing(spectrogram, parameters))
-
-    # Reconstruction by erosion
-    spectrogram_reconstruction_erosion = load_or_compute('reconstruction_erosion', arrays_folder, load,
-                                                         lambda: apply_reconstruction_by_erosion(spectrogram_closing,
-                                                                                                 spectrogram,
-                                                                                                 parameters))
-
-    spectrograms['closing'] = spectrogram_closing
-    spectrograms['reconstruction_erosion'] = spectrogram_reconstruction_erosion
-
-
-def apply_morphology_noise(spectrograms, arrays_folder, load, parameters):
-    print('\nMorphology - Noise')
-
-    # Opening for get noise component
-    spectrogram_opening = load_or_compute('opening', arrays_folder, load,
-                                          lambda: apply_opening(spectrograms['reconstruction_erosion'], parameters))
-
-    spectrograms['opening'] = spectrogram_opening
-
-
-def apply_morphology_sinusoids(spectrograms, arrays_folder, load):
-    # Sinusoids
-    print('\nMorphology - Sinusoids')
-
-    # Vertical Thinning
-    spectrogram_vertical_thin = load_or_compute('vertical_thin', arrays_folder, load,
-                                                lambda: apply_vertical_thinning(spectrograms['reconstruction_erosion']))
-
-    # Vertical top-hat
-    spectrogram_vertical_top_hat = load_or_compute('vertical_top_hat', arrays_folder, load,
-                                                   lambda: apply_vertical_top_hat(spectrogram_vertical_thin))
-
-    # Vertical threshold
-    spectrogram_vertical_threshold = load_or_compute('vertical_threshold', arrays_folder, load,
-                                                     lambda: apply_top_hat_threshold(
-                                                         spectrograms['reconstruction_erosion'],
-                                                         spectrogram_vertical_top_hat))
-
-    # Remove small horizontal lines
-    spectrogram_horizontal_filtered = load_or_compute('horizontal_filtered', arrays_folder, load,
-                                                      lambda: remove_small_horizontal_lines(
-                                                          spectrogram_vertical_threshold))
-
-    spectrograms['vertical_thin'] = spectrogram_vertical_thin
-    spectrograms['vertical_top_hat'] = spectrogram_vertical_top_hat
-    spectrograms['vertical_threshold'] = spectrogram_vertical_threshold
-    spectrograms['horizontal_filtered'] = spectrogram_horizontal_filtered
-
-
-def apply_morphology_transient(spectrograms, arrays_folder, load):
-    spectrogram_reconstruction_erosion = spectrograms['reconstruction_erosion']
-
-    # Transient
-    print('\nMorphology - Transient')
-
-    # Horizontal Thinning
-    spectrogram_horizontal_thin = load_or_compute('horizontal_thin', arrays_folder, load,
-                                                  lambda: apply_horizontal_thinning(spectrogram_reconstruction_erosion))
-
-    # Horizontal top-hat
-    spectrogram_horizontal_top_hat = load_or_compute('horizontal_top_hat', arrays_folder, load,
-                                                     lambda: apply_horizontal_top_hat(spectrogram_horizontal_thin))
-
-    # Horizontal threshold
-    spectrogram_horizontal_threshold = load_or_compute('horizontal_threshold', arrays_folder, load,
-                                                       lambda: apply_top_hat_threshold(
-                                                           spectrogram_reconstruction_erosion,
-                                                           spectrogram_horizontal_top_hat))
-
-    # Remove small vertical lines
-    spectrogram_vertical_filtered = load_or_compute('vertical_filtered', arrays_folder, load,
-                                                    lambda: remove_small_vertical_lines(
-                                                        spectrogram_horizontal_threshold))
-
-    spectrograms['horizontal_thin'] = spectrogram_horizontal_thin
-    spectrograms['horizontal_top_hat'] = spectrogram_horizontal_top_hat
-    spectrograms['horizontal_threshold'] = spectrogram_horizontal_threshold
-    spectrograms['vertical_filtered'] = spectrogram_vertical_filtered
-
-
-def apply_morphology(spectrograms, paths, load, components, parameters):
-    if components['input']:
-        apply_morphology_input(spectrograms, paths['arrays_folder'], load, parameters)
     if components['noise']:
-        apply_morphology_noise(spectrograms, paths['arrays_folder'], load, parameters)
+        chunk['opening'] = apply_opening(chunk['reconstruction_erosion'], parameters, verbose=False)
+
     if components['sinusoids']:
-        apply_morphology_sinusoids(spectrograms, paths['arrays_folder'], load)
+        chunk['vertical_thin'] = apply_vertical_thinning(chunk['reconstruction_erosion'], verbose=False)
+        chunk['vertical_top_hat'] = apply_vertical_top_hat(chunk['vertical_thin'], verbose=False)
+        chunk['vertical_threshold'] = apply_top_hat_threshold(chunk['reconstruction_erosion'],
+                                                              chunk['vertical_top_hat'], verbose=False)
+        chunk['horizontal_filtered'] = remove_small_horizontal_lines(chunk['vertical_threshold'], verbose=False)
+
     if components['transient']:
-        apply_morphology_transient(spectrograms, paths['arrays_folder'], load)
+        chunk['horizontal_thin'] = apply_horizontal_thinning(chunk['reconstruction_erosion'], verbose=False)
+        chunk['horizontal_top_hat'] = apply_horizontal_top_hat(chunk['horizontal_thin'], verbose=False)
+        chunk['horizontal_threshold'] = apply_top_hat_threshold(chunk['reconstruction_erosion'],
+                                                                chunk['horizontal_top_hat'], verbose=False)
+        chunk['vertical_filtered'] = remove_small_vertical_lines(chunk['horizontal_threshold'], verbose=False)
+
+    return chunk
+
+
+def apply_morphology_streaming(spectrograms, signal, paths, components, parameters, stft_layer=None,
+                               chunk_duration=STREAM_CHUNK_DURATION):
+    # Same stages as apply_morphology, computed from the signal on overlapping time chunks and stitched into the array
+    # store in the arrays folder, so that memory is bounded by the chunk size instead of the length of the signal.
+    # The output is not guaranteed to equal the one of apply_morphology: reconstructions without an iteration bound
+    # are assumed to stay within STREAM_RECONSTRUCTION_SUPPORT, and the thinning replaces infinite dilations by the
+    # minimum of the whole image, which a chunk only sees in part
+    print('\nMorphology - Streaming')
+    start_full = time.time()
+
+    if stft_layer is None:
+        stft_layer = create_stft_layer(center=False, iSTFT=False)
+    elif stft_layer.center:
+        raise ValueError("Parameter 'stft_layer' must not be centred")
+
+    n_columns = stft_length(len(signal), stft_layer)
+    chunk_size = max(int(round(chunk_duration / TIME_RESOLUTION)), 1)
+    halo = stream_halo(components, parameters)
+
+    outputs = {}
+    for start in range(0, n_columns, chunk_size):
+        end = min(start + chunk_size, n_columns)
+        window_start, window_end = max(start - halo, 0), min(end + halo, n_columns)
+
+        with stage('morphology_chunk', start=start, end=end, halo=halo):
+            spectrogram = apply_stft_columns(signal, stft_layer, window_start, window_end)
+            chunk = apply_morphology_chunk(spectrogram, components, parameters)
+
+        for name, array in chunk.items():
+            if name not in outputs:
+                outputs[name] = StoredArray.create(paths['arrays_folder'] / (name + '.npy'),
+                                                   (array.shape[0], n_columns))
+            outputs[name][:, start: end] = array[:, start - window_start: end - window_start]
+
+        print('Columns %d to %d of %d done (halo of %d columns)' % (start, end, n_columns, halo))
+
+    for name, output in outputs.items():
+        output.flush()
+        spectrograms[name] = output.load()
+
+    print('Time to apply streaming morphology: %.3f seconds' % (time.time() - start_full))
@@ -1,16 +1,23 @@
+import matplotlib.pyplot as plt
+import matplotlib as mpl
+from typing import Optional
 from mmm.spectrograms import *
 from mmm.spectrograms.plot import plot_stft, plot_lines, plot_two_spectrogram
 from mmm.spectrograms.parameters import MIN_DB
+from mmm.spectrograms.procedures.io import read_window
 
 
 def plot_single(spectrogram, name, title, images_folder, v_min: Optional[float] = MIN_DB, v_max: Optional[float] = 0,
                 c_map='afmhot', paper=None):
+    # Only the window shown is read, from the disk when the spectrogram is a StoredArray
+    paper_limits = {} if paper is None else paper
+    spectrogram, origin = read_window(spectrogram, paper_limits.get('x_lim', None), paper_limits.get('y_lim', None))
     if v_min is None:
         v_min = spectrogram.min()
     if v_max is None:
         v_max = spectrogram.max()
     fig = plot_stft(spectrogram.cpu().numpy(), v_min=v_min, v_max=v_max, c_map=c_map, title=title,
-                    fig_size=paper.get('fig_size', (6., 4.)) if paper is not None else (6., 4.))
+                    fig_size=paper.get('fig_size', (6., 4.)) if paper is not None else (6., 4.), origin=origin)
 
     if paper is not None:
         from mmm.spectrograms.parameters import TIME_RESOLUTION, FREQUENCY_PRECISION
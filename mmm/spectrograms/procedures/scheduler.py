@@ -0,0 +1,131 @@
+import time
+import torch
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from ..parameters import DEVICE, SCHEDULER_ENGINE, SCHEDULER_WORKERS
+from ..profiling import stage
+from ..utils import get_device
+
+
+class StageGraph:
+    def __init__(self, results=None):
+        # Stages by name, with the names of the stages they depend on; a stage is a function called with the results
+        # of these stages, in order, and the results of the ones that are not in the graph are given in results
+        self.stages = {}
+        self.results = dict(results or {})
+        self.timings = {}
+        self.wall_time = 0.
+
+    def add(self, name, function, after=()):
+        if name in self.stages:
+            raise ValueError("Parameter 'name' must not be the name of a stage already in the graph")
+        self.stages[name] = (function, list(after))
+        return self
+
+    def update(self, graph):
+        for name, (function, after) in graph.stages.items():
+            self.add(name, function, after)
+        for name, result in graph.results.items():
+            self.results.setdefault(name, result)
+        return self
+
+    def dependencies(self, name):
+        return [before for before in self.stages[name][1] if before in self.stages]
+
+    def order(self):
+        # Topological order, keeping the order of declaration among the stages that are ready
+        order = []
+        remaining = list(self.stages)
+        while len(remaining) > 0:
+            ready = [name for name in remaining if all(before in order for before in self.dependencies(name))]
+            if len(ready) == 0:
+                raise ValueError('Stages %s depend on each other' % ', '.join(remaining))
+            order.extend(ready)
+            remaining = [name for name in remaining if name not in ready]
+        return order
+
+    def inputs(self, name):
+        # Read when the stage is submitted, so that stages on other threads only see the results they are given
+        return [self.results[before] for before in self.stages[name][1]]
+
+    def run_stage(self, name, inputs, stream=None):
+        start = time.time()
+        with stage(name):
+            if stream is None:
+                result = self.stages[name][0](*inputs)
+            else:
+                # Kernels of the stage queued on its own stream, finished before the stages after it start
+                with torch.cuda.stream(stream):
+                    result = self.stages[name][0](*inputs)
+                stream.synchronize()
+        self.timings[name] = (start, time.time())
+        return result
+
+    def run(self, engine=SCHEDULER_ENGINE, workers=SCHEDULER_WORKERS, device=DEVICE, verbose=True):
+        if engine not in ['sequential', 'thread']:
+            raise ValueError("Parameter 'engine' must be 'sequential' or 'thread'")
+
+        start = time.time()
+        order = self.order()
+        missing = sorted({before for name in order for before in self.stages[name][1]
+                          if before not in self.stages and before not in self.results})
+        if len(missing) > 0:
+            raise ValueError('Stages %s are neither in the graph nor in its results' % ', '.join(missing))
+
+        if engine == 'sequential' or workers <= 1:
+            for name in order:
+                self.results[name] = self.run_stage(name, self.inputs(name))
+        else:
+            # Every stage submitted as soon as the stages it depends on are done
+            device = get_device(device)
+            streams = torch.device(device).type == 'cuda' and torch.cuda.is_available()
+            remaining = order
+            running = {}
+            with ThreadPoolExecutor(workers) as pool:
+                while len(remaining) > 0 or len(running) > 0:
+                    ready = [name for name in remaining
+                             if all(before in self.results for before in self.dependencies(name))]
+                    for name in ready:
+                        stream = torch.cuda.Stream(device) if streams else None
+                        running[pool.submit(self.run_stage, name, self.inputs(name), stream)] = name
+                    remaining = [name for name in remaining if name not in ready]
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.results[running.pop(future)] = future.result()
+        self.wall_time = time.time() - start
+
+        if verbose:
+            self.report()
+
+        return self.results
+
+    def duration(self, name):
+        if name not in self.timings:
+            return 0.
+        return self.timings[name][1] - self.timings[name][0]
+
+    def critical_path(self):
+        # Chain of dependent stages with the longest total duration in the last run, which bounds the time of any
+        # schedule of the graph
+        finish = {}
+        previous = {}
+        for name in self.order():
+            previous[name] = max(self.dependencies(name), key=lambda before: finish[before], default=None)
+            finish[name] = self.duration(name) + (finish[previous[name]] if previous[name] is not None else 0.)
+        if len(finish) == 0:
+            return [], 0.
+
+        name = max(finish, key=lambda last: finish[last])
+        length = finish[name]
+        path = []
+        while name is not None:
+            path.append(name)
+            name = previous[name]
+        return path[::-1], length
+
+    def report(self):
+        path, length = self.critical_path()
+        print('\nStages: %d, time: %.3f seconds, sum of the stage times: %.3f seconds'
+              % (len(self.timings), self.wall_time, sum(self.duration(name) for name in self.timings)))
+        print('Critical path: %s (%.3f seconds)' % (' -> '.join(path), length))
@@ -1,17 +1,22 @@
-from .. import *
+import torch
+import numpy as np
 
 from ..layers import apply_stft_layer
 from ..synthesis import synthesize_noise_mask, synthesize_white_noise, synthesize_sinusoids, synthesize_transient
 from ..processing import get_lines, filter_lines
 from ..utils import get_duration, to_db
+from ..parameters import SCHEDULER_ENGINE, SCHEDULER_WORKERS
 
 from .io import load_or_compute
+from .scheduler import StageGraph
 
 
-def synthesize_noise_signal(signals, spectrograms, paths, load, stft_layer):
+def synthesize_noise_signal(x, opening, paths, load, stft_layer):
+    # Each branch reads the arrays it is given and returns the signals, spectrograms and lines it computes, so that
+    # branches on other threads share nothing and the cache keys of their stages only depend on these arrays
     print('\nSynthesis - Noise')
 
-    n = signals['input'].size
+    n = x.size
 
     # White noise
     white_noise = load_or_compute('white_noise', paths['arrays_folder'], load, lambda: synthesize_white_noise(n))
@@ -21,64 +26,50 @@ def synthesize_noise_signal(signals, spectrograms, paths, load, stft_layer):
 
     # Noise
     filtered_noise = load_or_compute('filtered_noise', paths['audio_folder'], load,
-                                     lambda: synthesize_noise_mask(white_noise_stft, spectrograms['opening'],
-                                                                   stft_layer, verbose=True),
+                                     lambda: synthesize_noise_mask(white_noise_stft, opening, stft_layer, verbose=True),
                                      extension='.wav')
 
-    signals['white_noise'] = white_noise
-    signals['filtered_noise'] = filtered_noise
-
     spectrogram_white_noise = to_db(torch.sqrt(white_noise_stft[:, :, 0]**2 + white_noise_stft[:, :, 1]**2))
     spectrogram_filtered_noise = apply_stft_layer(filtered_noise, stft_layer, verbose=True, input_name='filtered noise')
 
-    spectrograms['white_noise'] = spectrogram_white_noise
-    spectrograms['filtered_noise'] = spectrogram_filtered_noise
+    return {'signals': {'white_noise': white_noise, 'filtered_noise': filtered_noise},
+            'spectrograms': {'white_noise': spectrogram_white_noise, 'filtered_noise': spectrogram_filtered_noise}}
 
 
-def synthesize_sinusoids_signal(lines, signals, spectrograms, paths, load, stft_layer):
+def synthesize_sinusoids_signal(horizontal_filtered, paths, load, stft_layer):
     print('\nSynthesis - Sinusoids')
 
     lines_sinusoids = load_or_compute('lines_sinusoids', paths['arrays_folder'], load,
-                                      lambda: get_lines(spectrograms['horizontal_filtered'], 'time'))
+                                      lambda: get_lines(horizontal_filtered, 'time'))
     filtered_lines = filter_lines(lines_sinusoids, 1)
-    lines['sinusoids'] = lines_sinusoids
-    lines['filtered_sinusoids'] = filtered_lines
 
     sinusoids = load_or_compute('sinusoids', paths['audio_folder'], load,
                                 lambda: synthesize_sinusoids(filtered_lines), extension='.wav')
 
-    signals['sinusoids'] = sinusoids
-
     spectrogram_sinusoids = apply_stft_layer(sinusoids, stft_layer, verbose=True, input_name='sinusoids')
 
-    spectrograms['sinusoids'] = spectrogram_sinusoids
+    return {'signals': {'sinusoids': sinusoids}, 'spectrograms': {'sinusoids': spectrogram_sinusoids},
+            'lines': {'sinusoids': lines_sinusoids, 'filtered_sinusoids': filtered_lines}}
 
 
-def synthesize_transient_signal(lines, signals, spectrograms, paths, load, stft_layer):
+def synthesize_transient_signal(x, vertical_filtered, paths, load, stft_layer):
     print('\nSynthesis - Transient')
 
     lines_transient = load_or_compute('lines_transient', paths['arrays_folder'], load,
-                                      lambda: get_lines(spectrograms['vertical_filtered'], 'frequency'))
+                                      lambda: get_lines(vertical_filtered, 'frequency'))
     filtered_lines = filter_lines(lines_transient, 0)
-    lines['transient'] = lines_transient
-    lines['filtered_transient'] = filtered_lines
 
-    duration = get_duration(signals['input'])
+    duration = get_duration(x)
     transient = load_or_compute('transient', paths['audio_folder'], load,
                                 lambda: synthesize_transient(filtered_lines, duration), extension='.wav')
 
-    signals['transient'] = transient
-
     spectrogram_transient = apply_stft_layer(transient, stft_layer, verbose=True, input_name='transient')
 
-    spectrograms['transient'] = spectrogram_transient
+    return {'signals': {'transient': transient}, 'spectrograms': {'transient': spectrogram_transient},
+            'lines': {'transient': lines_transient, 'filtered_transient': filtered_lines}}
 
 
-def synthesize_output_signal(signals, spectrograms, stft_layer):
-    filtered_noise = signals['filtered_noise']
-    sinusoids = signals['sinusoids']
-    transient = signals['transient']
-
+def synthesize_output_signal(filtered_noise, sinusoids, transient, stft_layer):
     print('\nSynthesis - Output')
     output_size = max(len(filtered_noise), len(sinusoids), len(transient))
 
@@ -87,19 +78,45 @@ def synthesize_output_signal(signals, spectrograms, stft_layer):
     output[:sinusoids.size] += sinusoids
     output[:transient.size] += transient
 
-    signals['output'] = output
-
     spectrogram_output = apply_stft_layer(output, stft_layer, verbose=True, input_name='output')
 
-    spectrograms['output'] = spectrogram_output
+    return {'signals': {'output': output}, 'spectrograms': {'output': spectrogram_output}}
 
 
-def synthesize_signals(lines, signals, spectrograms, paths, load, components, stft_layer):
+def synthesis_graph(signals, spectrograms, paths, load, components, stft_layer):
+    # Branches of the enabled components, after the morphology stages they read, so that the graph can be merged
+    # with the one of the morphology; the input signal and the spectrograms already computed are given as results
+    graph = StageGraph(dict(spectrograms, input_signal=signals['input']))
     if components['noise']:
-        synthesize_noise_signal(signals, spectrograms, paths, load, stft_layer)
+        graph.add('noise_signal', lambda x, opening: synthesize_noise_signal(x, opening, paths, load, stft_layer),
+                  after=['input_signal', 'opening'])
     if components['sinusoids']:
-        synthesize_sinusoids_signal(lines, signals, spectrograms, paths, load, stft_layer)
+        graph.add('sinusoids_signal',
+                  lambda horizontal_filtered: synthesize_sinusoids_signal(horizontal_filtered, paths, load,
+                                                                          stft_layer),
+                  after=['horizontal_filtered'])
     if components['transient']:
-        synthesize_transient_signal(lines, signals, spectrograms, paths, load, stft_layer)
+        graph.add('transient_signal',
+                  lambda x, vertical_filtered: synthesize_transient_signal(x, vertical_filtered, paths, load,
+                                                                           stft_layer),
+                  after=['input_signal', 'vertical_filtered'])
     if components['output']:
-        synthesize_output_signal(signals, spectrograms, stft_layer)
+        graph.add('output_signal',
+                  lambda noise, sinusoids, transient: synthesize_output_signal(
+                      noise['signals']['filtered_noise'], sinusoids['signals']['sinusoids'],
+                      transient['signals']['transient'], stft_layer),
+                  after=['noise_signal', 'sinusoids_signal', 'transient_signal'])
+    return graph
+
+
+def synthesize_signals(lines, signals, spectrograms, paths, load, components, stft_layer, engine=SCHEDULER_ENGINE,
+                       workers=SCHEDULER_WORKERS):
+    graph = synthesis_graph(signals, spectrograms, paths, load, components, stft_layer)
+    results = graph.run(engine=engine, workers=workers)
+
+    # Outputs of the branches written to the dictionaries once all of them are done
+    for name in graph.stages:
+        signals.update(results[name].get('signals', {}))
+        spectrograms.update(results[name].get('spectrograms', {}))
+        lines.update(results[name].get('lines', {}))
+    return results
@@ -1,128 +1,133 @@
-import scipy.signal.windows as win
-import scipy.ndimage as image
-import scipy.signal as sig
+from functools import lru_cache
 from .morphology import *
 from .parameters import *
-from .utils import from_db, to_db
+from .utils import from_db, to_db, synchronize, get_device
+from .profiling import profiled
+
+
+def flat_shape(parameters, operation):
+    time_width = parameters.get(operation + '_time_width', window_spread()[0])
+    frequency_width = parameters.get(operation + '_frequency_width', window_spread()[1])
+
+    return (int(np.ceil(frequency_width / FREQUENCY_PRECISION)),
+            int(np.ceil(time_width / TIME_RESOLUTION)))
 
 
 # Input
+@profiled()
 def apply_closing(spectrogram, parameters, verbose=True):
     start = time.time()
 
-    time_width = parameters.get('closing_time_width', WINDOW_SPREAD[0])
-    frequency_width = parameters.get('closing_frequency_width', WINDOW_SPREAD[1])
-
-    shape = (int(np.ceil(frequency_width / FREQUENCY_PRECISION)),
-             int(np.ceil(time_width / TIME_RESOLUTION)))
+    shape = flat_shape(parameters, 'closing')
 
-    str_el = torch.ones(shape).to(DEVICE)
-
-    spectrogram_closed = greyscale.closing(spectrogram, str_el, border='g')
+    spectrogram_closed = greyscale_flat('closing', spectrogram, shape, 1., border='g')
 
     if verbose:
-        torch.cuda.synchronize(DEVICE)
+        synchronize(DEVICE)
         print('Time to apply closing: %.3f seconds' % (time.time() - start))
 
     return spectrogram_closed
 
 
+@profiled()
 def apply_reconstruction_by_erosion(marker, spectrogram, verbose=True):
     start = time.time()
 
     spectrogram_filled = reconstruction_erosion(marker, spectrogram, verbose=verbose,
-                                                iterations=RECONSTRUCTION_EROSION_ITERATIONS)
+                                                iterations=RECONSTRUCTION_EROSION_ITERATIONS,
+                                                engine=RECONSTRUCTION_ENGINE)
 
     if verbose:
-        torch.cuda.synchronize(DEVICE)
+        synchronize(DEVICE)
         print('Time to apply reconstruction by erosion: %.3f seconds' % (time.time() - start))
 
     return spectrogram_filled
 
 
+@profiled()
 def apply_erosion(spectrogram):
+    import scipy.signal.windows as win
+
     start = time.time()
 
     window = win.get_window(WINDOW, int(np.ceil(WIN_LENGTH / FS / TIME_RESOLUTION)))
     window_db = to_db(window, 'numpy')
-    str_el = torch.from_numpy(window_db).to(torch.float32).to(DEVICE)
+    str_el = torch.from_numpy(window_db).to(torch.float32).to(get_device())
     str_el = str_el.view(1, -1)
 
     spectrogram_eroded = greyscale.erosion(spectrogram, str_el, border='g')
 
-    torch.cuda.synchronize(DEVICE)
+    synchronize(DEVICE)
     print('Time to apply erosion: %.3f seconds' % (time.time() - start))
 
     return spectrogram_eroded
 
 
 # Noise
+@profiled()
 def apply_opening(spectrogram, parameters, verbose=True):
     start = time.time()
 
-    time_width = parameters.get('opening_time_width', WINDOW_SPREAD[0])
-    frequency_width = parameters.get('opening_frequency_width', WINDOW_SPREAD[1])
-
-    shape = (int(np.ceil(frequency_width / FREQUENCY_PRECISION)),
-             int(np.ceil(time_width / TIME_RESOLUTION)))
+    shape = flat_shape(parameters, 'opening')
 
-    str_el = torch.zeros(shape).to(DEVICE)
-
-    spectrogram_opened = greyscale.opening(spectrogram, str_el, border='g')
+    spectrogram_opened = greyscale_flat('opening', spectrogram, shape, 0., border='g')
 
     if verbose:
-        torch.cuda.synchronize(DEVICE)
+        synchronize(DEVICE)
         print('Time to apply opening: %.3f seconds' % (time.time() - start))
 
     return spectrogram_opened
 
 
 # Sinusoids
+@profiled()
 def apply_vertical_thinning(spectrogram, verbose=True):
     print('Applying vertical thinning...')
 
     start = time.time()
 
     spectrogram_thinned = greyscale_thinning(spectrogram, direction='v', verbose=verbose,
-                                             iterations=VERTICAL_THINNING_ITERATIONS)
+                                             iterations=VERTICAL_THINNING_ITERATIONS, engine=THINNING_ENGINE,
+                                             tile_size=TILE_SIZE)
 
     if verbose:
-        torch.cuda.synchronize(DEVICE)
+        synchronize(DEVICE)
         print('Time to apply vertical thinning: %.3f seconds' % (time.time() - start))
 
     return spectrogram_thinned
 
 
+@profiled()
 def apply_vertical_top_hat(spectrogram, verbose=True):
     start = time.time()
 
     shape = (3, 1)
 
-    str_el = torch.zeros(shape).to(DEVICE)
-
-    spectrogram_top_hat = spectrogram - greyscale.opening(spectrogram, str_el)
+    spectrogram_top_hat = spectrogram - greyscale_flat('opening', spectrogram, shape)
 
     if verbose:
-        torch.cuda.synchronize(DEVICE)
+        synchronize(DEVICE)
         print('Time to apply vertical top-hat: %.3f seconds' % (time.time() - start))
 
     return spectrogram_top_hat
 
 
+@profiled()
 def apply_top_hat_threshold(spectrogram, spectrogram_top_hat, threshold=TOP_HAT_DIFF_THRESHOLD, min_db=MIN_DB,
                             verbose=True):
     start = time.time()
 
     spectrogram_threshold = torch.clone(spectrogram)
-    spectrogram_threshold[spectrogram_top_hat <= threshold] = min_db
+    spectrogram_threshold[spectrogram_top_hat <= threshold] = float(min_db)
 
     if verbose:
-        torch.cuda.synchronize(DEVICE)
+        synchronize(DEVICE)
         print('Time to apply top-hat threshold: %.3f seconds' % (time.time() - start))
 
     return spectrogram_threshold
 
 
+@profiled()
 def remove_small_horizontal_lines(spectrogram, verbose=True):
     print('Removing small horizontal lines...')
 
@@ -131,47 +136,51 @@ def remove_small_horizontal_lines(spectrogram, verbose=True):
     min_length_bins = int(MIN_LENGTH_SINUSOIDS / TIME_RESOLUTION)
     iterations = min_length_bins // 2
 
-    spectrogram_trimming = greyscale_trimming(spectrogram, iterations, 'h', verbose=verbose)
-    spectrogram_reconstruction = reconstruction_dilation(spectrogram_trimming, spectrogram)
+    spectrogram_trimming = greyscale_trimming(spectrogram, iterations, 'h', verbose=verbose,
+                                              engine=THINNING_ENGINE, tile_size=TILE_SIZE)
+    spectrogram_reconstruction = reconstruction_dilation(spectrogram_trimming, spectrogram,
+                                                         engine=RECONSTRUCTION_ENGINE)
 
     if verbose:
-        torch.cuda.synchronize(DEVICE)
+        synchronize(DEVICE)
         print('Time to remove small horizontal lines: %.3f seconds' % (time.time() - start))
 
     return spectrogram_reconstruction
 
 
 # Transients
+@profiled()
 def apply_horizontal_thinning(spectrogram, verbose=True):
     print('Applying horizontal thinning...')
     start = time.time()
 
     spectrogram_thinned = greyscale_thinning(spectrogram, direction='h', verbose=verbose,
-                                             iterations=HORIZONTAL_THINNING_ITERATIONS)
+                                             iterations=HORIZONTAL_THINNING_ITERATIONS, engine=THINNING_ENGINE,
+                                             tile_size=TILE_SIZE)
 
     if verbose:
-        torch.cuda.synchronize(DEVICE)
+        synchronize(DEVICE)
         print('Time to apply horizontal thinning: %.3f seconds' % (time.time() - start))
 
     return spectrogram_thinned
 
 
+@profiled()
 def apply_horizontal_top_hat(spectrogram, verbose=True):
     start = time.time()
 
     shape = (1, 3)
 
-    str_el = torch.zeros(shape).to(DEVICE)
-
-    spectrogram_top_hat = spectrogram - greyscale.opening(spectrogram, str_el)
+    spectrogram_top_hat = spectrogram - greyscale_flat('opening', spectrogram, shape)
 
     if verbose:
-        torch.cuda.synchronize(DEVICE)
+        synchronize(DEVICE)
         print('Time to apply horizontal top-hat: %.3f seconds' % (time.time() - start))
 
     return spectrogram_top_hat
 
 
+@profiled()
 def remove_small_vertical_lines(spectrogram, verbose=True):
     print('Removing small vertical lines...')
 
@@ -180,17 +189,82 @@ def remove_small_vertical_lines(spectrogram, verbose=True):
     min_length_bins = int(MIN_LENGTH_TRANSIENT / FREQUENCY_PRECISION)
     iterations = min_length_bins // 2
 
-    spectrogram_trimming = greyscale_trimming(spectrogram, iterations, 'v', verbose=verbose)
-    spectrogram_reconstruction = reconstruction_dilation(spectrogram_trimming, spectrogram)
+    spectrogram_trimming = greyscale_trimming(spectrogram, iterations, 'v', verbose=verbose,
+                                              engine=THINNING_ENGINE, tile_size=TILE_SIZE)
+    spectrogram_reconstruction = reconstruction_dilation(spectrogram_trimming, spectrogram,
+                                                         engine=RECONSTRUCTION_ENGINE)
 
     if verbose:
-        torch.cuda.synchronize(DEVICE)
+        synchronize(DEVICE)
         print('Time to remove small vertical lines: %.3f seconds' % (time.time() - start))
 
     return spectrogram_reconstruction
 
 
-def get_lines(spectrogram: torch.Tensor, sort_by, min_db=MIN_DB, verbose=True, verbose_it_step=100):
+# Streaming
+def time_support(parameters):
+    # Columns on each side of a pixel that a stage reads from its inputs; reconstructions without an iteration
+    # bound, which include the ones of the hybrid engine, propagate along whole lines and are assumed to stay within
+    # STREAM_RECONSTRUCTION_SUPPORT
+    unbounded = int(np.ceil(STREAM_RECONSTRUCTION_SUPPORT / TIME_RESOLUTION))
+    if RECONSTRUCTION_EROSION_ITERATIONS is None or RECONSTRUCTION_ENGINE == 'hybrid':
+        reconstruction_erosion_support = unbounded
+    else:
+        reconstruction_erosion_support = RECONSTRUCTION_EROSION_ITERATIONS
+
+    # Thinning applies six 3x3 templates per iteration and trimming two
+    return {
+        'closing': 2 * (flat_shape(parameters, 'closing')[1] // 2),
+        'reconstruction_erosion': reconstruction_erosion_support,
+        'opening': 2 * (flat_shape(parameters, 'opening')[1] // 2),
+        'vertical_thin': 6 * VERTICAL_THINNING_ITERATIONS,
+        'vertical_top_hat': 0,
+        'vertical_threshold': 0,
+        'horizontal_filtered': 2 * (int(MIN_LENGTH_SINUSOIDS / TIME_RESOLUTION) // 2) + unbounded,
+        'horizontal_thin': 6 * HORIZONTAL_THINNING_ITERATIONS,
+        'horizontal_top_hat': 2,
+        'horizontal_threshold': 0,
+        'vertical_filtered': 2 * (int(MIN_LENGTH_TRANSIENT / FREQUENCY_PRECISION) // 2) + unbounded,
+    }
+
+
+class Lines:
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        # Lines packed one after the other; line k is data[offsets[k]: offsets[k + 1]]
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return self.offsets.size - 1
+
+    def __getitem__(self, item):
+        return self.data[self.offsets[item]: self.offsets[item + 1]]
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def copy(self):
+        return Lines(np.copy(self.data), np.copy(self.offsets))
+
+    @classmethod
+    def from_list(cls, lines):
+        lengths = [line.shape[0] for line in lines]
+        offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        if len(lines) == 0:
+            return cls(np.zeros((0, 3), dtype=np.float32), offsets)
+        return cls(np.concatenate(lines), offsets)
+
+
+@profiled()
+def get_lines(spectrogram: torch.Tensor, sort_by, min_db=MIN_DB, verbose=True, origin=(0, 0)):
+    # The origin is the (frequency, time) index of the first pixel, for a window as given by read_window
+    import scipy.ndimage as image
+
     start = time.time()
 
     if verbose:
@@ -199,7 +273,6 @@ def get_lines(spectrogram: torch.Tensor, sort_by, min_db=MIN_DB, verbose=True, v
     structure = np.ones((3, 3))
 
     labels, n_labels = image.label(torch.greater(spectrogram, min_db).cpu().numpy(), structure=structure)
-    labels_tensor = torch.tensor(labels, device=DEVICE)
 
     if sort_by == 'time':
         min_length_bins = int(MIN_LENGTH_SINUSOIDS / TIME_RESOLUTION)
@@ -208,40 +281,43 @@ def get_lines(spectrogram: torch.Tensor, sort_by, min_db=MIN_DB, verbose=True, v
     else:
         raise ValueError('Parameter sort_by must be either "time" or "frequency"')
 
-    lines = []
-    for i in range(1, n_labels + 1):
-        values = torch.eq(labels_tensor, i)
-        idxs = torch.argwhere(values)
-
-        if idxs.shape[0] < min_length_bins:
-            continue
-
-        # Sort
-        if sort_by == 'time':
-            idxs_sort = idxs[idxs[:, 1].argsort()]
-        elif sort_by == 'frequency':
-            idxs_sort = idxs[idxs[:, 0].argsort()]
-        else:
-            raise ValueError('Parameter sort_by must be either "time" or "frequency"')
-
-        ampli_db = spectrogram[idxs_sort[:, 0], idxs_sort[:, 1]]
-        if torch.max(ampli_db) < MIN_AMPLI_DB:
-            continue
-
-        times = idxs_sort[:, 1] * TIME_RESOLUTION
-        freqs = idxs_sort[:, 0] * FREQUENCY_PRECISION
-        ampli = from_db(ampli_db)
-
-        line = torch.stack((times, freqs, ampli), dim=1)
+    # Pixels grouped by label, then sorted along the line
+    idxs = np.flatnonzero(labels)
+    pixel_labels = labels.reshape(-1)[idxs]
+    f, t = np.divmod(idxs, labels.shape[1])
+    if sort_by == 'time':
+        order = np.lexsort((f, t, pixel_labels))
+    else:
+        order = np.lexsort((t, f, pixel_labels))
+    f = f[order]
+    t = t[order]
+    pixel_labels = pixel_labels[order]
+
+    # Length and amplitude filters
+    lengths = np.bincount(pixel_labels, minlength=n_labels + 1)[1:]
+    f_tensor = torch.from_numpy(f).to(spectrogram.device)
+    t_tensor = torch.from_numpy(t).to(spectrogram.device)
+    ampli_db = spectrogram[f_tensor, t_tensor]
+    if n_labels > 0:
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        max_ampli_db = np.maximum.reduceat(ampli_db.cpu().numpy(), starts)
+    else:
+        max_ampli_db = np.zeros(0)
+    keep = np.logical_and(lengths >= min_length_bins, max_ampli_db >= MIN_AMPLI_DB)
+    keep_pixels = torch.from_numpy(keep[pixel_labels - 1]).to(spectrogram.device)
 
-        lines.append(line.cpu().numpy())
+    # Lines
+    times = (t_tensor[keep_pixels] + origin[1]) * TIME_RESOLUTION
+    freqs = (f_tensor[keep_pixels] + origin[0]) * FREQUENCY_PRECISION
+    ampli = from_db(ampli_db[keep_pixels])
 
-        if verbose and i % verbose_it_step == 0:
-            print('Iteration %d / %d' % (i, n_labels))
+    data = torch.stack((times, freqs, ampli), dim=1).cpu().numpy()
+    offsets = np.concatenate(([0], np.cumsum(lengths[keep], dtype=np.int64)))
+    lines = Lines(data, offsets)
 
     if verbose:
         print('Number of lines found: %d' % len(lines))
-        print('Time to find horizontal lines: %.3f seconds' % (time.time() - start))
+        print('Time to find %s lines: %.3f seconds' % (sort_by, time.time() - start))
 
     return lines
 
@@ -250,8 +326,16 @@ def filter_lines(lines, axis):
     if FILTER_SINUSOIDS is None:
         return lines
 
+    import scipy.signal as sig
+
     ba = sig.butter(*FILTER_SINUSOIDS)
 
+    if isinstance(lines, Lines):
+        filtered_lines = lines.copy()
+        for line in filtered_lines:
+            line[:, axis] = sig.filtfilt(*ba, line[:, axis], method="gust")
+        return filtered_lines
+
     filtered_lines = []
     for line in lines:
         y = line[:, axis]
@@ -280,8 +364,20 @@ if isinstance(WINDOW, Tuple):
     NEW_WINDOW = (WINDOW[0], FS * WINDOW[1] / np.sqrt(2 * np.pi))
 else:
     NEW_WINDOW = WINDOW
-WINDOW_SPREAD = get_window_spread(win.get_window(NEW_WINDOW, WIN_LENGTH), DROP, N_FFT, FS)
+
+
+# Computed on first use: it needs scipy and an N_FFT-point FFT, which short-lived imports should not pay for
+@lru_cache(maxsize=None)
+def window_spread():
+    import scipy.signal.windows as win
+    return get_window_spread(win.get_window(NEW_WINDOW, WIN_LENGTH), DROP, N_FFT, FS)
 # print('Window spread for a %d dB drop:'
 #       '\nTime: %d ms'
-#       '\nFrequency: %d Hz' % (DROP, WINDOW_SPREAD[0] * 1e3, WINDOW_SPREAD[1]))
+#       '\nFrequency: %d Hz' % (DROP, window_spread()[0] * 1e3, window_spread()[1]))
 # print()
+
+
+def __getattr__(name):
+    if name == 'WINDOW_SPREAD':
+        return window_spread()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import time
+import numbers
+import threading
+import functools
+import contextlib
+import numpy as np
+from pathlib import Path
+
+from .parameters import DEVICE, PROFILING
+from .utils import synchronize, get_device
+
+
+def loaded_torch():
+    # torch if it has been imported; until then there are no tensors to describe and no kernels to wait for, and
+    # importing the profiler does not import it
+    return sys.modules.get('torch')
+
+
+def array_types():
+    torch = loaded_torch()
+    return (np.ndarray,) if torch is None else (np.ndarray, torch.Tensor)
+
+
+def describe(value):
+    # Shape, type and size of arrays, so that the events stay small and can be written as JSON
+    if isinstance(value, array_types()):
+        return {'shape': list(value.shape), 'dtype': str(value.dtype),
+                'bytes': int(value.nbytes if isinstance(value, np.ndarray) else value.element_size() * value.numel())}
+    elif isinstance(value, (list, tuple)):
+        return [describe(item) for item in value]
+    elif isinstance(value, dict):
+        return {str(key): describe(item) for key, item in value.items()}
+    elif value is None or isinstance(value, (bool, str)):
+        return value
+    elif isinstance(value, numbers.Integral):
+        return int(value)
+    elif isinstance(value, numbers.Real):
+        return float(value)
+    return type(value).__name__
+
+
+def resident_memory():
+    # Current resident memory of the process in bytes, None where /proc is not available; ru_maxrss would be the peak
+    # of the whole life of the process, which says nothing about a span
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def cuda_device(device=DEVICE):
+    # Device whose memory torch tracks, None when it is not a GPU or torch has not been imported
+    torch = loaded_torch()
+    if torch is None or not torch.cuda.is_available():
+        return None
+    device = get_device(device)
+    return device if torch.device(device).type == 'cuda' else None
+
+
+class Profiler:
+    def __init__(self, enabled=PROFILING, device=DEVICE):
+        # Closed spans as events with their start and duration in seconds, their thread, their depth in the spans
+        # open on that thread, and their metadata: arrays, iterations, resident memory at their start and end, and on
+        # CUDA the peak memory allocated by torch while they were open
+        self.enabled = enabled
+        self.device = device
+        self.events = []
+        self.origin = time.perf_counter()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.open_count = 0
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self.lock:
+            self.events = []
+            self.origin = time.perf_counter()
+
+    def open_spans(self):
+        if not hasattr(self.local, 'spans'):
+            self.local.spans = []
+        return self.local.spans
+
+    @contextlib.contextmanager
+    def span(self, name, **metadata):
+        spans = self.open_spans()
+        event = {'name': name, 'thread': threading.get_ident(), 'depth': len(spans), 'metadata': describe(metadata)}
+        device = cuda_device(self.device)
+        with self.lock:
+            # The peak is reset only when no span is open on any thread, so that concurrent stages keep theirs; the
+            # peak of a span that overlaps others is the one of all of them
+            if self.open_count == 0 and device is not None:
+                loaded_torch().cuda.reset_peak_memory_stats(device)
+            self.open_count += 1
+        event['metadata']['rss_start'] = resident_memory()
+        spans.append(event)
+        start = time.perf_counter()
+        try:
+            yield event
+        finally:
+            # Queued kernels are part of the span
+            if loaded_torch() is not None:
+                synchronize(self.device)
+            end = time.perf_counter()
+            spans.pop()
+            event['start'] = start - self.origin
+            event['duration'] = end - start
+            event['metadata']['rss_end'] = resident_memory()
+            device = cuda_device(self.device)
+            if device is not None:
+                event['metadata']['peak_cuda'] = loaded_torch().cuda.max_memory_allocated(device)
+            with self.lock:
+                self.open_count -= 1
+                self.events.append(event)
+
+    def record(self, **metadata):
+        # Metadata of the innermost span open on this thread
+        spans = self.open_spans()
+        if len(spans) > 0:
+            spans[-1]['metadata'].update(describe(metadata))
+
+    def summary(self):
+        summary = {}
+        for event in self.events:
+            entry = summary.setdefault(event['name'], {'count': 0, 'total': 0., 'max': 0.})
+            entry['count'] += 1
+            entry['total'] += event['duration']
+            entry['max'] = max(entry['max'], event['duration'])
+        for entry in summary.values():
+            entry['mean'] = entry['total'] / entry['count']
+        return summary
+
+    def to_json(self, file_path: Path):
+        with open(file_path, 'w') as f:
+            json.dump({'events': sorted(self.events, key=lambda event: event['start']), 'summary': self.summary()},
+                      f, indent=1)
+
+    def to_chrome_trace(self, file_path: Path):
+        # Complete events in microseconds, to open with chrome://tracing or Perfetto
+        trace = [{'name': event['name'], 'cat': 'mmm', 'ph': 'X', 'ts': event['start'] * 1e6,
+                  'dur': event['duration'] * 1e6, 'pid': os.getpid(), 'tid': event['thread'],
+                  'args': event['metadata']} for event in self.events]
+        with open(file_path, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+    def print_summary(self):
+        for name, entry in sorted(self.summary().items(), key=lambda item: - item[1]['total']):
+            print('%-40s %6d calls %10.3f seconds' % (name, entry['count'], entry['total']))
+
+
+PROFILER = Profiler()
+NO_SPAN = contextlib.nullcontext()
+
+
+def stage(name, **metadata):
+    # Span recorded by the profiler; when it is disabled, a shared context that does nothing
+    if not PROFILER.enabled:
+        return NO_SPAN
+    return PROFILER.span(name, **metadata)
+
+
+def record(**metadata):
+    if PROFILER.enabled:
+        PROFILER.record(**metadata)
+
+
+def profiled(name=None):
+    # Decorator recording each call as a span, with the arrays it reads and the one it returns
+    def decorator(function):
+        span_name = function.__name__ if name is None else name
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return function(*args, **kwargs)
+            arrays = [arg for arg in args if isinstance(arg, array_types())]
+            with PROFILER.span(span_name, inputs=arrays) as event:
+                result = function(*args, **kwargs)
+                event['metadata']['output'] = describe(result)
+            return result
+        return wrapper
+    return decorator
@@ -1,17 +1,18 @@
 import time
 import numpy as np
-import scipy.signal.windows as win
-import scipy.fft as fft
 from .parameters import TIME_RESOLUTION, FS, NOISE_SIGMA, FREQUENCY_PRECISION, FADE_OUT, FADE_OUT_FREQ, FADE_IN_FREQ, \
-    FADE_IN
+    FADE_IN, SYNTHESIS_ENGINE, SYNTHESIS_BLOCK, TRANSIENT_ENGINE, TRANSIENT_MARGIN
 from .utils import from_db
+from .profiling import profiled
 
 
+@profiled()
 def synthesize_white_noise(n):
     white_noise = np.random.randn(n) * NOISE_SIGMA
     return white_noise
 
 
+@profiled()
 def synthesize_noise_mask(white_noise_stft, mask, stft_layer, verbose=False):
     start = time.time()
 
@@ -49,7 +50,99 @@ def modulated_sinusoid(times, freqs, ampli, fs=FS, fade_out=None, fade_in=None):
     return sinusoid
 
 
-def synthesize_sinusoids(lines_h, fs=FS, verbose=True):
+def pack_lines(lines):
+    # Points of all the lines one after the other, line k being data[offsets[k]: offsets[k + 1]]
+    if hasattr(lines, 'offsets'):
+        return lines.data, lines.offsets
+    offsets = np.concatenate(([0], np.cumsum([line.shape[0] for line in lines], dtype=np.int64)))
+    if len(lines) == 0:
+        return np.zeros((0, 3)), offsets
+    return np.concatenate(lines), offsets
+
+
+def concatenated_ranges(lengths):
+    # Index of each element in its range for ranges of the given lengths put one after the other
+    starts = np.cumsum(lengths) - lengths
+    return np.arange(np.sum(lengths)) - np.repeat(starts, lengths)
+
+
+def oscillator_bank(data, offsets, fs=FS, fade_out=None, fade_in=None, dtype=np.float64):
+    # Samples of modulated_sinusoid for every line at once, the sample grids of the lines being put one after the
+    # other; returns the samples and the start of each line in them
+    ts = 1 / fs
+    first = offsets[:-1]
+    last = offsets[1:] - 1
+    t_min = data[first, 0].astype(np.float64)
+    n_samples = np.maximum(np.ceil((data[last, 0] - t_min) / ts), 0).astype(np.int64)
+    starts = np.cumsum(n_samples) - n_samples
+    n = int(np.sum(n_samples))
+
+    # Interpolation segments: the points of a line, but the last, are placed at the first sample of the grid not
+    # before them, so that each segment covers the samples up to the next point
+    x = data[:, 0].astype(np.float64)
+    point_line = np.repeat(np.arange(n_samples.size), np.diff(offsets))
+    u = x - t_min[point_line]
+    point_sample = np.ceil(u / ts).astype(np.int64)
+    # Rounding of the division corrected on the samples of np.arange, start + k * ((start + ts) - start), in
+    # absolute time as np.interp compares them with the points, so that a point falling on a sample, as at the jumps
+    # of a line, starts its segment at that sample
+    grid_start = t_min[point_line]
+    grid_step = (grid_start + ts) - grid_start
+    point_sample += grid_start + point_sample * grid_step < x
+    point_sample -= grid_start + (point_sample - 1) * grid_step >= x
+    knots = np.flatnonzero(np.logical_and(point_sample < n_samples[point_line], np.arange(x.size) != last[point_line]))
+    knot_starts = starts[point_line[knots]] + point_sample[knots]
+    runs = np.diff(np.append(knot_starts, n))
+
+    # Frequencies and amplitudes interpolated as np.interp: at the first sample of each segment and their increment
+    # per sample
+    width = x[knots + 1] - x[knots]
+    width[width == 0] = 1.
+    slopes = (data[knots + 1, 1:] - data[knots, 1:]) / width[:, None] * ts
+    values = data[knots, 1:] + (point_sample[knots] - u[knots] / ts)[:, None] * slopes
+
+    # Phase in cycles before each segment, restarted at each line and reduced modulo 1 in double precision, so that
+    # the samples of a segment can be computed in the requested precision
+    increments = ts * (runs * values[:, 0] + runs * (runs - 1) / 2 * slopes[:, 0])
+    phases = np.cumsum(increments)
+    line_knots = np.searchsorted(knot_starts, starts[n_samples > 0])
+    phases -= np.repeat(phases[line_knots] - increments[line_knots], np.diff(np.append(line_knots, knots.size)))
+    phases = np.mod(phases - increments, 1.)
+
+    # Samples of each segment from their index j in it, the cycles being the sum of the frequencies up to and
+    # including the sample: phase + (j + 1) * (value + j * slope / 2) * ts, written as a polynomial in j
+    index = concatenated_ranges(runs).astype(dtype)
+    coefficients = 2 * np.pi * ts * np.stack((slopes[:, 0] / 2, values[:, 0] + slopes[:, 0] / 2,
+                                             values[:, 0] + phases / ts))
+    sinusoids = np.repeat(coefficients[0].astype(dtype), runs)
+    sinusoids *= index
+    sinusoids += np.repeat(coefficients[1].astype(dtype), runs)
+    sinusoids *= index
+    sinusoids += np.repeat(coefficients[2].astype(dtype), runs)
+    np.sin(sinusoids, out=sinusoids)
+    ampli = np.repeat(2 * slopes[:, 1].astype(dtype), runs)
+    ampli *= index
+    ampli += np.repeat(2 * values[:, 1].astype(dtype), runs)
+    sinusoids *= ampli
+
+    # Raised-cosine fades, shortened to half the line if needed
+    fade_in = np.minimum(int(fade_in * fs) if fade_in is not None else 0, n_samples // 2)
+    fade_out = np.minimum(int(fade_out * fs) if fade_out is not None else 0, n_samples // 2)
+    index = concatenated_ranges(fade_in)
+    length = np.repeat(fade_in, fade_in)
+    sinusoids[np.repeat(starts, fade_in) + index] *= np.cos(np.pi * (length - 1 - index) / (2 * length)) ** 2
+    index = concatenated_ranges(fade_out)
+    length = np.repeat(fade_out, fade_out)
+    sinusoids[np.repeat(starts + n_samples - fade_out, fade_out) + index] *= np.cos(np.pi * index / (2 * length)) ** 2
+
+    return sinusoids, starts
+
+
+@profiled()
+def synthesize_sinusoids(lines_h, fs=FS, verbose=True, engine=SYNTHESIS_ENGINE, dtype=np.float64):
+    if engine not in ['loop', 'bank']:
+        raise ValueError("Parameter 'engine' must be 'loop' or 'bank'")
+
     start = time.time()
     if verbose:
         print('Synthesizing sinusoids...')
@@ -61,18 +154,35 @@ def synthesize_sinusoids(lines_h, fs=FS, verbose=True):
     else:
         duration = max(*durations)
 
-    signal_sinusoids = np.zeros(int(np.ceil(duration * fs)))
-
-    for line in lines_h:
-        times = line[:, 0]
-        freqs = line[:, 1]
-        ampli = line[:, 2]
+    signal_sinusoids = np.zeros(int(np.ceil(duration * fs)), dtype=dtype)
+
+    if engine == 'bank':
+        # Lines synthesized together by blocks of about SYNTHESIS_BLOCK samples
+        data, offsets = pack_lines(lines_h)
+        lengths = np.ceil((data[offsets[1:] - 1, 0] - data[offsets[:-1], 0]) * fs)
+        blocks = (np.cumsum(lengths) - lengths) // SYNTHESIS_BLOCK
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(blocks)) + 1, [lengths.size]))
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            block = data[offsets[first]: offsets[last]]
+            block_offsets = offsets[first: last + 1] - offsets[first]
+            sinusoids, starts = oscillator_bank(block, block_offsets, fs, fade_out=FADE_OUT, fade_in=FADE_IN,
+                                                dtype=dtype)
+            # Lines added one by one, as the loop does, since their samples are contiguous
+            ends = np.append(starts[1:], sinusoids.size)
+            idxs_0 = (block[block_offsets[:-1], 0] * fs).astype(np.int64)
+            for idx_0, a, b in zip(idxs_0, starts, ends):
+                signal_sinusoids[idx_0: idx_0 + b - a] += sinusoids[a: b]
+    else:
+        for line in lines_h:
+            times = line[:, 0]
+            freqs = line[:, 1]
+            ampli = line[:, 2]
 
-        s = modulated_sinusoid(times, freqs, ampli, fade_out=FADE_OUT, fade_in=FADE_IN)
+            s = modulated_sinusoid(times, freqs, ampli, fade_out=FADE_OUT, fade_in=FADE_IN)
 
-        idx_0 = int(times.min() * fs)
-        idx_1 = idx_0 + s.size
-        signal_sinusoids[idx_0:idx_1] += s
+            idx_0 = int(times.min() * fs)
+            idx_1 = idx_0 + s.size
+            signal_sinusoids[idx_0:idx_1] += s
 
     if verbose:
         print('Time to synthesize sinusoids: %.3f s' % (time.time() - start))
@@ -81,6 +191,8 @@ def synthesize_sinusoids(lines_h, fs=FS, verbose=True):
 
 
 def generate_transient(times, freqs, ampli, duration, fs=FS):
+    import scipy.fft as fft
+
     taus = duration * freqs / (fs / 2)
     omegas = (fs / 2) * times / duration
 
@@ -97,6 +209,8 @@ def generate_transient(times, freqs, ampli, duration, fs=FS):
 
 
 def cut_transient(s, times):
+    import scipy.signal.windows as win
+
     idx_0 = int(times.min() * FS)
     idx_1 = int(times.max() * FS)
     w = np.zeros_like(s)
@@ -108,7 +222,77 @@ def cut_transient(s, times):
     return s
 
 
-def synthesize_transient(lines_v, duration, fs=FS, verbose=True):
+def cut_window(times):
+    # Window of cut_transient over its support only, and the index of its first sample
+    import scipy.signal.windows as win
+
+    idx_0 = int(times.min() * FS)
+    idx_1 = int(times.max() * FS)
+    h = win.get_window('hann', int(FADE_IN * FS))
+    h = h / h.sum()
+    if idx_1 <= idx_0:
+        return np.zeros(0), idx_0
+    return np.convolve(np.ones(idx_1 - idx_0), h), idx_0 - (h.size - 1) // 2
+
+
+def local_transient(times, freqs, ampli, duration, fs=FS, margin=TRANSIENT_MARGIN):
+    # cut_transient(generate_transient(...)) computed over the support of the cut and a margin on each side only;
+    # returns the samples and the index of the first one. It differs from it by about 1e-4 of the peak, and by up to
+    # 2e-2 for lines in the first tens of milliseconds, whose mirror image, kept by generate_transient, still overlaps
+    # them
+    import scipy.fft as fft
+
+    w, idx_0 = cut_window(times)
+    if w.size == 0:
+        return w, idx_0
+    n = int(duration * fs)
+    n_margin = int(margin * fs)
+    n_fft = fft.next_fast_len(w.size + 2 * n_margin)
+
+    # Frequencies of the FFT bins; the long FFT of generate_transient puts the sinusoid a fraction of a bin lower
+    f_lo = freqs.min()
+    f_hi = freqs.max()
+    tau_lo = duration * f_lo / (fs / 2) * fs
+    delta = (tau_lo - int(tau_lo)) * fs / (2 * n)
+    bins = np.arange(int(np.ceil((f_lo - delta) * n_fft / fs)), int(np.ceil((f_hi - delta) * n_fft / fs)))
+    f = bins * fs / n_fft + delta
+
+    # Spectrum of the transient: its phase is the sum over the samples of the long sinusoid of the times, as an
+    # integral plus the Euler-Maclaurin correction for its samples at 1 / (2 * duration) Hz
+    t = np.interp(f, freqs, times)
+    t_lo = np.interp(f_lo, freqs, times)
+    integral = np.cumsum(np.diff(f, prepend=f_lo) * (t + np.concatenate(([t_lo], t[:-1]))) / 2)
+    phase = 2 * np.pi * integral + np.pi / (2 * duration) * (t + t_lo)
+    spectrum = np.interp(f, freqs, ampli)
+
+    # Fades of modulated_sinusoid, in samples of the long sinusoid
+    fade_out = int(int(FADE_OUT_FREQ / FREQUENCY_PRECISION) * TIME_RESOLUTION * FS)
+    fade_in = int(int(FADE_IN_FREQ / FREQUENCY_PRECISION) * TIME_RESOLUTION * FS)
+    size = int(np.ceil((f_hi - f_lo) * 2 * duration))
+    fade_in = min(fade_in, size // 2)
+    fade_out = min(fade_out, size // 2)
+    index = (f - f_lo) * 2 * duration
+    is_in = index < fade_in
+    spectrum[is_in] *= np.cos(np.pi * (fade_in - 1 - index[is_in]) / (2 * fade_in)) ** 2
+    tail = index - (size - fade_out)
+    is_out = tail >= 0
+    spectrum[is_out] *= np.cos(np.pi * tail[is_out] / (2 * fade_out)) ** 2
+
+    # Only the part of the sinusoid arriving at the times of the line, delayed to the start of the margin; the
+    # scale accounts for the coarser bins
+    delay = np.mod(bins * (idx_0 - n_margin), n_fft)
+    z = np.zeros(n_fft, dtype=complex)
+    z[bins] = -1j * spectrum * np.exp(1j * (phase - 2 * np.pi * delay / n_fft))
+    transient = 8 * np.sqrt(2 * n) / n_fft * fft.fft(z).real
+
+    return transient[n_margin: n_margin + w.size] * w, idx_0
+
+
+@profiled()
+def synthesize_transient(lines_v, duration, fs=FS, verbose=True, engine=TRANSIENT_ENGINE):
+    if engine not in ['full', 'local']:
+        raise ValueError("Parameter 'engine' must be 'full' or 'local'")
+
     start = time.time()
     if verbose:
         print('Synthesizing transient...')
@@ -120,11 +304,19 @@ def synthesize_transient(lines_v, duration, fs=FS, verbose=True):
         freqs = line[:, 1]
         ampli = line[:, 2]
 
-        s = generate_transient(times, freqs, ampli, duration)
+        if engine == 'local':
+            # Overlap-add of the support of each line, clipped to the signal
+            s, idx_0 = local_transient(times, freqs, ampli, duration, fs)
+            start_s = max(-idx_0, 0)
+            stop_s = min(s.size, signal_transient.size - idx_0)
+            if stop_s > start_s:
+                signal_transient[idx_0 + start_s: idx_0 + stop_s] += s[start_s: stop_s]
+        else:
+            s = generate_transient(times, freqs, ampli, duration)
 
-        s = cut_transient(s, times)
+            s = cut_transient(s, times)
 
-        signal_transient += s
+            signal_transient += s
 
     if verbose:
         print('Time to synthesize transient: %.3f s' % (time.time() - start))
@@ -1,168 +1,182 @@
 import torch
-
-DEVICE = 'cuda:0'
-
-# Thinning templates
-C = torch.Tensor([[1]]).to(torch.bool).to(DEVICE)
-
-C_W = torch.Tensor([
-    [0, 0, 0],
-    [0, 1, 1],
-    [0, 0, 0]
-]).to(torch.bool).to(DEVICE)
-
-D_W = torch.Tensor([
-    [1, 0, 0],
-    [1, 0, 0],
-    [1, 0, 0]
-]).to(torch.bool).to(DEVICE)
-
-C_E = torch.Tensor([
-    [0, 0, 0],
-    [1, 1, 0],
-    [0, 0, 0]
-]).to(torch.bool).to(DEVICE)
-
-D_E = torch.Tensor([
-    [0, 0, 1],
-    [0, 0, 1],
-    [0, 0, 1]
-]).to(torch.bool).to(DEVICE)
-
-C_N = torch.Tensor([
-    [0, 0, 0],
-    [0, 1, 0],
-    [0, 1, 0]
-]).to(torch.bool).to(DEVICE)
-
-D_N = torch.Tensor([
-    [1, 1, 1],
-    [0, 0, 0],
-    [0, 0, 0]
-]).to(torch.bool).to(DEVICE)
-
-C_S = torch.Tensor([
-    [0, 1, 0],
-    [0, 1, 0],
-    [0, 0, 0]
-]).to(torch.bool).to(DEVICE)
-
-D_S = torch.Tensor([
-    [0, 0, 0],
-    [0, 0, 0],
-    [1, 1, 1]
-]).to(torch.bool).to(DEVICE)
-
-# Restoring
-C_WE = torch.Tensor([
-    [0, 1, 1, 0],
-]).to(torch.bool).to(DEVICE)
-
-D_WE = torch.Tensor([
-    [1, 0, 0, 1],
-]).to(torch.bool).to(DEVICE)
+from functools import lru_cache
+from .parameters import DEVICE
+from .utils import get_device
+
+# Thinning templates, turned into tensors on first use so that importing does not touch the device
+TEMPLATES = {
+    'C': [[1]],
+
+    'C_W': [
+        [0, 0, 0],
+        [0, 1, 1],
+        [0, 0, 0]
+    ],
+
+    'D_W': [
+        [1, 0, 0],
+        [1, 0, 0],
+        [1, 0, 0]
+    ],
+
+    'C_E': [
+        [0, 0, 0],
+        [1, 1, 0],
+        [0, 0, 0]
+    ],
+
+    'D_E': [
+        [0, 0, 1],
+        [0, 0, 1],
+        [0, 0, 1]
+    ],
+
+    'C_N': [
+        [0, 0, 0],
+        [0, 1, 0],
+        [0, 1, 0]
+    ],
+
+    'D_N': [
+        [1, 1, 1],
+        [0, 0, 0],
+        [0, 0, 0]
+    ],
+
+    'C_S': [
+        [0, 1, 0],
+        [0, 1, 0],
+        [0, 0, 0]
+    ],
+
+    'D_S': [
+        [0, 0, 0],
+        [0, 0, 0],
+        [1, 1, 1]
+    ],
+
+    # Restoring
+    'C_WE': [
+        [0, 1, 1, 0],
+    ],
+
+    'D_WE': [
+        [1, 0, 0, 1],
+    ],
+
+    'C_NS': [
+        [0],
+        [1],
+        [1],
+        [0],
+    ],
+
+    'D_NS': [
+        [1],
+        [0],
+        [0],
+        [1],
+    ],
+
+    # Trimming
+    'C_NE': [
+        [0, 0, 0],
+        [1, 1, 0],
+        [0, 1, 0]
+    ],
+
+    'D_NE': [
+        [0, 1, 1],
+        [0, 0, 1],
+        [0, 0, 0]
+    ],
+
+    'C_NW': [
+        [0, 0, 0],
+        [0, 1, 1],
+        [0, 1, 0]
+    ],
+
+    'D_NW': [
+        [1, 1, 0],
+        [1, 0, 0],
+        [0, 0, 0]
+    ],
+
+    'C_SW': [
+        [0, 1, 0],
+        [0, 1, 1],
+        [0, 0, 0]
+    ],
+
+    'D_SW': [
+        [0, 0, 0],
+        [1, 0, 0],
+        [1, 1, 0]
+    ],
+
+    'C_SE': [
+        [0, 1, 0],
+        [1, 1, 0],
+        [0, 0, 0]
+    ],
+
+    'D_SE': [
+        [0, 0, 0],
+        [0, 0, 1],
+        [0, 1, 1]
+    ],
+
+    'C_WT': [
+        [0, 0, 0],
+        [0, 1, 1],
+        [0, 0, 0]
+    ],
+
+    'D_WT': [
+        [1, 1, 0],
+        [1, 0, 0],
+        [1, 1, 0]
+    ],
+
+    'D_ET': [
+        [0, 1, 1],
+        [0, 0, 1],
+        [0, 1, 1]
+    ],
+
+    'C_NT': [
+        [0, 0, 0],
+        [0, 1, 0],
+        [0, 1, 0]
+    ],
+
+    'D_NT': [
+        [1, 1, 1],
+        [1, 0, 1],
+        [1, 0, 1]
+    ],
+
+    'B_O': [
+        [1, 1, 1],
+        [1, 0, 1],
+        [1, 1, 1]
+    ],
+}
 
 ORIGIN_WE = (0, 1)
 ORIGIN_WE_DIL = (0, 2)
+ORIGIN_NS = (1, 0)
+ORIGIN_NS_DIL = (2, 0)
 
-C_NS = torch.Tensor([
-    [0],
-    [1],
-    [1],
-    [0],
-]).to(torch.bool).to(DEVICE)
 
-D_NS = torch.Tensor([
-    [1],
-    [0],
-    [0],
-    [1],
-]).to(torch.bool).to(DEVICE)
+@lru_cache(maxsize=None)
+def template(name: str, device=DEVICE):
+    return torch.tensor(TEMPLATES[name], dtype=torch.bool, device=get_device(device))
 
-ORIGIN_NS = (1, 0)
-ORIGIN_NS_DIL = (2, 0)
 
-# Trimming
-C_NE = torch.Tensor([
-    [0, 0, 0],
-    [1, 1, 0],
-    [0, 1, 0]
-]).to(torch.bool).to(DEVICE)
-
-D_NE = torch.Tensor([
-    [0, 1, 1],
-    [0, 0, 1],
-    [0, 0, 0]
-]).to(torch.bool).to(DEVICE)
-
-C_NW = torch.Tensor([
-    [0, 0, 0],
-    [0, 1, 1],
-    [0, 1, 0]
-]).to(torch.bool).to(DEVICE)
-
-D_NW = torch.Tensor([
-    [1, 1, 0],
-    [1, 0, 0],
-    [0, 0, 0]
-]).to(torch.bool).to(DEVICE)
-
-C_SW = torch.Tensor([
-    [0, 1, 0],
-    [0, 1, 1],
-    [0, 0, 0]
-]).to(torch.bool).to(DEVICE)
-
-D_SW = torch.Tensor([
-    [0, 0, 0],
-    [1, 0, 0],
-    [1, 1, 0]
-]).to(torch.bool).to(DEVICE)
-
-C_SE = torch.Tensor([
-    [0, 1, 0],
-    [1, 1, 0],
-    [0, 0, 0]
-]).to(torch.bool).to(DEVICE)
-
-D_SE = torch.Tensor([
-    [0, 0, 0],
-    [0, 0, 1],
-    [0, 1, 1]
-]).to(torch.bool).to(DEVICE)
-
-C_WT = torch.Tensor([
-    [0, 0, 0],
-    [0, 1, 1],
-    [0, 0, 0]
-]).to(torch.bool).to(DEVICE)
-
-D_WT = torch.Tensor([
-    [1, 1, 0],
-    [1, 0, 0],
-    [1, 1, 0]
-]).to(torch.bool).to(DEVICE)
-
-D_ET = torch.Tensor([
-    [0, 1, 1],
-    [0, 0, 1],
-    [0, 1, 1]
-]).to(torch.bool).to(DEVICE)
-
-C_NT = torch.Tensor([
-    [0, 0, 0],
-    [0, 1, 0],
-    [0, 1, 0]
-]).to(torch.bool).to(DEVICE)
-
-D_NT = torch.Tensor([
-    [1, 1, 1],
-    [1, 0, 1],
-    [1, 0, 1]
-]).to(torch.bool).to(DEVICE)
-
-B_O = torch.Tensor([
-    [1, 1, 1],
-    [1, 0, 1],
-    [1, 1, 1]
-]).to(torch.bool).to(DEVICE)
+def __getattr__(name):
+    # Module-level tensors such as C_E remain available as attributes
+    if name in TEMPLATES:
+        return template(name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
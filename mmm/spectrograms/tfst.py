@@ -1,10 +1,17 @@
 import torch
 import numpy as np
-import scipy.signal.windows as win
+import torch.nn.functional as func
 from typing import Union, List
 
+# Time of one FFT butterfly relative to one multiply-add of the direct convolution, for the engine choice
+FFT_COST_FACTOR = 12.
+# Number of floats of correlation computed at once by the FFT engine
+FFT_BLOCK_BUDGET = 2 ** 24
+
 
 def get_window_dispatch(window, n, fft_bins=True):
+    import scipy.signal.windows as win
+
     if isinstance(window, str):
         return win.get_window(window, n, fftbins=fft_bins)
     elif isinstance(window, tuple):
@@ -49,6 +56,59 @@ def create_kernels(sizes: np.ndarray,
     return kernels
 
 
+def conv_cost(n_outputs: int, size: int, n_kernels: int):
+    # Multiply-adds of the strided direct correlation
+    return n_kernels * size * n_outputs
+
+
+def fft_length(size: int):
+    # Overlap-save blocks of twice the kernel size, rounded up to a power of two
+    return 2 ** int(np.ceil(np.log2(2 * size)))
+
+
+def fft_cost(n_outputs: int, size: int, hop_length: int, n_kernels: int):
+    # One forward transform per block, then a product and an inverse transform per block and kernel
+    length = fft_length(size)
+    n_blocks = int(np.ceil(((n_outputs - 1) * hop_length + 1) / (length - size + 1)))
+    return FFT_COST_FACTOR * n_blocks * ((n_kernels + 1) * length * np.log2(length) + n_kernels * length)
+
+
+def correlate_conv(input_tensor: torch.Tensor, kernels: torch.Tensor, hop_length: int, n_outputs: int):
+    # Real and imaginary kernels stacked along the channels, so that a single convolution computes both; leading
+    # dimensions of the input are batch dimensions
+    batch = input_tensor.reshape(-1, 1, input_tensor.shape[-1])
+    output = func.conv1d(batch, kernels.unsqueeze(1), stride=hop_length)[:, :, :n_outputs]
+    return output.reshape(input_tensor.shape[:-1] + output.shape[1:])
+
+
+def correlate_fft(input_tensor: torch.Tensor, kernels_fft: torch.Tensor, size: int, hop_length: int, n_outputs: int):
+    # Overlap-save: block b gives the correlation at positions b * step to (b + 1) * step - 1, from which the
+    # multiples of hop_length are kept
+    if n_outputs == 0:
+        return input_tensor.new_empty(input_tensor.shape[:-1] + (kernels_fft.shape[0], 0))
+
+    length = 2 * (kernels_fft.shape[-1] - 1)
+    step = length - size + 1
+    positions = torch.arange(n_outputs, device=input_tensor.device) * hop_length
+    n_blocks = int(positions[-1]) // step + 1
+
+    padded = func.pad(input_tensor, [0, n_blocks * step + size - 1 - input_tensor.shape[-1]])
+    segments = padded.unfold(-1, length, step)
+
+    output = torch.empty(input_tensor.shape[:-1] + (kernels_fft.shape[0], n_outputs), dtype=input_tensor.dtype,
+                         device=input_tensor.device)
+    group = max(FFT_BLOCK_BUDGET // (max(input_tensor[..., 0].numel(), 1) * kernels_fft.shape[0] * length), 1)
+    for first in range(0, n_blocks, group):
+        last = min(first + group, n_blocks)
+        keep = torch.logical_and(positions >= first * step, positions < last * step)
+        offsets = positions[keep] - first * step
+        segments_fft = torch.fft.rfft(segments[..., first: last, :], n=length)
+        correlation = torch.fft.irfft(segments_fft.unsqueeze(-2) * kernels_fft, n=length)[..., :step]
+        output[..., keep] = correlation[..., offsets // step, :, offsets % step].movedim(0, -1)
+
+    return output
+
+
 class TFST(torch.nn.Module):
     def __init__(self,
                  fs: int = 48000,
@@ -62,9 +122,13 @@ class TFST(torch.nn.Module):
                  bins_per_octave: int = 12,
                  output_format: str = 'Magnitude',
                  device: str = 'cuda:0',
+                 engine: str = 'auto',
                  ):
         super().__init__()
 
+        if engine not in ['auto', 'conv', 'fft']:
+            raise ValueError("Parameter 'engine' must be 'auto', 'conv' or 'fft'")
+
         # Direct attributes
         self.fs = fs
         self.hop_length = int(time_resolution * fs)
@@ -78,6 +142,7 @@ class TFST(torch.nn.Module):
         self.n_octaves = n_octaves
         self.bins_per_octave = bins_per_octave
         self.device = device
+        self.engine = engine
 
         # Derived attributes
         self.n_bins = int(bins_per_octave * n_octaves)
@@ -88,42 +153,56 @@ class TFST(torch.nn.Module):
         # Create kernels
         self.kernels = create_kernels(self.sizes, window, frequencies, fs, device)
 
+        # Real kernels of each size, real parts first; their spectra are computed the first time the FFT engine is
+        # chosen for the size
+        self.conv_kernels = []
+        for s in range(self.sizes.size):
+            start = np.sum(self.sizes[:s])
+            kernels = self.kernels[:, start: start + self.sizes[s]]
+            self.conv_kernels.append(torch.cat((kernels.real, kernels.imag)))
+        self.fft_kernels = [None] * self.sizes.size
+
+    def fft_kernel(self, s: int):
+        if self.fft_kernels[s] is None:
+            self.fft_kernels[s] = torch.conj(torch.fft.rfft(self.conv_kernels[s], n=fft_length(self.sizes[s])))
+        return self.fft_kernels[s]
+
+    def engines(self, n_samples: int):
+        # Cheapest engine for each size under the cost model, unless one is forced
+        if self.engine != 'auto':
+            return [self.engine] * self.sizes.size
+
+        n_outputs = n_samples // self.hop_length
+        n_kernels = 2 * self.frequencies.shape[0]
+        return ['fft' if fft_cost(n_outputs, size, self.hop_length, n_kernels) < conv_cost(n_outputs, size, n_kernels)
+                else 'conv' for size in self.sizes]
+
     def forward(self, input_tensor: torch.Tensor):
-        time_shape = input_tensor.shape[0] // self.hop_length
-        if self.output_format == 'Magnitude':
-            output_shape = [self.sizes.shape[0], self.frequencies.shape[0], time_shape]
-            output_tensor = torch.empty(output_shape, device=self.device)
-
-            for s in range(self.sizes.size):
-                start = np.sum(self.sizes[:s])
-                end = start + self.sizes[s]
-                input_conv = func.pad(input_tensor,
-                                      [self.sizes[s] // 2, self.sizes[s] // 2],
-                                      'constant',
-                                      0.).unsqueeze(0).unsqueeze(0)
-                output_tensor[s, :, :] = torch.sqrt(
-                    func.conv1d(input_conv, self.kernels.real[:, start: end].unsqueeze(1),
-                                stride=self.hop_length)[0, :, :time_shape]**2 +
-                    func.conv1d(input_conv, self.kernels.imag[:, start: end].unsqueeze(1),
-                                stride=self.hop_length)[0, :, :time_shape]**2
-                )
-        elif self.output_format == 'Complex':
-            output_shape = [2, self.sizes.shape[0], self.frequencies.shape[0], time_shape]
-            output_tensor = torch.empty(output_shape, device=self.device)
-
-            for s in range(self.sizes.size):
-                start = np.sum(self.sizes[:s])
-                end = start + self.sizes[s]
-                input_conv = func.pad(input_tensor,
-                                      [self.sizes[s] // 2, self.sizes[s] // 2],
-                                      'constant',
-                                      0.).unsqueeze(0).unsqueeze(0)
-                output_tensor[0, s, :, :] = func.conv1d(input_conv, self.kernels.real[:, start: end].unsqueeze(1),
-                                                        stride=self.hop_length)[0, :, :time_shape]
-                output_tensor[0, s, :, :] = func.conv1d(input_conv, self.kernels.imag[:, start: end].unsqueeze(1),
-                                                        stride=self.hop_length)[0, :, :time_shape]
-        else:
+        # Leading dimensions of the input are batch dimensions, the last one being time
+        if self.output_format not in ['Magnitude', 'Complex']:
             raise ValueError("Parameter output_format should be one of:"
                              "'Magnitude' or 'Complex'.")
 
+        time_shape = input_tensor.shape[-1] // self.hop_length
+        n_frequencies = self.frequencies.shape[0]
+        # The magnitude of each size is computed from its correlation, without keeping both parts of all of them
+        if self.output_format == 'Magnitude':
+            output_shape = list(input_tensor.shape[:-1]) + [self.sizes.shape[0], n_frequencies, time_shape]
+        else:
+            output_shape = list(input_tensor.shape[:-1]) + [2, self.sizes.shape[0], n_frequencies, time_shape]
+        output_tensor = torch.empty(output_shape, device=input_tensor.device)
+
+        for s, engine in enumerate(self.engines(input_tensor.shape[-1])):
+            input_conv = func.pad(input_tensor, [self.sizes[s] // 2, self.sizes[s] // 2], 'constant', 0.)
+            if engine == 'conv':
+                output = correlate_conv(input_conv, self.conv_kernels[s], self.hop_length, time_shape)
+            else:
+                output = correlate_fft(input_conv, self.fft_kernel(s), self.sizes[s], self.hop_length, time_shape)
+            if self.output_format == 'Magnitude':
+                output_tensor[..., s, :, :] = torch.sqrt(output[..., :n_frequencies, :]**2
+                                                         + output[..., n_frequencies:, :]**2)
+            else:
+                output_tensor[..., 0, s, :, :] = output[..., :n_frequencies, :]
+                output_tensor[..., 1, s, :, :] = output[..., n_frequencies:, :]
+
         return output_tensor
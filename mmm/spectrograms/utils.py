@@ -1,10 +1,12 @@
-import torch
 import numpy as np
-from .parameters import EPS, FS
+from functools import lru_cache
+from .parameters import EPS, FS, DEVICE
 
 
 def to_db(x, library='torch'):
     if library == 'torch':
+        import torch
+
         return 20 * torch.log10(x + EPS)
     elif library == 'numpy':
         return 20 * np.log10(x + EPS)
@@ -12,10 +14,32 @@ def to_db(x, library='torch'):
 
 def from_db(x, library='torch'):
     if library == 'torch':
+        import torch
+
         return torch.pow(10, x / 20)
     elif library == 'numpy':
         return np.pow(10, x / 20)
 
 
+@lru_cache(maxsize=None)
+def get_device(device=DEVICE):
+    # 'auto' is the first GPU when there is one; resolved when tensors are first created rather than when the
+    # parameters are imported, so that importing them does not import torch
+    if device == 'auto':
+        import torch
+
+        return 'cuda:0' if torch.cuda.is_available() else 'cpu'
+    return device
+
+
+def synchronize(device):
+    # Waits for the queued kernels before reading the clock; CPU operations are already finished
+    import torch
+
+    device = get_device(device)
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
 def get_duration(data):
     return len(data) / FS
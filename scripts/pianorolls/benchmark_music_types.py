@@ -0,0 +1,57 @@
+import timeit
+import tracemalloc
+from mmm.pianorolls.music import *
+
+
+# Parameters
+number = 100000
+repeat = 5
+
+
+def allocation_size(constructor, n=10000):
+    tracemalloc.start()
+    objects = [constructor(k) for k in range(n)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return size / n
+
+
+def benchmark(name, statement):
+    best = min(timeit.repeat(statement, number=number, repeat=repeat, globals=globals()))
+    print('%-40s %8.3f us' % (name, best / number * 1e6))
+
+
+# Objects
+shift = TimeShift(1, 4)
+point = TimePoint(3, 4)
+frequency_shift = FrequencyShift(2)
+frequency_point = FrequencyPoint(60)
+time_frequency = TimeFrequency(point, frequency_point)
+shift_frequency = TimeFrequency(shift, frequency_shift)
+
+# Allocation
+print('Allocation')
+benchmark('TimeShift(1, 4)', 'TimeShift(1, 4)')
+benchmark('TimePoint(3, 4)', 'TimePoint(3, 4)')
+benchmark('FrequencyShift(2)', 'FrequencyShift(2)')
+benchmark('FrequencyPoint(60)', 'FrequencyPoint(60)')
+benchmark('TimeFrequency(point, frequency_point)', 'TimeFrequency(point, frequency_point)')
+if hasattr(TimeShift, 'from_value'):
+    benchmark('TimeShift.from_value', 'TimeShift.from_value(shift.value)')
+    benchmark('TimePoint.from_value', 'TimePoint.from_value(point.value, point.time_signature)')
+    benchmark('FrequencyPoint.from_value', 'FrequencyPoint.from_value(60)')
+    benchmark('TimeFrequency.from_values', 'TimeFrequency.from_values(point, frequency_point)')
+
+# Arithmetic
+print('Arithmetic')
+benchmark('TimePoint + TimeShift', 'point + shift')
+benchmark('TimePoint - TimePoint', 'point - point')
+benchmark('TimeShift * int', 'shift * 3')
+benchmark('FrequencyPoint + FrequencyShift', 'frequency_point + frequency_shift')
+benchmark('TimeFrequency + TimeFrequency', 'time_frequency + shift_frequency')
+
+# Memory
+print('Memory')
+print('%-40s %8.1f B' % ('TimePoint', allocation_size(lambda k: TimePoint(k))))
+print('%-40s %8.1f B' % ('TimeFrequency', allocation_size(lambda k: TimeFrequency(TimePoint(k), FrequencyPoint(60)))))
@@ -12,6 +12,7 @@ from mmm.pianorolls.graphs import ActivationsGraph, DerivedActivationsGraph
 full = True
 sync = True
 sparse = True
+lazy = True
 
 load = False
 log = True
@@ -180,7 +181,7 @@ if log:
 # Find minimal activations
 start = time.time()
 shortest_paths, min_activation_stacks, derived_graph = \
-    find_minimal_activations(derived_graph, folder_save=folder, verbose=log, load=load, sparse=sparse)
+    find_minimal_activations(derived_graph, folder_save=folder, verbose=log, load=load, sparse=sparse, lazy=lazy)
 if log:
     logging.info('Time to find minimal activations: %.3f s' % (time.time() - start))
 
@@ -0,0 +1,67 @@
+import time
+import numpy as np
+from pathlib import Path
+
+from mmm.spectrograms.parameters import FS, DEVICE
+from mmm.spectrograms.layers import create_stft_layer, create_cqt_layer, apply_stft_layer, apply_cqt_layer, \
+    apply_stft_layer_batch, apply_cqt_layer_batch, synchronize
+from mmm.spectrograms.procedures.io import read_wav
+
+
+# Parameters
+n_notes = 1000
+min_duration = 0.1  # s
+max_duration = 0.5  # s
+batch_size = 64
+names = ['marimba', 'woodblock']
+
+# Paths
+project_folder = Path('..') / Path('..')
+audio_folder = project_folder / Path('data') / Path('audio')
+
+
+def load_notes():
+    # Excerpts of the recordings of various lengths, as short notes would be; decaying sinusoids when the
+    # recordings are not available (e.g. Git LFS pointers)
+    rng = np.random.default_rng(0)
+    lengths = rng.integers(int(min_duration * FS), int(max_duration * FS), n_notes)
+    try:
+        recordings = [read_wav(audio_folder / (name + '.wav')) for name in names]
+        recordings = [x if x.ndim == 1 else x.mean(axis=1) for x in recordings]
+    except ValueError:
+        print('Recordings not available, using synthetic notes')
+        t = np.arange(int(max_duration * FS)) / FS
+        recordings = [np.sin(2 * np.pi * f * t) * np.exp(- t / 0.1) for f in [440., 1760.]]
+
+    notes = []
+    for k, length in enumerate(lengths):
+        x = recordings[k % len(recordings)]
+        length = min(length, x.size)
+        start = rng.integers(0, x.size - length + 1)
+        notes.append(x[start: start + length])
+    return notes
+
+
+def throughput(name, function):
+    function()
+    start = time.time()
+    function()
+    synchronize(DEVICE)
+    duration = time.time() - start
+    print('%-24s %8.1f files/s' % (name, n_notes / duration))
+    return duration
+
+
+notes = load_notes()
+stft_layer = create_stft_layer(iSTFT=False)
+cqt_layer = create_cqt_layer()
+
+print('%d notes of %.1f to %.1f s' % (n_notes, min_duration, max_duration))
+loop = throughput('STFT, loop', lambda: [apply_stft_layer(x, stft_layer, verbose=False) for x in notes])
+batch = throughput('STFT, batches', lambda: apply_stft_layer_batch(notes, stft_layer, verbose=False,
+                                                                   batch_size=batch_size))
+print('%-24s %8.2fx' % ('STFT speed-up', loop / batch))
+loop = throughput('CQT, loop', lambda: [apply_cqt_layer(x, cqt_layer, verbose=False) for x in notes])
+batch = throughput('CQT, batches', lambda: apply_cqt_layer_batch(notes, cqt_layer, verbose=False,
+                                                                 batch_size=batch_size))
+print('%-24s %8.2fx' % ('CQT speed-up', loop / batch))
@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import time
+import platform
+import numpy as np
+import torch
+from pathlib import Path
+
+from mmm.spectrograms.parameters import FS
+from mmm.spectrograms.utils import get_device
+from mmm.spectrograms.layers import create_stft_layer, apply_stft_layer
+from mmm.spectrograms.processing import apply_closing, apply_reconstruction_by_erosion, apply_opening, \
+    apply_vertical_thinning, apply_horizontal_thinning, apply_vertical_top_hat, apply_horizontal_top_hat, \
+    apply_top_hat_threshold, remove_small_horizontal_lines, remove_small_vertical_lines, get_lines, filter_lines
+from mmm.spectrograms.synthesis import synthesize_white_noise, synthesize_noise_mask, synthesize_sinusoids, \
+    synthesize_transient
+from mmm.spectrograms.profiling import PROFILER, stage
+from mmm.spectrograms.procedures.io import read_wav
+
+
+# Parameters
+durations = [1., 2., 5.]  # s, excerpts taken from the start of every recording
+repeats = 1  # runs of every excerpt, the fastest is kept
+run_path = None  # None to run the benchmark, or the results of a run to compare with the reference
+reference_path = None  # results of an earlier run, None to skip the comparison
+tolerance = 0.1  # relative slow-down of a stage reported as a regression
+min_difference = 0.01  # s, differences below it are noise
+
+# Paths
+project_folder = Path('..') / Path('..')
+audio_folder = project_folder / Path('data') / Path('audio')
+benchmarks_folder = project_folder / Path('results') / Path('benchmarks')
+
+
+def load_recordings():
+    # Recordings of the corpus as mono signals; a synthetic recording when none is available (e.g. Git LFS pointers)
+    recordings = {}
+    for file_path in sorted(audio_folder.glob('*.wav')):
+        try:
+            x = read_wav(file_path)
+        except ValueError:
+            continue
+        recordings[file_path.stem] = x if x.ndim == 1 else x.mean(axis=1)
+
+    if len(recordings) == 0:
+        print('Recordings not available, using a synthetic recording')
+        rng = np.random.default_rng(0)
+        t = np.arange(int(max(durations) * FS)) / FS
+        x = 0.01 * rng.normal(size=t.size)
+        for onset in np.arange(0., max(durations), 0.5):
+            f_0 = 110. * 2 ** (rng.integers(0, 36) / 12)
+            envelope = np.where(t >= onset, np.exp(- (t - onset) / 0.3), 0.)
+            for harmonic in range(1, 6):
+                x += envelope * np.sin(2 * np.pi * harmonic * f_0 * (t - onset)) / harmonic
+        recordings['synthetic'] = (x / np.max(np.abs(x))).astype(np.float32)
+
+    return recordings
+
+
+def run_stages(x, stft_layer):
+    # Stages of the analysis-synthesis pipeline, each in a profiling span named after it
+    duration = x.size / FS
+    with stage('stft'):
+        spectrogram = apply_stft_layer(x, stft_layer, verbose=False)
+    with stage('closing'):
+        closing = apply_closing(spectrogram, {}, verbose=False)
+    with stage('reconstruction'):
+        reconstruction = apply_reconstruction_by_erosion(closing, spectrogram, verbose=False)
+    with stage('opening'):
+        opening = apply_opening(reconstruction, {}, verbose=False)
+    with stage('thinning'):
+        vertical_thin = apply_vertical_thinning(reconstruction, verbose=False)
+        horizontal_thin = apply_horizontal_thinning(reconstruction, verbose=False)
+    with stage('top_hat'):
+        vertical_threshold = apply_top_hat_threshold(reconstruction,
+                                                     apply_vertical_top_hat(vertical_thin, verbose=False),
+                                                     verbose=False)
+        horizontal_threshold = apply_top_hat_threshold(reconstruction,
+                                                       apply_horizontal_top_hat(horizontal_thin, verbose=False),
+                                                       verbose=False)
+    with stage('trimming'):
+        horizontal_filtered = remove_small_horizontal_lines(vertical_threshold, verbose=False)
+        vertical_filtered = remove_small_vertical_lines(horizontal_threshold, verbose=False)
+    with stage('get_lines'):
+        lines_sinusoids = get_lines(horizontal_filtered, 'time', verbose=False)
+        lines_transient = get_lines(vertical_filtered, 'frequency', verbose=False)
+    with stage('sinusoids'):
+        synthesize_sinusoids(filter_lines(lines_sinusoids, 1), verbose=False)
+    with stage('transient'):
+        synthesize_transient(filter_lines(lines_transient, 0), duration, verbose=False)
+    with stage('noise'):
+        white_noise = synthesize_white_noise(x.size)
+        white_noise_stft = apply_stft_layer(white_noise, stft_layer, verbose=False, output_format='Complex')
+        synthesize_noise_mask(white_noise_stft, opening, stft_layer)
+
+
+def run_benchmark():
+    recordings = load_recordings()
+    stft_layer = create_stft_layer()
+
+    # Resident memory of the process at the end of each stage, and its growth during the stage
+    results = []
+    PROFILER.enable()
+    for duration in sorted(durations):
+        for name, x in recordings.items():
+            if x.size < int(duration * FS):
+                print('%s is shorter than %.1f s, skipped' % (name, duration))
+                continue
+            excerpt = np.ascontiguousarray(x[:int(duration * FS)], dtype=np.float32)
+
+            times = {}
+            for _ in range(repeats):
+                PROFILER.clear()
+                run_stages(excerpt, stft_layer)
+                for event in PROFILER.events:
+                    if event['depth'] == 0:
+                        best = times.get(event['name'], (np.inf, None, None))
+                        times[event['name']] = min(best, (event['duration'], event['metadata'].get('rss_start'),
+                                                          event['metadata'].get('rss_end')),
+                                                   key=lambda entry: entry[0])
+
+            for stage_name, (stage_time, rss_start, rss_end) in times.items():
+                rss_growth = None if rss_start is None or rss_end is None else rss_end - rss_start
+                results.append({'recording': name, 'duration': duration, 'stage': stage_name, 'time': stage_time,
+                                'throughput': duration / stage_time, 'rss_end': rss_end, 'rss_growth': rss_growth})
+                print('%-16s %6.1f s %-16s %8.3f s %10.1f s/s %8.0f MB %+8.0f MB'
+                      % (name, duration, stage_name, stage_time, duration / stage_time, (rss_end or 0) / 2**20,
+                         (rss_growth or 0) / 2**20))
+    PROFILER.disable()
+
+    environment = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+                   'torch': torch.__version__, 'numpy': np.__version__, 'device': get_device(),
+                   'cpu_count': os.cpu_count(), 'machine': platform.machine(), 'repeats': repeats}
+    return {'environment': environment, 'results': results}
+
+
+def compare(reference, run):
+    # Stages slower than the reference by more than the tolerance, on the excerpts measured in both runs
+    reference_times = {(r['recording'], r['duration'], r['stage']): r['time'] for r in reference['results']}
+    regressions = []
+    for r in run['results']:
+        case = (r['recording'], r['duration'], r['stage'])
+        if case not in reference_times:
+            continue
+        ratio = r['time'] / reference_times[case]
+        regression = ratio > 1 + tolerance and r['time'] - reference_times[case] > min_difference
+        print('%-16s %6.1f s %-16s %8.3f s -> %8.3f s %6.2fx%s'
+              % (*case, reference_times[case], r['time'], ratio, '  REGRESSION' if regression else ''))
+        if regression:
+            regressions.append(case)
+    print('Regressions: %d' % len(regressions))
+    return regressions
+
+
+if run_path is None:
+    run = run_benchmark()
+    benchmarks_folder.mkdir(parents=True, exist_ok=True)
+    run_path = benchmarks_folder / ('pipeline_%s.json' % time.strftime('%Y%m%d_%H%M%S'))
+    with open(run_path, 'w') as f:
+        json.dump(run, f, indent=1)
+    print('Results written to %s' % run_path)
+else:
+    with open(run_path) as f:
+        run = json.load(f)
+
+if reference_path is not None:
+    with open(reference_path) as f:
+        reference = json.load(f)
+    if len(compare(reference, run)) > 0:
+        sys.exit(1)
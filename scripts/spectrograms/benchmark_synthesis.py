@@ -0,0 +1,49 @@
+import time
+import numpy as np
+
+from mmm.spectrograms.parameters import FS, TIME_RESOLUTION
+from mmm.spectrograms.synthesis import synthesize_sinusoids
+
+
+# Parameters
+n_lines = 2000
+duration = 20.  # s
+min_length = 0.1  # s
+max_length = 2.  # s
+
+
+def random_lines():
+    # Lines as get_lines finds them: one point per time bin, with a slowly varying frequency and amplitude
+    rng = np.random.default_rng(0)
+    lines = []
+    for _ in range(n_lines):
+        length = int(rng.integers(int(min_length / TIME_RESOLUTION), int(max_length / TIME_RESOLUTION)))
+        start = int(rng.integers(0, int(duration / TIME_RESOLUTION) - length))
+        times = (start + np.arange(length)) * TIME_RESOLUTION
+        freqs = 100 + 3000 * rng.random() + np.cumsum(rng.normal(size=length))
+        ampli = np.abs(rng.normal(size=length)) * 0.01
+        lines.append(np.stack((times, freqs, ampli), axis=1))
+    return lines
+
+
+def timing(name, function):
+    start = time.time()
+    result = function()
+    duration_synthesis = time.time() - start
+    print('%-24s %8.3f s %8.1fx real time' % (name, duration_synthesis, duration / duration_synthesis))
+    return result, duration_synthesis
+
+
+lines = random_lines()
+
+print('%d lines of %.1f to %.1f s in %.0f s of audio' % (n_lines, min_length, max_length, duration))
+reference, loop = timing('Loop', lambda: synthesize_sinusoids(lines, FS, verbose=False, engine='loop'))
+signal, bank = timing('Bank', lambda: synthesize_sinusoids(lines, FS, verbose=False, engine='bank'))
+signal_32, bank_32 = timing('Bank, float32', lambda: synthesize_sinusoids(lines, FS, verbose=False, engine='bank',
+                                                                          dtype=np.float32))
+
+scale = np.max(np.abs(reference))
+print('%-24s %8.2fx' % ('Bank speed-up', loop / bank))
+print('%-24s %8.2fx' % ('Bank float32 speed-up', loop / bank_32))
+print('%-24s %8.1e' % ('Bank error', np.max(np.abs(signal - reference)) / scale))
+print('%-24s %8.1e' % ('Bank float32 error', np.max(np.abs(signal_32 - reference)) / scale))
@@ -0,0 +1,133 @@
+import tempfile
+import unittest
+
+
+class TestResultCache(unittest.TestCase):
+    def test_hits(self):
+        import numpy as np
+        from mmm.spectrograms.procedures.io import ResultCache
+
+        x = np.arange(100.)
+        with tempfile.TemporaryDirectory() as folder:
+            cache = ResultCache(folder)
+            first = cache.load_or_compute('square', lambda: x ** 2, verbose=False)
+            second = cache.load_or_compute('square', lambda: x ** 2, verbose=False)
+            self.assertTrue(np.array_equal(first, second))
+            self.assertEqual(cache.stats()['misses'], 1)
+            self.assertEqual(cache.stats()['hits'], 1)
+
+            # Same stage on other data
+            x = np.arange(10.)
+            third = cache.load_or_compute('square', lambda: x ** 2, verbose=False)
+            self.assertEqual(third.size, 10)
+            self.assertEqual(cache.stats()['misses'], 2)
+
+            # Index kept on disk
+            self.assertEqual(ResultCache(folder).stages, cache.stages)
+
+    def test_parameter_sets(self):
+        import numpy as np
+        from mmm.spectrograms.procedures.io import ResultCache
+
+        x = np.arange(100.)
+        parameters = {'scale': 2.}
+        with tempfile.TemporaryDirectory() as folder:
+            cache = ResultCache(folder)
+            for scale in [2., 3., 2.]:
+                parameters['scale'] = scale
+                scaled = cache.load_or_compute('scaled', lambda: x * parameters['scale'], verbose=False)
+                shifted = cache.load_or_compute('shifted', lambda: scaled + 1, verbose=False)
+                self.assertEqual(shifted[1], scale + 1)
+
+            # The results of the first parameters are still there when going back to them
+            self.assertEqual(cache.stats()['misses'], 4)
+            self.assertEqual(cache.stats()['hits'], 2)
+            self.assertEqual(cache.stats()['invalidations'], 0)
+            self.assertEqual(len(cache.entries), 4)
+
+    def test_invalidation(self):
+        import numpy as np
+        from mmm.spectrograms.procedures.io import ResultCache
+
+        rng = np.random.default_rng(0)
+        with tempfile.TemporaryDirectory() as folder:
+            cache = ResultCache(folder)
+            noise = cache.load_or_compute('noise', lambda: rng.random(10), verbose=False)
+            cache.load_or_compute('shifted', lambda: noise + 1, verbose=False)
+
+            # Computed again with the same key but another result, the results computed from it are removed
+            noise = cache.load_or_compute('noise', lambda: rng.random(10), load=False, verbose=False)
+            self.assertEqual(cache.stats()['invalidations'], 1)
+            self.assertEqual(list(cache.stages), ['noise'])
+            shifted = cache.load_or_compute('shifted', lambda: noise + 1, verbose=False)
+            self.assertTrue(np.array_equal(shifted, noise + 1))
+
+    def test_eviction(self):
+        import numpy as np
+        from mmm.spectrograms.procedures.io import ResultCache
+
+        with tempfile.TemporaryDirectory() as folder:
+            cache = ResultCache(folder, budget=3000)
+            for n in [100, 101, 102, 103]:
+                cache.load_or_compute('zeros_%d' % n, lambda: np.zeros(n), verbose=False)
+            self.assertLessEqual(cache.size(), 3000)
+            self.assertEqual(cache.stats()['evictions'], 1)
+            self.assertNotIn('zeros_100', cache.stages)
+
+
+class TestPipelineCache(unittest.TestCase):
+    def test_synthesis_stages(self):
+        import numpy as np
+        import torch
+        from pathlib import Path
+        from mmm.spectrograms.parameters import FS, MIN_DB
+        from mmm.spectrograms.layers import create_stft_layer, apply_stft_layer
+        from mmm.spectrograms.procedures.io import result_cache
+        from mmm.spectrograms.procedures.synthesis import synthesize_signals
+
+        stft_layer = create_stft_layer(n_fft=1024, win_length=512)
+        t = np.arange(int(0.3 * FS)) / FS
+        x = (0.5 * np.sin(2 * np.pi * 440 * t) + 0.2 * np.sin(2 * np.pi * 1250 * t)).astype(np.float32)
+        spectrogram = apply_stft_layer(x, stft_layer, verbose=False)
+        peaks = torch.where(spectrogram > spectrogram.max() - 20, spectrogram, MIN_DB)
+        components = {'noise': True, 'sinusoids': True, 'transient': True, 'output': True}
+        names = ['white_noise', 'filtered_noise', 'lines_sinusoids', 'sinusoids', 'lines_transient', 'transient']
+
+        with tempfile.TemporaryDirectory() as folder:
+            paths = {'arrays_folder': Path(folder) / 'arrays', 'audio_folder': Path(folder) / 'audio'}
+            spectrograms = {'input': spectrogram, 'opening': spectrogram, 'horizontal_filtered': peaks,
+                            'vertical_filtered': peaks}
+            for engine in ['thread', 'sequential']:
+                # The second run has the outputs of the first one and an unrelated array in the dictionaries
+                synthesize_signals({}, {'input': x}, spectrograms, paths, {name: True for name in names},
+                                   components, stft_layer, engine=engine)
+                spectrograms['unrelated'] = torch.zeros(3)
+
+            statistics = [result_cache(paths[name]).stats() for name in ['arrays_folder', 'audio_folder']]
+            self.assertEqual(sum(entry['misses'] for entry in statistics), len(names))
+            self.assertEqual(sum(entry['hits'] for entry in statistics), len(names))
+            self.assertEqual(sum(entry['invalidations'] for entry in statistics), 0)
+
+
+class TestArrayStore(unittest.TestCase):
+    def test_compression(self):
+        import numpy as np
+        import torch
+        from pathlib import Path
+        from mmm.spectrograms.procedures.io import save_array, open_array, read_window
+        from mmm.spectrograms.parameters import TIME_RESOLUTION, FREQUENCY_PRECISION
+
+        x = torch.from_numpy(-80 * np.random.default_rng(0).random((30, 50)).astype(np.float32))
+        with tempfile.TemporaryDirectory() as folder:
+            for compression, tolerance in [(None, 0.), ('float16', 0.05), ('int16', 0.005 + 1e-6)]:
+                file_path = Path(folder) / ('x_%s.npy' % compression)
+                save_array(file_path, x, compression=compression)
+                stored = open_array(file_path)
+                self.assertLessEqual(float((stored.load() - x).abs().max()), tolerance)
+
+                # Window read from the disk
+                window, origin = read_window(stored, (10 * TIME_RESOLUTION, 20 * TIME_RESOLUTION),
+                                             (5 * FREQUENCY_PRECISION, 8 * FREQUENCY_PRECISION))
+                self.assertEqual(origin, (5, 10))
+                self.assertEqual(tuple(window.shape), (4, 11))
+                self.assertLessEqual(float((window - x[5: 9, 10: 21]).abs().max()), tolerance)
@@ -0,0 +1,112 @@
+import unittest
+import networkx as nx
+
+
+def derived_activations_graph():
+    from mmm.pianorolls.music import Texture, Rhythm, Hit, Harmony, Chord, PianoRollStack, ActivationsStack, \
+        Activations, TimeFrequency, TimePoint, TimeShift, FrequencyPoint
+    from mmm.pianorolls.morphology import erosion, dilation
+    from mmm.pianorolls.graphs import ActivationsGraph, DerivedActivationsGraph
+
+    texture = Texture(
+        Rhythm(Hit('0/4', '1/2')),
+        Rhythm(Hit('1/4', '1/4')),
+    )
+    harmonic_textures = PianoRollStack(
+        texture * Harmony(Chord(0), Chord(3)),
+        texture * Harmony(Chord(0, 3), Chord(0)),
+    )
+    start = TimePoint(1, 1, 0)
+    activations = ActivationsStack(
+        Activations(TimeFrequency(start, FrequencyPoint(60))),
+        Activations(TimeFrequency(start + TimeShift(1, 2), FrequencyPoint(60))),
+    )
+    piano_roll = dilation(activations, harmonic_textures)
+    activations_texture = erosion(piano_roll, texture)
+    activations_texture.change_extension(piano_roll.extension)
+    graph = ActivationsGraph(piano_roll, activations_texture.synchronize(), texture)
+
+    return DerivedActivationsGraph(graph)
+
+
+class TestDerivedActivationsGraph(unittest.TestCase):
+    def test_derive(self):
+        derived_graph = derived_activations_graph()
+        networkx_graph = derived_graph.to_networkx()
+        self.assertEqual(derived_graph.number_of_nodes(), networkx_graph.number_of_nodes())
+        self.assertEqual(derived_graph.number_of_edges(), networkx_graph.number_of_edges())
+
+        # Nodes of the derivative are the edges of the graph
+        second_derived_graph = derived_graph.derive().derive()
+        self.assertEqual(second_derived_graph.order, 2)
+        first_derived_graph = derived_graph.derive()
+        self.assertEqual(second_derived_graph.number_of_nodes(), first_derived_graph.number_of_edges())
+        for k in range(second_derived_graph.number_of_nodes()):
+            u, v, w = second_derived_graph.node(k)
+            self.assertEqual(u.cluster + 1, v.cluster)
+            self.assertEqual(v.cluster + 1, w.cluster)
+
+        # Same shortest paths as networkx on the converted graph
+        for order in range(4):
+            pruned_graph = derived_graph
+            for _ in range(order):
+                pruned_graph = pruned_graph.derive()
+            pruned_graph.remove_inconsistent_nodes()
+            pruned_graph.add_start_end_nodes()
+            pruned_graph.weight_graph()
+
+            shortest_paths = pruned_graph.shortest_paths()
+            try:
+                expected = list(nx.all_shortest_paths(pruned_graph.to_networkx(), 'S', 'E', weight='weight'))
+            except nx.NetworkXNoPath:
+                expected = []
+            self.assertEqual(sorted(map(str, shortest_paths)), sorted(map(str, expected)))
+
+            # The lazy search gives the same paths, in the same order
+            self.assertEqual(list(map(str, derived_graph.lazy_shortest_paths(order))), list(map(str, shortest_paths)))
+
+    def test_checkpoint(self):
+        import tempfile
+        import numpy as np
+        from pathlib import Path
+        from mmm.pianorolls.graphs import DerivedActivationsGraph
+
+        derived_graph = derived_activations_graph()
+        pruned_graph = derived_graph.derive().derive()
+        pruned_graph.remove_inconsistent_nodes()
+        pruned_graph.add_start_end_nodes()
+        pruned_graph.weight_graph()
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = Path(folder) / 'derivative_graph-2.npz'
+            pruned_graph.save(path)
+            self.assertEqual([p.name for p in Path(folder).iterdir()], [path.name])
+
+            loaded_graph = derived_graph.load(path)
+            self.assertIsInstance(loaded_graph, DerivedActivationsGraph)
+            self.assertEqual(loaded_graph.order, 2)
+            self.assertTrue(np.array_equal(loaded_graph.weights, pruned_graph.weights))
+            self.assertEqual(list(map(str, loaded_graph.shortest_paths())), list(map(str, pruned_graph.shortest_paths())))
+
+            # Version header
+            with np.load(path) as data:
+                arrays = dict(data)
+            arrays['version'] = np.array(0)
+            np.savez(path, **arrays)
+            with self.assertRaises(ValueError):
+                derived_graph.load(path)
+
+            with self.assertRaises(FileNotFoundError):
+                derived_graph.load(Path(folder) / 'derivative_graph-3.npz')
+
+    def test_unique_rows(self):
+        import numpy as np
+        from mmm.pianorolls.graphs import unique_rows
+
+        rng = np.random.default_rng(0)
+        digits = rng.integers(0, 3, (200, 5))
+        expected, expected_inverse = np.unique(digits, axis=0, return_inverse=True)
+        for radices in [np.full(5, 3), np.full(5, 2 ** 20)]:
+            index, inverse = unique_rows(digits, radices)
+            self.assertTrue(np.array_equal(digits[index], expected))
+            self.assertTrue(np.array_equal(inverse, expected_inverse.reshape(-1)))
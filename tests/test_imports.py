@@ -0,0 +1,57 @@
+import subprocess
+import sys
+import unittest
+
+# Cumulative time allowed by python -X importtime for each package, in microseconds
+IMPORT_BUDGET = 50000
+HEAVY_MODULES = ['torch', 'scipy', 'matplotlib', 'networkx', 'nnAudio', 'nnMorpho']
+
+
+def run_imports(code):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+                            check=True)
+    # Cumulative import time of every module imported, in microseconds
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            cumulative.setdefault(fields[2].strip(), int(fields[1]))
+    return cumulative, result.stdout
+
+
+def import_profile(module):
+    # Cumulative import time of the module, without the one of numpy that every module of the project needs, and the
+    # set of modules it loaded, measured in a fresh interpreter
+    cumulative, stdout = run_imports('import sys, %s; print(" ".join(sys.modules))' % module)
+    return cumulative[module] - cumulative.get('numpy', 0), set(stdout.split())
+
+
+class TestImports(unittest.TestCase):
+    def test_budget(self):
+        for module in ['mmm.pianorolls', 'mmm.spectrograms', 'mmm.spectrograms.parameters',
+                       'mmm.spectrograms.synthesis']:
+            cumulative, modules = import_profile(module)
+            self.assertLessEqual(cumulative, IMPORT_BUDGET, module)
+            for heavy in HEAVY_MODULES:
+                self.assertNotIn(heavy, modules, module)
+
+    def test_processing(self):
+        # torch and nnMorpho are needed by the morphology, the other libraries only by some of the functions
+        _, modules = import_profile('mmm.spectrograms.processing')
+        for heavy in ['scipy.signal', 'scipy.ndimage', 'matplotlib', 'networkx', 'nnAudio']:
+            self.assertNotIn(heavy, modules)
+
+    def test_no_cached_calls(self):
+        # Structuring elements and windows are computed on first use, not when the modules are imported
+        code = 'from mmm.spectrograms import processing, templates; ' \
+               'print(templates.template.cache_info().misses, processing.window_spread.cache_info().misses)'
+        _, stdout = run_imports(code)
+        self.assertEqual(stdout.split(), ['0', '0'])
+
+    def test_lazy_submodules(self):
+        import mmm.pianorolls
+        from mmm.pianorolls import music
+
+        self.assertIs(mmm.pianorolls.music, music)
+        with self.assertRaises(AttributeError):
+            getattr(mmm.pianorolls, 'missing')
@@ -0,0 +1,51 @@
+import unittest
+
+
+class TestBatches(unittest.TestCase):
+    def test_batch_signals(self):
+        import numpy as np
+        from mmm.spectrograms.layers import batch_signals
+
+        signals = [np.zeros(n) for n in [300, 3000, 2900, 1000, 2000]]
+        batches = batch_signals(signals, batch_size=2, padding=0.5)
+        self.assertEqual([list(indices) for indices in batches], [[1, 2], [4, 3], [0]])
+
+    def test_layers(self):
+        import numpy as np
+        import torch
+        from mmm.spectrograms.layers import create_stft_layer, create_cqt_layer, apply_stft_layer, apply_cqt_layer, \
+            apply_stft_layer_batch, apply_cqt_layer_batch, apply_tfst_layer_batch
+        from mmm.spectrograms.tfst import TFST
+
+        # Ragged lengths, padded into one batch or cut into several
+        rng = np.random.default_rng(0)
+        signals = [rng.normal(size=n).astype(np.float32) for n in [3000, 300, 2950, 1234, 2000]]
+        stft_layer = create_stft_layer(n_fft=256, win_length=256, hop_length=64, iSTFT=False, device='cpu')
+        cqt_layer = create_cqt_layer(fs=8000, hop_length=64, f_min=200, n_bins=24, bins_per_octave=12, device='cpu')
+        tfst_layer = TFST(fs=8000, time_resolution=0.01, sizes=(64, 128), f_min=100, n_octaves=3, bins_per_octave=4,
+                          device='cpu')
+
+        for batch_size, padding in [(8, 1.), (2, 0.5)]:
+            case = '%d %s' % (batch_size, padding)
+            for output_format in ['Magnitude', 'Complex']:
+                batched = apply_stft_layer_batch(signals, stft_layer, verbose=False, output_format=output_format,
+                                                 device='cpu', batch_size=batch_size, padding=padding)
+                for signal, spectrogram in zip(signals, batched):
+                    expected = apply_stft_layer(signal, stft_layer, verbose=False, output_format=output_format,
+                                                device='cpu')
+                    self.assertTrue(torch.equal(spectrogram, expected), case)
+
+            batched = apply_cqt_layer_batch(signals, cqt_layer, verbose=False, device='cpu', batch_size=batch_size,
+                                            padding=padding)
+            # The batched convolution may sum in another order, which moves the levels by rounding errors only
+            for signal, spectrogram in zip(signals, batched):
+                expected = apply_cqt_layer(signal, cqt_layer, verbose=False, device='cpu')
+                self.assertEqual(spectrogram.shape, expected.shape, case)
+                self.assertLess(torch.max(torch.abs(spectrogram - expected)), 1e-3, case)
+
+            batched = apply_tfst_layer_batch(signals, tfst_layer, verbose=False, device='cpu', batch_size=batch_size,
+                                             padding=padding)
+            for signal, spectrogram in zip(signals, batched):
+                expected = tfst_layer(torch.tensor(signal))
+                self.assertEqual(spectrogram.shape, expected.shape, case)
+                self.assertLess(torch.max(torch.abs(spectrogram - expected)), 1e-6 * torch.max(expected), case)
@@ -0,0 +1,91 @@
+import unittest
+import numpy as np
+
+
+class TestErosion(unittest.TestCase):
+    def test_bitset(self):
+        from mmm.pianorolls.music import PianoRoll, TimeFrequency, TimeShift, TimePoint, FrequencyShift, \
+            FrequencyPoint
+        from mmm.pianorolls.morphology import erosion
+
+        rng = np.random.default_rng(0)
+        array = (rng.random((12, 150)) < 0.6).astype(np.int8)
+        piano_roll = PianoRoll(array, TimeFrequency(TimePoint(0), FrequencyPoint(60)), TimeShift(1, 4),
+                               FrequencyShift(1))
+
+        str_els = [
+            (np.array([[1, 1, 0, 1]], dtype=np.int8), TimeFrequency(TimeShift(0), FrequencyShift(0))),
+            (np.array([[1, 0], [0, 1], [1, 1]], dtype=np.int8), TimeFrequency(TimeShift(1, 2), FrequencyShift(2))),
+            (np.array([[1], [1]], dtype=np.int8), TimeFrequency(TimeShift(-1, 4), FrequencyShift(-1))),
+            (np.ones((2, 70), dtype=np.int8), TimeFrequency(TimeShift(0), FrequencyShift(0))),
+        ]
+        for str_el_array, origin in str_els:
+            structuring_element = PianoRoll(str_el_array, origin, TimeShift(1, 4), FrequencyShift(1))
+            activations_numpy = erosion(piano_roll, structuring_element, engine='numpy')
+            activations_bitset = erosion(piano_roll, structuring_element, engine='bitset')
+
+            self.assertEqual(len(activations_numpy), len(activations_bitset))
+            for a, b in zip(activations_numpy, activations_bitset):
+                self.assertEqual(a, b)
+
+    def test_sliding(self):
+        from mmm.pianorolls.music import PianoRoll, TimeFrequency, TimeShift, TimePoint, FrequencyShift, \
+            FrequencyPoint, Hit, Rhythm
+        from mmm.pianorolls.morphology import erosion
+
+        rng = np.random.default_rng(1)
+        array = rng.choice(np.array([0, 1, 2], dtype=np.uint8), size=(10, 120), p=[0.3, 0.4, 0.3])
+        piano_roll = PianoRoll(array, TimeFrequency(TimePoint(0), FrequencyPoint(60)), TimeShift(1, 8),
+                               FrequencyShift(1))
+
+        rhythms = [
+            Rhythm(Hit('0', '1/4')),
+            Rhythm(Hit('0', '1/8'), Hit('1/4', '1/4')),
+            Rhythm(Hit('-1/8', '1/4'), Hit('1/4', '1/8')),
+        ]
+        for rhythm in rhythms:
+            activations_numpy = erosion(piano_roll, rhythm, engine='numpy')
+            activations_sliding = erosion(piano_roll, rhythm)
+
+            self.assertEqual(len(activations_numpy), len(activations_sliding))
+            for a, b in zip(activations_numpy, activations_sliding):
+                self.assertEqual(a, b)
+
+    def test_attack(self):
+        from mmm.pianorolls.music import PianoRoll, TimeFrequency, TimeShift, TimePoint, FrequencyShift, \
+            FrequencyPoint, Hit, Rhythm
+        from mmm.pianorolls.morphology import erosion
+
+        array = np.array([[2, 1, 1, 2, 1, 0, 1, 1]], dtype=np.uint8)
+        piano_roll = PianoRoll(array, TimeFrequency(TimePoint(0), FrequencyPoint(60)), TimeShift(1, 4),
+                               FrequencyShift(1))
+
+        activations = erosion(piano_roll, Rhythm(Hit('0', '1/2')))
+        self.assertEqual([a.time for a in activations], [TimePoint(0), TimePoint(3, 4)])
+
+
+class TestDilation(unittest.TestCase):
+    def test_batched(self):
+        from mmm.pianorolls.music import PianoRoll, TimeFrequency, TimeShift, TimePoint, FrequencyShift, \
+            FrequencyPoint, Activations
+        from mmm.pianorolls.morphology import dilation
+
+        rng = np.random.default_rng(2)
+        f_idx, t_idx = np.nonzero(rng.random((6, 40)) < 0.2)
+        activations = Activations.from_indices(f_idx, t_idx, TimeFrequency(TimePoint(1, 4), FrequencyPoint(48)),
+                                               TimeShift(1, 4), FrequencyShift(1))
+        structuring_element = PianoRoll(np.array([[2, 1, 1], [0, 2, 0]], dtype=np.int8),
+                                        TimeFrequency(TimeShift(-1, 8), FrequencyShift(1)),
+                                        TimeShift(1, 8), FrequencyShift(1))
+
+        expected = PianoRoll()
+        for activation in activations:
+            shifted_piano_roll = structuring_element.copy()
+            shifted_piano_roll.shift(activation)
+            expected += shifted_piano_roll
+
+        result = dilation(activations, structuring_element)
+
+        self.assertTrue(np.array_equal(result.array, expected.array))
+        self.assertEqual(result.origin, expected.origin)
+        self.assertEqual(result.tatum, expected.tatum)
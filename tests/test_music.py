@@ -59,6 +59,22 @@ class TestFrequency(unittest.TestCase):
 
 
 class TestTimeFrequency(unittest.TestCase):
+    def test_slots(self):
+        import pickle
+        from copy import deepcopy
+        from mmm.pianorolls.music import TimeShift, FrequencyShift, TimeFrequency, TimePoint, FrequencyPoint
+
+        time_frequency = TimeFrequency(TimePoint(3, 4, time_signature=(6, 8)), FrequencyPoint(60))
+        shifted = time_frequency + TimeFrequency(TimeShift(1, 8), FrequencyShift(2))
+
+        self.assertEqual(shifted, TimeFrequency(TimePoint(7, 8), FrequencyPoint(62)))
+        self.assertIs(shifted.time.time_signature, time_frequency.time.time_signature)
+        self.assertIs(FrequencyPoint.from_value(62), shifted.frequency)
+
+        for copy in [pickle.loads(pickle.dumps(shifted)), deepcopy(shifted)]:
+            self.assertEqual(copy, shifted)
+            self.assertEqual(copy.time.time_signature.duration, TimeShift(6, 8))
+
     def test_time_frequency(self):
         from mmm.pianorolls.music import TimeShift, FrequencyShift, TimeFrequency, TimePoint, FrequencyPoint
 
@@ -78,6 +94,31 @@ class TestTimeFrequency(unittest.TestCase):
                     TimeFrequency(time, 0, time_nature, frequency_nature)
 
 
+class TestActivations(unittest.TestCase):
+    def test_from_indices(self):
+        import numpy as np
+        from mmm.pianorolls.music import TimeShift, FrequencyShift, TimeFrequency, TimePoint, FrequencyPoint, \
+            Activations
+
+        origin = TimeFrequency(TimePoint(1, 2), FrequencyPoint(60))
+        f_idx = np.array([0, 2, 2, 5])
+        t_idx = np.array([4, 8, 16, 12])
+        values = [TimeFrequency(origin.time + int(t) * TimeShift(1, 8), origin.frequency + int(f) * FrequencyShift(1))
+                  for f, t in zip(f_idx, t_idx)]
+
+        activations = Activations(*values)
+        lazy = Activations.from_indices(f_idx, t_idx, origin, TimeShift(1, 8), FrequencyShift(1))
+
+        self.assertEqual(len(lazy), 4)
+        self.assertIsNone(lazy._activations)
+        self.assertTrue(np.array_equal(lazy.array, activations.array))
+        self.assertEqual(lazy.origin, activations.origin)
+        self.assertEqual(lazy.tatum, activations.tatum)
+        self.assertEqual(list(lazy), values)
+
+        self.assertEqual(len(Activations.from_indices([], [], origin, TimeShift(1, 8), FrequencyShift(1))), 0)
+
+
 class TestHarmonicTexture(unittest.TestCase):
     def test_texture(self):
         from mmm.pianorolls.music import Hit, Rhythm, Texture, WrongNature
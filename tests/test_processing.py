@@ -0,0 +1,90 @@
+import unittest
+import numpy as np
+
+
+def labelled_spectrogram():
+    # Lines of pixels (frequency bin, column) with their level in dB, on a background below MIN_DB
+    from mmm.spectrograms.parameters import MIN_DB
+
+    lines = {
+        'stepped': [(5, t) for t in range(10, 70)] + [(6, t) for t in range(70, 140)],
+        'short': [(20, t) for t in range(10, 60)],
+        'quiet': [(30, t) for t in range(0, 190)],
+        'gap': [(35, t) for t in range(0, 250)],
+        'vertical': [(f, 200) for f in range(2, 30)],
+        'vertical_short': [(f, 230) for f in range(0, 10)],
+    }
+    levels = {'stepped': -60., 'short': -40., 'quiet': -110., 'gap': -80., 'vertical': -50., 'vertical_short': -30.}
+
+    spectrogram = np.full((40, 260), MIN_DB - 10., dtype=np.float32)
+    for name, pixels in lines.items():
+        f, t = np.array(pixels).T
+        spectrogram[f, t] = levels[name] + 0.1 * np.arange(f.size) / f.size
+    # One pixel of the line above min_db but below the other levels, which cuts it in two at a higher min_db
+    spectrogram[35, 120] = -90.
+    lines['gap_start'] = lines['gap'][:120]
+    lines['gap_end'] = lines['gap'][121:]
+
+    return spectrogram, lines
+
+
+class TestLines(unittest.TestCase):
+    def test_get_lines(self):
+        import torch
+        from mmm.spectrograms.parameters import TIME_RESOLUTION, FREQUENCY_PRECISION
+        from mmm.spectrograms.processing import get_lines, Lines
+
+        spectrogram, pixels = labelled_spectrogram()
+        origin = (3, 7)
+        # The short lines are too short for their axis, the quiet one below MIN_AMPLI_DB
+        cases = [('time', None, ['stepped', 'gap']),
+                 ('time', -85., ['stepped', 'gap_start', 'gap_end']),
+                 ('frequency', None, ['stepped', 'short', 'gap', 'vertical'])]
+        for sort_by, min_db, names in cases:
+            case = '%s %s' % (sort_by, min_db)
+            kwargs = {} if min_db is None else {'min_db': min_db}
+            lines = get_lines(torch.tensor(spectrogram), sort_by, verbose=False, origin=origin, **kwargs)
+            self.assertIsInstance(lines, Lines)
+            self.assertEqual(len(lines), len(names), case)
+            self.assertEqual(list(lines.lengths), [line.shape[0] for line in lines], case)
+
+            found = {}
+            for line in lines:
+                t = np.round(line[:, 0] / TIME_RESOLUTION).astype(int) - origin[1]
+                f = np.round(line[:, 1] / FREQUENCY_PRECISION).astype(int) - origin[0]
+                found[frozenset(zip(f, t))] = line
+
+                # Sorted along the line, then across it
+                if sort_by == 'time':
+                    order = np.lexsort((f, t))
+                else:
+                    order = np.lexsort((t, f))
+                self.assertTrue(np.array_equal(order, np.arange(t.size)), case)
+                self.assertTrue(np.allclose(line[:, 2], 10 ** (spectrogram[f, t] / 20), rtol=1e-5), case)
+
+            self.assertEqual(set(found), {frozenset(pixels[name]) for name in names}, case)
+
+    def test_filter_lines(self):
+        import torch
+        import scipy.signal as sig
+        from mmm.spectrograms.parameters import FILTER_SINUSOIDS
+        from mmm.spectrograms.processing import get_lines, filter_lines, Lines
+
+        spectrogram, _ = labelled_spectrogram()
+        lines = get_lines(torch.tensor(spectrogram), 'time', verbose=False)
+        original = lines.copy()
+        ba = sig.butter(*FILTER_SINUSOIDS)
+
+        # Lines as returned by get_lines, and lists of arrays as old pickles hold them
+        for lines_input in [lines, [np.copy(line) for line in lines]]:
+            filtered = filter_lines(lines_input, 1)
+            self.assertIsInstance(filtered, type(lines_input))
+            self.assertEqual(len(filtered), len(original))
+            for line, line_original in zip(filtered, original):
+                expected = np.copy(line_original)
+                expected[:, 1] = sig.filtfilt(*ba, line_original[:, 1], method='gust')
+                self.assertTrue(np.allclose(line, expected))
+
+        # The input is left as it was
+        self.assertTrue(np.array_equal(lines.data, original.data))
+        self.assertTrue(np.array_equal(lines.offsets, original.offsets))
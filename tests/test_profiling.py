@@ -0,0 +1,75 @@
+import json
+import tempfile
+import unittest
+
+
+class TestProfiler(unittest.TestCase):
+    def test_spans(self):
+        import numpy as np
+        from pathlib import Path
+        from mmm.spectrograms.profiling import PROFILER, profiled, stage, record
+
+        @profiled('double')
+        def double(x):
+            record(iterations=3)
+            return 2 * x
+
+        PROFILER.clear()
+        double(np.zeros(10))
+        self.assertEqual(PROFILER.events, [])
+
+        PROFILER.enable()
+        try:
+            with stage('outer', label='test'):
+                double(np.zeros((4, 5), dtype=np.float32))
+        finally:
+            PROFILER.disable()
+
+        inner, outer = PROFILER.events
+        self.assertEqual((inner['name'], inner['depth']), ('double', 1))
+        self.assertEqual(inner['metadata']['iterations'], 3)
+        self.assertEqual(inner['metadata']['output'], {'shape': [4, 5], 'dtype': 'float32', 'bytes': 80})
+        self.assertEqual(outer['metadata']['label'], 'test')
+        self.assertLessEqual(inner['duration'], outer['duration'])
+        self.assertGreater(inner['metadata']['rss_start'], 0)
+        self.assertGreater(inner['metadata']['rss_end'], 0)
+        self.assertEqual(PROFILER.open_count, 0)
+
+        with tempfile.TemporaryDirectory() as folder:
+            PROFILER.to_json(Path(folder) / 'profile.json')
+            PROFILER.to_chrome_trace(Path(folder) / 'trace.json')
+            with open(Path(folder) / 'profile.json') as f:
+                self.assertEqual(json.load(f)['summary']['double']['count'], 1)
+            with open(Path(folder) / 'trace.json') as f:
+                self.assertEqual([event['ph'] for event in json.load(f)['traceEvents']], ['X', 'X'])
+        PROFILER.clear()
+
+    def test_concurrent_spans(self):
+        import threading
+        from mmm.spectrograms.profiling import PROFILER, stage
+
+        # Spans open on several threads at once, counted by the profiler until the last one closes
+        barrier = threading.Barrier(3)
+        counts = []
+
+        def run():
+            with stage('concurrent'):
+                barrier.wait()
+                counts.append(PROFILER.open_count)
+                barrier.wait()
+
+        PROFILER.clear()
+        PROFILER.enable()
+        try:
+            threads = [threading.Thread(target=run) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            PROFILER.disable()
+
+        self.assertEqual(counts, [3, 3, 3])
+        self.assertEqual(PROFILER.open_count, 0)
+        self.assertEqual([event['depth'] for event in PROFILER.events], [0, 0, 0])
+        PROFILER.clear()
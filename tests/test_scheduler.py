@@ -0,0 +1,37 @@
+import time
+import unittest
+
+
+class TestStageGraph(unittest.TestCase):
+    def test_order(self):
+        from mmm.spectrograms.procedures.scheduler import StageGraph
+
+        graph = StageGraph()
+        graph.add('output', lambda: 0, after=['noise', 'sinusoids'])
+        graph.add('noise', lambda: 0, after=['input'])
+        graph.add('sinusoids', lambda: 0, after=['input'])
+        graph.add('input', lambda: 0, after=['spectrogram'])
+        self.assertEqual(graph.order(), ['input', 'noise', 'sinusoids', 'output'])
+
+        graph.add('cycle', lambda: 0, after=['cycle'])
+        with self.assertRaises(ValueError):
+            graph.order()
+
+    def test_run(self):
+        from mmm.spectrograms.procedures.scheduler import StageGraph
+
+        for engine in ['sequential', 'thread']:
+            # Stages called with the results of the stages they depend on, in order
+            graph = StageGraph({'spectrogram': 1})
+            graph.add('input', lambda spectrogram: spectrogram + 1, after=['spectrogram'])
+            graph.add('short', lambda x: x + 1, after=['input'])
+            graph.add('long', lambda x: time.sleep(0.05) or x * 10, after=['input'])
+            graph.add('output', lambda short, long: (short, long), after=['short', 'long'])
+            results = graph.run(engine=engine, workers=2, verbose=False)
+            self.assertEqual(results['output'], (3, 20))
+            self.assertEqual(graph.critical_path()[0], ['input', 'long', 'output'])
+
+        graph = StageGraph()
+        graph.add('input', lambda spectrogram: spectrogram, after=['spectrogram'])
+        with self.assertRaises(ValueError):
+            graph.run(verbose=False)
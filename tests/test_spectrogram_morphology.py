@@ -0,0 +1,145 @@
+import unittest
+import numpy as np
+
+
+def spectrogram_image(seed, shape=(45, 70)):
+    # Levels in dB with ties, isolated pixels at minus infinity and a silent column
+    import torch
+
+    rng = np.random.default_rng(seed)
+    x = np.round(rng.normal(-50., 15., size=shape))
+    x[rng.random(shape) < 0.1] = -np.inf
+    x[:, shape[1] // 3] = -np.inf
+    return torch.tensor(x, dtype=torch.float32)
+
+
+class TestThinning(unittest.TestCase):
+    def unfused(self, x, templates, iterations):
+        # Iterations of greyscale_hit_or_miss, one full erosion and dilation per template
+        import torch
+        from mmm.spectrograms.morphology import greyscale_hit_or_miss
+
+        count = 0
+        while True:
+            x_out = x
+            for str_el_in, str_el_out in templates:
+                x_out = x_out - greyscale_hit_or_miss(x_out, str_el_in, str_el_out)
+            if torch.equal(x_out, x):
+                break
+            x = x_out
+            count += 1
+            if count == iterations:
+                break
+        return x
+
+    def test_engines(self):
+        import torch
+        from mmm.spectrograms.morphology import greyscale_thinning, greyscale_trimming, thinning_templates, \
+            trimming_templates
+
+        operations = [(greyscale_thinning, thinning_templates), (greyscale_trimming, trimming_templates)]
+        for seed, (operation, templates) in enumerate(operations):
+            x = spectrogram_image(seed)
+            for direction in ['h', 'v']:
+                for iterations in [None, 1, 2]:
+                    case = '%s %s %s' % (operation.__name__, direction, iterations)
+                    expected = self.unfused(x, templates(direction), iterations)
+                    fused = operation(x, iterations, direction, engine='iterative')
+                    tiles = operation(x, iterations, direction, engine='tiles', tile_size=16)
+
+                    self.assertTrue(torch.equal(fused, expected), case)
+                    self.assertTrue(torch.equal(tiles, expected), case)
+
+
+class TestDeltaStack(unittest.TestCase):
+    def test_frames(self):
+        import pickle
+        import tempfile
+        import torch
+        from mmm.spectrograms.morphology import greyscale_thinning_stack, greyscale_trimming_stack, DeltaStack, \
+            elementary_greyscale_sequential_thinning, elementary_greyscale_trimming
+
+        for seed, direction in enumerate(['h', 'v']):
+            x = spectrogram_image(5 + seed)
+            thinning = elementary_greyscale_sequential_thinning
+            cases = [(greyscale_thinning_stack(x, direction), thinning, None),
+                     (greyscale_thinning_stack(x, direction, max_iterations=3), thinning, 3),
+                     (greyscale_trimming_stack(x, None, direction), elementary_greyscale_trimming, None)]
+            for stack, step, max_iterations in cases:
+                case = '%s %s %s' % (step.__name__, direction, max_iterations)
+
+                # Frames of the elementary step iterated from the input, up to idempotence or the bound
+                expected = [x.numpy()]
+                while max_iterations is None or len(expected) < max_iterations:
+                    frame = step(torch.from_numpy(expected[-1]), direction).numpy()
+                    if np.array_equal(frame, expected[-1]):
+                        break
+                    expected.append(frame)
+                expected = np.stack(expected)
+                self.assertEqual(stack.shape, expected.shape, case)
+                self.assertGreater(len(stack), 1, case)
+
+                # Reads in any order, slices, pixel indexing and conversion to an array
+                for k in [len(stack) - 1, 0, 1, -1, -len(stack)]:
+                    self.assertTrue(np.array_equal(stack[k], expected[k]), case)
+                self.assertTrue(np.array_equal(stack[::-2], expected[::-2]), case)
+                self.assertTrue(np.array_equal(stack[1:, 3, 4:9], expected[1:, 3, 4:9]), case)
+                self.assertTrue(np.array_equal(stack[2, 3:, 4], expected[2, 3:, 4]), case)
+                self.assertTrue(np.array_equal(np.asarray(stack), expected), case)
+                self.assertTrue(np.array_equal(np.stack(list(stack)), expected), case)
+                with self.assertRaises(IndexError):
+                    stack[len(stack)]
+
+                copy = pickle.loads(pickle.dumps(stack))
+                self.assertTrue(np.array_equal(copy[:], expected), case)
+                with tempfile.TemporaryDirectory() as folder:
+                    stack.save(folder)
+                    loaded = DeltaStack.load(folder)
+                    self.assertTrue(np.array_equal(loaded[:], expected), case)
+                    self.assertEqual(loaded.nbytes, stack.nbytes, case)
+                    del loaded
+
+
+class TestFlat(unittest.TestCase):
+    def test_engines(self):
+        import torch
+        import nnMorpho.greyscale_operators as greyscale
+        from mmm.spectrograms.morphology import greyscale_flat
+
+        # Strips narrower than the image and than the widest rectangles, whose reach then spans several strips
+        x = spectrogram_image(4, shape=(40, 75))
+        for operation in ['erosion', 'dilation', 'opening', 'closing']:
+            for border in ['e', 'g']:
+                for shape in [(3, 5), (1, 21), (4, 6), (7, 1), (5, 30)]:
+                    str_el = torch.full(shape, 1., dtype=x.dtype)
+                    if operation == 'dilation':
+                        expected = greyscale.dilation(x, str_el)
+                    else:
+                        expected = getattr(greyscale, operation)(x, str_el, border=border)
+                    for tile_width, n_threads in [(1024, 1), (8, 3), (16, 2)]:
+                        case = '%s %s %s %d' % (operation, border, shape, tile_width)
+                        flat = greyscale_flat(operation, x, shape, 1., border, tile_width=tile_width,
+                                              n_threads=n_threads)
+                        self.assertTrue(torch.equal(flat, expected), case)
+
+
+class TestReconstruction(unittest.TestCase):
+    def test_engines(self):
+        import torch
+        from mmm.spectrograms.morphology import reconstruction_erosion, reconstruction_dilation
+
+        condition = spectrogram_image(2, shape=(60, 80))
+        bumps = torch.tensor(np.random.default_rng(3).exponential(10., size=condition.shape), dtype=torch.float32)
+        cases = [(reconstruction_erosion, condition + bumps), (reconstruction_erosion, None),
+                 (reconstruction_dilation, condition - bumps), (reconstruction_dilation, None)]
+        for operation, marker in cases:
+            converged = operation(marker, condition, engine='iterative')
+            for iterations in [None, 1, 2, 5]:
+                case = '%s %s %s' % (operation.__name__, marker is None, iterations)
+                expected = operation(marker, condition, iterations, engine='iterative')
+                queue = operation(marker, condition, iterations, engine='queue')
+                hybrid = operation(marker, condition, iterations, engine='hybrid')
+
+                self.assertTrue(torch.equal(queue, expected), case)
+                # The line scans of the hybrid engine always run to convergence
+                self.assertTrue(torch.equal(hybrid, converged), case)
@@ -0,0 +1,54 @@
+import tempfile
+import unittest
+
+
+class TestStreaming(unittest.TestCase):
+    def test_chunks(self):
+        import numpy as np
+        from pathlib import Path
+        from unittest import mock
+        from mmm.spectrograms import processing
+        from mmm.spectrograms.parameters import FS, TIME_RESOLUTION
+        from mmm.spectrograms.layers import create_stft_layer, apply_stft_layer
+        from mmm.spectrograms.procedures.morphological_pipeline import apply_morphology, \
+            apply_morphology_streaming, stream_halo
+
+        # Few iterations and short supports, so that the halo is small and the signal spans several chunks
+        patches = {'RECONSTRUCTION_EROSION_ITERATIONS': 4, 'VERTICAL_THINNING_ITERATIONS': 2,
+                   'HORIZONTAL_THINNING_ITERATIONS': 2, 'STREAM_RECONSTRUCTION_SUPPORT': 0.02,
+                   'MIN_LENGTH_SINUSOIDS': 0.02}
+        parameters = {'closing_time_width': 0.005, 'opening_time_width': 0.005}
+        components = {'input': True, 'noise': True, 'sinusoids': True, 'transient': True}
+        chunk_duration = 0.05
+
+        with mock.patch.multiple(processing, **patches), tempfile.TemporaryDirectory() as folder:
+            halo = stream_halo(components, parameters)
+            chunk_size = int(round(chunk_duration / TIME_RESOLUTION))
+            self.assertLess(halo, 100)
+
+            # Short tones over noise, longer than two halos and four chunks
+            rng = np.random.default_rng(0)
+            t = np.arange(int((2 * halo + 4 * chunk_size) * TIME_RESOLUTION * FS)) / FS
+            x = 0.01 * rng.normal(size=t.size)
+            for onset in np.arange(0., t[-1], 0.03):
+                x += np.where((t >= onset) & (t < onset + 0.015), np.sin(2 * np.pi * rng.uniform(200, 2000) * t), 0.)
+            x = x.astype(np.float32)
+
+            full = {'input': apply_stft_layer(x, create_stft_layer(n_fft=1024, win_length=512, iSTFT=False),
+                                              verbose=False)}
+            apply_morphology(full, {'arrays_folder': Path(folder) / 'full'}, {}, components, parameters,
+                             engine='sequential')
+            stream = {}
+            stft_layer = create_stft_layer(n_fft=1024, win_length=512, center=False, iSTFT=False)
+            apply_morphology_streaming(stream, x, {'arrays_folder': Path(folder)}, components, parameters,
+                                       stft_layer=stft_layer, chunk_duration=chunk_duration)
+
+            self.assertGreater(full['input'].shape[1], 2 * halo + chunk_size)
+            self.assertEqual(set(stream), set(full))
+            for name in full:
+                expected = full[name].cpu().numpy()
+                result = np.asarray(stream[name])
+                if name.endswith('_thin'):
+                    # Infinite dilations take the minimum of the whole image, which differs near its border
+                    expected, result = expected[3: -3, 3: -3], result[3: -3, 3: -3]
+                np.testing.assert_array_equal(result, expected, name)
@@ -0,0 +1,55 @@
+import unittest
+
+
+class TestSinusoids(unittest.TestCase):
+    def test_repeated_times(self):
+        import numpy as np
+        from mmm.spectrograms.parameters import TIME_RESOLUTION, FREQUENCY_PRECISION
+        from mmm.spectrograms.synthesis import synthesize_sinusoids
+
+        # Lines as get_lines finds them, with vertical steps of one bin inside a column, so with repeated times
+        rng = np.random.default_rng(0)
+        lines = []
+        for _ in range(20):
+            columns = []
+            bins = []
+            column = int(rng.integers(0, 500))
+            frequency_bin = int(rng.integers(50, 500))
+            for _ in range(int(rng.integers(100, 300))):
+                columns.append(column)
+                bins.append(frequency_bin)
+                if rng.random() < 0.1:
+                    frequency_bin += int(rng.choice([-1, 1]))
+                    columns.append(column)
+                    bins.append(frequency_bin)
+                column += 1
+            times = np.array(columns) * TIME_RESOLUTION
+            freqs = np.array(bins) * FREQUENCY_PRECISION
+            lines.append(np.stack((times, freqs, 0.01 + 0.001 * rng.random(times.size)), axis=1))
+
+        loop = synthesize_sinusoids(lines, verbose=False, engine='loop')
+        bank = synthesize_sinusoids(lines, verbose=False, engine='bank')
+        self.assertEqual(loop.shape, bank.shape)
+        self.assertLess(np.max(np.abs(bank - loop)), 1e-7 * np.max(np.abs(loop)))
+
+
+class TestTransient(unittest.TestCase):
+    def test_engines(self):
+        import numpy as np
+        from mmm.spectrograms.parameters import TIME_RESOLUTION, FREQUENCY_PRECISION
+        from mmm.spectrograms.synthesis import synthesize_transient
+
+        # Vertical lines as get_lines finds them, drifting by a column every twenty bins or so; the local engine
+        # leaves out the mirror image that the full engine keeps, which still overlaps the lines near the start
+        rng = np.random.default_rng(1)
+        duration = 2.
+        for onset, tolerance in [(0.01, 3e-2), (0.05, 5e-3), (0.3, 5e-4), (0.5, 2e-4), (1.2, 2e-4)]:
+            bins = np.arange(int(rng.integers(20, 100)), int(rng.integers(400, 1500)))
+            columns = np.round(onset / TIME_RESOLUTION) + np.cumsum(rng.random(bins.size) < 0.05)
+            line = np.stack((columns * TIME_RESOLUTION, bins * FREQUENCY_PRECISION,
+                             0.01 + 0.001 * rng.random(bins.size)), axis=1)
+
+            full = synthesize_transient([line], duration, verbose=False, engine='full')
+            local = synthesize_transient([line], duration, verbose=False, engine='local')
+            self.assertEqual(local.shape, full.shape)
+            self.assertLess(np.max(np.abs(local - full)), tolerance * np.max(np.abs(full)), onset)
@@ -0,0 +1,49 @@
+import unittest
+
+
+class TestTFST(unittest.TestCase):
+    def direct(self, layer, x):
+        # Correlation of the zero-padded signal with the complex kernels of each size, one column at a time
+        import numpy as np
+
+        kernels = layer.kernels.numpy().astype(np.complex128)
+        n_columns = x.size // layer.hop_length
+        output = np.zeros((layer.sizes.size, kernels.shape[0], n_columns), dtype=np.complex128)
+        for s, size in enumerate(layer.sizes):
+            start = np.sum(layer.sizes[:s])
+            padded = np.pad(x.astype(np.float64), (size // 2, size // 2))
+            for column in range(n_columns):
+                segment = padded[column * layer.hop_length: column * layer.hop_length + size]
+                output[s, :, column] = kernels[:, start: start + size] @ segment
+        return output
+
+    def test_engines(self):
+        import numpy as np
+        import torch
+        from mmm.spectrograms.tfst import TFST
+
+        # Signals longer and shorter than one hop, and sizes longer than the hop
+        rng = np.random.default_rng(0)
+        for n_samples in [1000, 50]:
+            x = rng.normal(size=n_samples).astype(np.float32)
+            for output_format in ['Magnitude', 'Complex']:
+                layers = {engine: TFST(fs=8000, time_resolution=0.01, sizes=(64, 128, 256), f_min=100, n_octaves=3,
+                                       bins_per_octave=4, output_format=output_format, device='cpu', engine=engine)
+                          for engine in ['auto', 'conv', 'fft']}
+                expected = self.direct(layers['conv'], x)
+                if output_format == 'Magnitude':
+                    expected = np.abs(expected)
+                else:
+                    expected = np.stack((expected.real, expected.imag))
+
+                for engine, layer in layers.items():
+                    case = '%d %s %s' % (n_samples, output_format, engine)
+                    output = layer(torch.tensor(x)).numpy()
+                    self.assertEqual(output.shape, expected.shape, case)
+                    self.assertLess(np.max(np.abs(output - expected), initial=0.), 1e-5 * np.max(expected, initial=1.),
+                                    case)
+
+                # Spectra only for the sizes the FFT engine ran on
+                self.assertEqual([kernels is None for kernels in layers['conv'].fft_kernels], [True] * 3)
+                self.assertEqual([kernels is None for kernels in layers['auto'].fft_kernels],
+                                 [engine == 'conv' for engine in layers['auto'].engines(n_samples)])